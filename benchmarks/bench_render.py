@@ -0,0 +1,44 @@
+"""Render reminder messages with and without the compiled template.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_render [count]
+"""
+from __future__ import annotations
+
+import sys
+import time
+from datetime import datetime, UTC
+
+from config import compile_template
+
+TEMPLATE = "Hi {user}, please review the mod queue in {guild}.\\nSent at {now_iso}"
+
+
+def render_per_call(count: int) -> float:
+    """The old path: timestamp, ``\\n`` fix-up and ``str.format`` per member."""
+    start = time.perf_counter()
+    for i in range(count):
+        now_iso = datetime.now(UTC).isoformat()
+        TEMPLATE.replace("\\n", "\n").format(guild="Guild", user=f"member{i}", now_iso=now_iso)
+    return time.perf_counter() - start
+
+
+def render_compiled(count: int) -> float:
+    start = time.perf_counter()
+    bound = compile_template(TEMPLATE).bind("Guild")
+    for i in range(count):
+        bound.render(f"member{i}")
+    return time.perf_counter() - start
+
+
+def main(count: int) -> None:
+    before = render_per_call(count)
+    after = render_compiled(count)
+    print(f"messages: {count}")
+    print(f"format per call: {count / before:12.0f} msg/s ({before:.3f}s)")
+    print(f"compiled:        {count / after:12.0f} msg/s ({after:.3f}s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
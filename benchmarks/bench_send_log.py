@@ -0,0 +1,68 @@
+"""Compare per-row ``send_log`` commits with the batched write-behind writer.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_send_log [rows]
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+from db import Database
+
+
+async def bench_commit_per_row(path: str, rows: int) -> float:
+    """The old behaviour: default journal mode, one INSERT + COMMIT per DM."""
+    conn = await aiosqlite.connect(path)
+    await conn.execute(
+        """CREATE TABLE send_log(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER,
+        user_id INTEGER,
+        status TEXT,
+        error TEXT,
+        sent_at TEXT
+    )"""
+    )
+    await conn.commit()
+    start = time.perf_counter()
+    for i in range(rows):
+        await conn.execute(
+            "INSERT INTO send_log(guild_id, user_id, status, error, sent_at) VALUES (?,?,?,?,datetime('now'))",
+            (1, i, "sent", None),
+        )
+        await conn.commit()
+    elapsed = time.perf_counter() - start
+    await conn.close()
+    return elapsed
+
+
+async def bench_write_behind(path: str, rows: int) -> float:
+    db = Database(path)
+    await db.connect()
+    start = time.perf_counter()
+    for i in range(rows):
+        await db.log_send(1, i, "sent", None)
+    await db.flush_send_log()
+    elapsed = time.perf_counter() - start
+    await db.close()
+    return elapsed
+
+
+async def main(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        before = await bench_commit_per_row(os.path.join(tmp, "before.db"), rows)
+        after = await bench_write_behind(os.path.join(tmp, "after.db"), rows)
+    print(f"rows: {rows}")
+    print(f"commit per row: {rows / before:10.0f} inserts/s ({before:.3f}s)")
+    print(f"write-behind:   {rows / after:10.0f} inserts/s ({after:.3f}s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,87 @@
+"""Staff lookups on large synthetic guilds: ``role.members`` scan vs ``StaffIndex``.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_staff_index [guild_size] [staff] [lookups]
+"""
+from __future__ import annotations
+
+import sys
+import time
+
+from staff_index import StaffIndex
+
+
+class Role:
+    def __init__(self, guild, role_id: int) -> None:
+        self.guild = guild
+        self.id = role_id
+
+    @property
+    def members(self):
+        # Like discord.py: a scan over the guild's whole member cache.
+        return [m for m in self.guild.members if self.id in m.role_ids]
+
+
+class Member:
+    def __init__(self, guild, member_id: int, role_ids) -> None:
+        self.guild = guild
+        self.id = member_id
+        self.bot = False
+        self.role_ids = set(role_ids)
+
+    def get_role(self, role_id: int):
+        return role_id if role_id in self.role_ids else None
+
+
+class Guild:
+    def __init__(self, guild_id: int, size: int, staff: int) -> None:
+        self.id = guild_id
+        self.role = Role(self, 1)
+        step = max(size // staff, 1)
+        self.members = [Member(self, i, [1] if i % step == 0 else []) for i in range(size)]
+        self._by_id = {m.id: m for m in self.members}
+
+    def get_role(self, role_id: int):
+        return self.role if role_id == 1 else None
+
+    def get_member(self, member_id: int):
+        return self._by_id.get(member_id)
+
+
+def main(size: int, staff: int, lookups: int) -> None:
+    guild = Guild(1, size, staff)
+
+    start = time.perf_counter()
+    for _ in range(lookups):
+        len([m for m in guild.role.members if not m.bot])
+    scan = time.perf_counter() - start
+
+    index = StaffIndex()
+    start = time.perf_counter()
+    index.count(guild, 1)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(lookups):
+        member = guild.members[i % size]
+        member.role_ids ^= {1}
+        index.on_member_update(member)
+        index.count(guild, 1)
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(lookups):
+        index.members(guild, 1)
+    iterate = time.perf_counter() - start
+
+    print(f"guild size: {size}, staff: {index.count(guild, 1)}, lookups: {lookups}")
+    print(f"role.members scan:        {scan / lookups * 1e6:10.1f} us/lookup")
+    print(f"index build (once):       {build * 1e3:10.1f} ms")
+    print(f"index update + count:     {indexed / lookups * 1e6:10.1f} us/lookup")
+    print(f"index member iteration:   {iterate / lookups * 1e6:10.1f} us/lookup")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [100_000, 200, 200][len(args):]))
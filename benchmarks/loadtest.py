@@ -0,0 +1,207 @@
+"""End-to-end load test of DMQueue and Scheduler against a fake Discord API.
+
+Every guild's run is started at once and driven on a virtual clock, so rate
+limit waits, retry_after sleeps and API latency cost no real time. Run from
+the repository root::
+
+    python -m benchmarks.loadtest --guilds 2000 --members 5
+    python -m benchmarks.loadtest --mode scheduler --rate-429 0.01 --forbidden 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import metrics
+from cache import GuildConfigCache
+from config import GuildConfig
+from db import Database
+from dispatcher import RunDispatcher
+from dm_queue import AdaptiveRateLimiter, DMQueue, RateLimiter
+from scheduler import Scheduler
+from tests.fake_discord import FakeClient, FakeDMChannel, FakeHTTP, VirtualClock, staff_guild, track_db_calls
+
+DB_OPS = ("send_log", "claim", "config")
+
+
+@dataclass
+class LoadTestResult:
+    mode: str
+    guilds: int
+    members: int
+    sent: int = 0
+    failed: int = 0
+    requests: int = 0
+    rate_limited: int = 0
+    forbidden: int = 0
+    channel_opens: int = 0
+    virtual_seconds: float = 0.0
+    real_seconds: float = 0.0
+    run_seconds: List[float] = field(default_factory=list)
+    db_writes: Dict[str, int] = field(default_factory=dict)
+    peak_memory: int = 0
+    final_rate: float = 0.0
+
+    def report(self) -> str:
+        runs = sorted(self.run_seconds) or [0.0]
+        p95 = runs[min(len(runs) - 1, int(len(runs) * 0.95))]
+        total = self.sent + self.failed
+        lines = [
+            f"mode: {self.mode}, guilds: {self.guilds}, members/guild: {self.members}",
+            f"recipients: {total} ({self.sent} sent, {self.failed} failed)",
+            f"API requests: {self.requests} ({self.rate_limited} 429s, {self.forbidden} 403s)"
+            f" + {self.channel_opens} DM channel opens",
+            f"throughput: {total / self.virtual_seconds if self.virtual_seconds else 0:.3f} DMs/s (virtual)",
+            f"run wall time: p50 {statistics.median(runs):.1f}s, p95 {p95:.1f}s, max {runs[-1]:.1f}s (virtual)",
+            f"total: {self.virtual_seconds:.1f}s virtual, {self.real_seconds:.2f}s real",
+            f"send rate at the end: {self.final_rate:.2f}/s allowed",
+            "DB writes: " + ", ".join(f"{op} {n}" for op, n in self.db_writes.items()),
+            f"memory high-water: {self.peak_memory / 1024 / 1024:.1f} MiB",
+        ]
+        return "\n".join(lines)
+
+
+class FakeBot:
+    def __init__(self, guilds) -> None:
+        self._guilds = {g.id: g for g in guilds}
+
+    def get_guild(self, guild_id: int):
+        return self._guilds.get(guild_id)
+
+
+async def run_load_test(
+    db_path: str,
+    guilds: int = 100,
+    members: int = 10,
+    mode: str = "send",
+    interval: float = 2.0,
+    warm_channels: bool = False,
+    adaptive: bool = False,
+    **http_options,
+) -> LoadTestResult:
+    """Drive one concurrent run per guild; ``http_options`` go to ``FakeHTTP``.
+
+    With ``warm_channels`` every member's DM channel is already known, as
+    after a restart that loaded the saved channel ids. With ``adaptive`` the
+    send spacing starts at ``interval`` and adapts to 429s.
+    """
+    clock = VirtualClock()
+    real_sleep = asyncio.sleep
+    asyncio.sleep = clock.sleep
+    try:
+        http = FakeHTTP(clock, record=False, **http_options)
+        fake_guilds = [staff_guild(i + 1, members, http=http) for i in range(guilds)]
+        db = Database(db_path)
+        await db.connect()
+        track_db_calls(db, clock)
+        try:
+            configs = GuildConfigCache(db, max_size=guilds)
+            cron = "0 9 * * *" if mode == "scheduler" else None
+            await db.bulk_upsert_guild_configs(
+                GuildConfig(guild_id=g.id, staff_role_id=100, schedule_cron=cron) for g in fake_guilds
+            )
+            configs.prime(await db.get_guild_configs(g.id for g in fake_guilds))
+            limiter = AdaptiveRateLimiter(interval, clock.time) if adaptive else RateLimiter(interval, clock.time)
+            queue = DMQueue(db, limiter, client=FakeClient(fake_guilds))
+            if warm_channels:
+                for guild in fake_guilds:
+                    for member in guild._members.values():
+                        member.dm_channel = FakeDMChannel(member.id + 1, member)
+                        queue.dm_channels[member.id] = member.dm_channel.id
+            scheduler = Scheduler(FakeBot(fake_guilds), db, RunDispatcher(queue, configs), time_func=clock.time)
+            result = LoadTestResult(mode, guilds, members)
+            writes_before = {op: metrics.DB_WRITE.count(op=op) for op in DB_OPS}
+
+            run_job = scheduler._run_job
+            by_id = {g.id: g for g in fake_guilds}
+
+            async def one_run(guild_id: int) -> None:
+                start = clock.time()
+                if mode == "scheduler":
+                    await run_job(guild_id)
+                else:
+                    await queue.send(by_id[guild_id], await configs.get_guild_config(guild_id))
+                result.run_seconds.append(clock.time() - start)
+
+            tracemalloc.start()
+            real_start = time.perf_counter()
+            if mode == "scheduler":
+                # Every guild is due now and fired by one tick of the timer loop.
+                scheduler._run_job = one_run
+                await db.set_next_fires((g.id, clock.time()) for g in fake_guilds)
+                await scheduler.tick()
+                await asyncio.gather(*scheduler._runs)
+            else:
+                await asyncio.gather(*(one_run(g.id) for g in fake_guilds))
+            result.real_seconds = time.perf_counter() - real_start
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+            result.final_rate = limiter.rate
+            tracemalloc.stop()
+
+            await db.flush_send_log()
+            async with db.conn.execute("SELECT status, COUNT(*) FROM send_log GROUP BY status") as cur:
+                counts = dict(await cur.fetchall())
+        finally:
+            await db.close()
+    finally:
+        asyncio.sleep = real_sleep
+    result.sent = counts.get("sent", 0)
+    result.failed = counts.get("failed", 0)
+    result.requests = http.request_count + http.rate_limited
+    result.rate_limited = http.rate_limited
+    result.forbidden = http.forbidden
+    result.channel_opens = http.channel_opens
+    result.virtual_seconds = clock.time()
+    result.db_writes = {op: metrics.DB_WRITE.count(op=op) - writes_before[op] for op in DB_OPS}
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--mode", choices=("send", "scheduler"), default="send")
+    parser.add_argument("--interval", type=float, default=2.0, help="RateLimiter min interval")
+    parser.add_argument("--limit", type=int, default=5, help="fake bucket size")
+    parser.add_argument("--window", type=float, default=5.0, help="fake bucket window (s)")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API latency (s)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument(
+        "--retry-after", type=float, default=1.0, help="seconds an injected 429 lasts; above 30 it reaches the bot"
+    )
+    parser.add_argument("--forbidden", type=float, default=0.0, help="share of users with DMs closed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm-channels", action="store_true", help="start with every DM channel id known")
+    parser.add_argument("--adaptive", action="store_true", help="adapt the send spacing to 429s")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(
+            run_load_test(
+                os.path.join(tmp, "loadtest.db"),
+                guilds=args.guilds,
+                members=args.members,
+                mode=args.mode,
+                interval=args.interval,
+                warm_channels=args.warm_channels,
+                adaptive=args.adaptive,
+                limit=args.limit,
+                window=args.window,
+                latency=args.latency,
+                rate_429=args.rate_429,
+                retry_after=args.retry_after,
+                forbidden_rate=args.forbidden,
+                seed=args.seed,
+            )
+        )
+    print(result.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Soak test: days of cron runs against a fake Discord API, checking memory stays bounded.
+
+Every guild has a daily cron. The scheduler's timer loop fires them on a
+virtual clock, so each simulated day costs seconds of real time; the
+database's timestamps follow that clock too. After each day the send
+history past the retention and expired undeliverable marks are removed as
+the daily maintenance does, and a tracemalloc snapshot is taken. Growth is measured
+from the end of the warm-up days. Run from the repository root::
+
+    python -m benchmarks.soak --days 14 --guilds 20 --members 10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, UTC
+from typing import Dict, List, Tuple
+
+import db as db_module
+import memory
+from benchmarks.loadtest import FakeBot
+from cache import GuildConfigCache
+from config import GuildConfig
+from db import Database
+from dispatcher import RunDispatcher
+from dm_queue import AdaptiveRateLimiter, DMQueue
+from scheduler import Scheduler
+from staff_index import StaffIndex
+from tests.fake_discord import FakeClient, FakeHTTP, VirtualClock, staff_guild, track_db_calls
+
+# Virtual wall-clock time at the start of the soak.
+EPOCH = datetime(2024, 1, 1, tzinfo=UTC).timestamp()
+
+
+@dataclass
+class SoakDay:
+    day: int
+    sent: int
+    traced: int
+    send_log_rows: int
+    caches: Dict[str, int]
+
+
+@dataclass
+class SoakResult:
+    guilds: int
+    members: int
+    warmup: int
+    days: List[SoakDay] = field(default_factory=list)
+    growth: List[Tuple[str, int, int]] = field(default_factory=list)
+    real_seconds: float = 0.0
+
+    @property
+    def traced_growth(self) -> int:
+        """Bytes traced at the end minus at the end of the warm-up."""
+        return self.days[-1].traced - self.days[self.warmup - 1].traced
+
+    def report(self) -> str:
+        lines = [f"guilds: {self.guilds}, members/guild: {self.members}, days: {len(self.days)}"]
+        for d in self.days:
+            caches = ", ".join(f"{name} {size}" for name, size in d.caches.items())
+            lines.append(
+                f"day {d.day}: {d.sent} sent, traced {d.traced / 1024 / 1024:.2f} MiB,"
+                f" send_log {d.send_log_rows} rows; {caches}"
+            )
+        lines.append(f"traced growth after warm-up: {self.traced_growth / 1024:.0f} KiB")
+        lines += [f"  {size / 1024:+.0f} KiB ({count:+d} blocks) {where}" for where, size, count in self.growth]
+        lines.append(f"real time: {self.real_seconds:.1f}s")
+        return "\n".join(lines)
+
+
+async def run_soak(
+    db_path: str,
+    days: int = 14,
+    guilds: int = 20,
+    members: int = 10,
+    warmup: int = 2,
+    retention_days: int = 3,
+    interval: float = 0.5,
+    **http_options,
+) -> SoakResult:
+    """Drive ``days`` daily cron runs per guild; ``http_options`` go to ``FakeHTTP``."""
+    clock = VirtualClock()
+
+    def now() -> datetime:
+        return datetime.fromtimestamp(EPOCH + clock.time(), UTC)
+
+    real_sleep, real_sqlite_now = asyncio.sleep, db_module.sqlite_now
+    asyncio.sleep = clock.sleep
+    db_module.sqlite_now = lambda: now().strftime("%Y-%m-%d %H:%M:%S")
+    result = SoakResult(guilds, members, warmup)
+    try:
+        http = FakeHTTP(clock, record=False, **http_options)
+        fake_guilds = [staff_guild(i + 1, members, http=http) for i in range(guilds)]
+        db = Database(db_path)
+        await db.connect()
+        track_db_calls(db, clock)
+        try:
+            configs = GuildConfigCache(db)
+            await db.bulk_upsert_guild_configs(
+                GuildConfig(guild_id=g.id, staff_role_id=100, schedule_cron="0 9 * * *") for g in fake_guilds
+            )
+            staff = StaffIndex()
+            queue = DMQueue(db, AdaptiveRateLimiter(interval, clock.time), staff=staff, client=FakeClient(fake_guilds))
+            dispatcher = RunDispatcher(queue, configs, time_func=clock.time)
+            # One owner renews its own leases, whatever the real time.
+            scheduler = Scheduler(
+                FakeBot(fake_guilds), db, dispatcher, timezone=UTC, time_func=lambda: EPOCH + clock.time()
+            )
+            await scheduler._schedule_missing()
+            baseline = None
+            tracemalloc.start()
+            real_start = time.perf_counter()
+            for day in range(1, days + 1):
+                next_at = await db.next_fire_at()
+                await asyncio.sleep(next_at - scheduler.time_func())
+                await scheduler.tick()
+                await asyncio.gather(*scheduler._runs)
+                await db.compact_send_log((now() - timedelta(days=retention_days)).strftime("%Y-%m-%d"))
+                await db.purge_undeliverable()
+                async with db.conn.execute("SELECT COUNT(*) FROM send_log") as cur:
+                    (rows,) = await cur.fetchone()
+                sent = sum(1 for g in fake_guilds for m in g._members.values() for _ in m.received)
+                gc.collect()
+                snapshot = memory.take_snapshot()
+                if day == warmup:
+                    baseline = snapshot
+                result.days.append(
+                    SoakDay(
+                        day,
+                        sent,
+                        tracemalloc.get_traced_memory()[0],
+                        rows,
+                        memory.cache_sizes(configs, staff, queue, dispatcher),
+                    )
+                )
+                # Received messages are the fake API's record, not the bot's.
+                for g in fake_guilds:
+                    for m in g._members.values():
+                        m.received.clear()
+            result.real_seconds = time.perf_counter() - real_start
+            if baseline is not None:
+                result.growth = memory.top_allocations(snapshot, 10, baseline)
+            tracemalloc.stop()
+        finally:
+            scheduler.shutdown()
+            await db.close()
+    finally:
+        asyncio.sleep, db_module.sqlite_now = real_sleep, real_sqlite_now
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2, help="days before growth is measured")
+    parser.add_argument("--retention-days", type=int, default=3, help="days of send_log kept")
+    parser.add_argument("--interval", type=float, default=0.5, help="initial seconds between DMs")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API latency (s)")
+    parser.add_argument("--forbidden", type=float, default=0.0, help="share of users with DMs closed")
+    parser.add_argument("--max-growth-kib", type=float, help="exit with status 1 above this traced growth")
+    args = parser.parse_args(argv)
+    if not 1 <= args.warmup < args.days:
+        parser.error("--warmup must be at least 1 and below --days")
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(
+            run_soak(
+                os.path.join(tmp, "soak.db"),
+                days=args.days,
+                guilds=args.guilds,
+                members=args.members,
+                warmup=args.warmup,
+                retention_days=args.retention_days,
+                interval=args.interval,
+                latency=args.latency,
+                forbidden_rate=args.forbidden,
+            )
+        )
+    print(result.report())
+    if args.max_growth_kib is not None and result.traced_growth > args.max_growth_kib * 1024:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
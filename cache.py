@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Dict, Iterable
+
+from config import GuildConfig, TemplateError
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class GuildConfigCache:
+    """Bounded LRU cache of ``GuildConfig`` objects in front of the storage.
+
+    Reads are served from memory after the first load. Updates are written
+    through to the database before the cached copy is replaced, so the cache
+    never holds a value the database does not. In a sharded deployment a
+    guild's commands and events all reach the process owning its shard, so
+    that process's cache stays authoritative for the guild.
+    """
+
+    def __init__(self, db: Storage, max_size: int = 1024) -> None:
+        self.db = db
+        self.max_size = max_size
+        self._configs: OrderedDict[int, GuildConfig] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._configs)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._configs
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _store(self, cfg: GuildConfig) -> None:
+        try:
+            # Compile once on load rather than on first send.
+            cfg.validate()
+        except TemplateError as e:
+            logger.warning("Guild %s has an invalid reminder message: %s", cfg.guild_id, e)
+        self._configs[cfg.guild_id] = cfg
+        self._configs.move_to_end(cfg.guild_id)
+        while len(self._configs) > self.max_size:
+            self._configs.popitem(last=False)
+
+    async def get_guild_config(self, guild_id: int) -> GuildConfig:
+        cfg = self._configs.get(guild_id)
+        if cfg is not None:
+            self.hits += 1
+            self._configs.move_to_end(guild_id)
+            return cfg
+        self.misses += 1
+        cfg = await self.db.get_guild_config(guild_id)
+        self._store(cfg)
+        return cfg
+
+    async def get_guild_configs(self, guild_ids: Iterable[int]) -> Dict[int, GuildConfig]:
+        """Configs of ``guild_ids``; those not cached are loaded in one query.
+
+        Guilds without a stored config are left out.
+        """
+        found: Dict[int, GuildConfig] = {}
+        missing = []
+        for guild_id in guild_ids:
+            cfg = self._configs.get(guild_id)
+            if cfg is None:
+                missing.append(guild_id)
+            else:
+                found[guild_id] = cfg
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            for cfg in await self.db.get_guild_configs(missing):
+                self._store(cfg)
+                found[cfg.guild_id] = cfg
+        return found
+
+    async def update_guild_config(self, guild_id: int, **fields) -> GuildConfig:
+        cfg = replace(await self.get_guild_config(guild_id), **fields)
+        await self.db.upsert_guild_config(cfg)
+        self._store(cfg)
+        return cfg
+
+    def prime(self, configs: Iterable[GuildConfig]) -> None:
+        """Store configs loaded in bulk, e.g. at startup."""
+        for cfg in configs:
+            self._store(cfg)
+
+    def evict(self, guild_id: int) -> None:
+        self._configs.pop(guild_id, None)
+
+    def clear(self) -> None:
+        self._configs.clear()
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import string
+from dataclasses import dataclass, field
 from datetime import datetime, UTC
-from typing import Optional
+from functools import lru_cache
+from typing import List, Literal, Optional, Tuple
 
 from pydantic import BaseSettings
 
 DEFAULT_MESSAGE = "Please review mod queue and tickets."
+PLACEHOLDERS = ("guild", "user", "now_iso")
+
+
+class TemplateError(ValueError):
+    """Raised when a reminder template cannot be parsed."""
 
 
 class EnvConfig(BaseSettings):
@@ -18,6 +25,44 @@ class EnvConfig(BaseSettings):
 
     token: str | None = None
     manager_role_id: int | None = None
+    # Spread guilds sharing a cron expression over this many seconds.
+    schedule_spread_seconds: float = 0.0
+    # A cron run firing later than this (seconds) after its time, as after
+    # downtime, is run once ("once") or dropped ("skip").
+    schedule_misfire_grace: int = 300
+    schedule_catch_up: Literal["once", "skip"] = "once"
+    # Seconds between DMs. The spacing widens on 429s that reach the bot and
+    # narrows again after, but never below send_interval_min; unset, that is
+    # send_interval, so speeding up past it has to be opted into.
+    send_interval: float = 2.0
+    send_interval_min: float | None = None
+    # 429s asking to wait longer than this (seconds, at least 30) are raised
+    # by discord.py instead of slept through, and pause the DM queue instead.
+    rate_limit_timeout: float = 30.0
+    # A new run is refused this long after the last complete one.
+    min_run_gap_minutes: float = 5.0
+    db_path: str = "bot.db"
+    # Read-only connections next to the single writer.
+    db_readers: int = 2
+    # Shards run by this process, e.g. SHARD_COUNT=4 and SHARD_IDS=[0,1];
+    # unset runs every shard Discord recommends in one process.
+    shard_count: int | None = None
+    shard_ids: List[int] | None = None
+    # Serve Prometheus metrics at http://metrics_host:metrics_port/metrics.
+    metrics_port: int | None = None
+    metrics_host: str = "127.0.0.1"
+    # Keep per-recipient send history this many days; 0 keeps it forever.
+    send_log_retention_days: int = 90
+    # Skip members whose DMs failed permanently (closed DMs) for this many days.
+    undeliverable_ttl_days: float = 7.0
+    # "all" lets discord.py cache every guild member; "staff" caches none and
+    # keeps only staff role holders, loaded from the gateway for each run.
+    member_cache: Literal["all", "staff"] = "all"
+    # Trace allocations (this many frames each) for /staff debug memory;
+    # 0 leaves tracemalloc off.
+    tracemalloc_frames: int = 0
+    # Register the /staff debug commands.
+    debug_commands: bool = False
 
     class Config:
         env_file = ".env"
@@ -31,9 +76,88 @@ class GuildConfig:
     schedule_cron: Optional[str] = None
     last_sent_at: Optional[str] = None  # ISO timestamp
     log_channel_id: Optional[int] = None
+    _template: Optional[MessageTemplate] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def template(self) -> MessageTemplate:
+        """The compiled ``reminder_message``, recompiled only when it changes."""
+        return self.validate()
+
+    def validate(self) -> MessageTemplate:
+        """Compile ``reminder_message`` if it changed; raises ``TemplateError`` if invalid."""
+        if self._template is None or self._template.source != self.reminder_message:
+            self._template = compile_template(self.reminder_message)
+        return self._template
+
+
+class BoundTemplate:
+    """A template with ``{guild}`` and ``{now_iso}`` resolved; only ``{user}`` varies."""
+
+    __slots__ = ("_chunks",)
+
+    def __init__(self, chunks: Tuple[str, ...]) -> None:
+        self._chunks = chunks
+
+    def render(self, user: str) -> str:
+        return user.join(self._chunks)
+
+
+class MessageTemplate:
+    """A reminder template parsed and validated once.
+
+    Literal ``\\n`` sequences are turned into newlines, and only the
+    ``PLACEHOLDERS`` are accepted, without format specs or conversions.
+    """
+
+    __slots__ = ("source", "_parts")
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        text = source.replace("\\n", "\n")
+        parts: List[Tuple[str, Optional[str]]] = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}") from None
+        for literal, name, spec, conversion in parsed:
+            if name is None:
+                parts.append((literal, None))
+                continue
+            if name not in PLACEHOLDERS:
+                allowed = ", ".join("{%s}" % p for p in PLACEHOLDERS)
+                raise TemplateError(f"Unknown placeholder {{{name}}}; use {allowed}")
+            if spec or conversion:
+                raise TemplateError(f"Placeholder {{{name}}} does not take a format spec")
+            parts.append((literal, name))
+        self._parts = tuple(parts)
+
+    def bind(self, guild: str, now_iso: str | None = None) -> BoundTemplate:
+        """Resolve the per-run placeholders once for a whole run."""
+        if now_iso is None:
+            now_iso = datetime.now(UTC).isoformat()
+        values = {"guild": guild, "now_iso": now_iso}
+        chunks: List[str] = []
+        current: List[str] = []
+        for literal, name in self._parts:
+            current.append(literal)
+            if name == "user":
+                chunks.append("".join(current))
+                current = []
+            elif name is not None:
+                current.append(values[name])
+        chunks.append("".join(current))
+        return BoundTemplate(tuple(chunks))
+
+    def render(self, guild: str, user: str, now_iso: str | None = None) -> str:
+        return self.bind(guild, now_iso).render(user)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> MessageTemplate:
+    """Parse ``source``; raises ``TemplateError`` for invalid templates."""
+    return MessageTemplate(source)
 
 
 def render_message(template: str, guild: str, user: str) -> str:
     """Render placeholders for guild, user and current ISO time."""
-    now_iso = datetime.now(UTC).isoformat()
-    return template.format(guild=guild, user=user, now_iso=now_iso)
+    return compile_template(template).render(guild, user)
@@ -1,19 +1,237 @@
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta, UTC
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 
 import aiosqlite
 
+import metrics
 from config import GuildConfig, DEFAULT_MESSAGE
 
 
+# Applied on every connection. WAL lets readers proceed while a write is in
+# progress and, with synchronous=NORMAL, turns most commits into a WAL append
+# instead of a full fsync.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+CONFIG_COLUMNS = "guild_id, staff_role_id, reminder_message, schedule_cron, last_sent_at, log_channel_id"
+UPSERT_CONFIG = """INSERT INTO guild_config(guild_id, staff_role_id, reminder_message, schedule_cron, last_sent_at, log_channel_id)
+VALUES(?,?,?,?,?,?)
+ON CONFLICT(guild_id) DO UPDATE SET
+    staff_role_id=excluded.staff_role_id,
+    reminder_message=excluded.reminder_message,
+    schedule_cron=excluded.schedule_cron,
+    last_sent_at=excluded.last_sent_at,
+    log_channel_id=excluded.log_channel_id
+"""
+# Restricts a query to the guilds of some shards, as discord.py assigns them.
+SHARD_FILTER = "((guild_id >> 22) % ?) IN (SELECT value FROM json_each(?))"
+# Prepared statements kept per connection. Every query uses fixed SQL text
+# (id lists go through json_each), so each is compiled once per connection.
+CACHED_STATEMENTS = 256
+
+
+def _config_params(cfg: GuildConfig) -> Tuple:
+    return (
+        cfg.guild_id,
+        cfg.staff_role_id,
+        cfg.reminder_message,
+        cfg.schedule_cron,
+        cfg.last_sent_at,
+        cfg.log_channel_id,
+    )
+
+
+def _config_from_row(row) -> GuildConfig:
+    return GuildConfig(
+        guild_id=row[0],
+        staff_role_id=row[1],
+        reminder_message=row[2] or DEFAULT_MESSAGE,
+        schedule_cron=row[3],
+        last_sent_at=row[4],
+        log_channel_id=row[5],
+    )
+
+
+def sqlite_now() -> str:
+    """Current UTC time in the format produced by SQLite's ``datetime('now')``."""
+    return datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def sqlite_time(iso: str) -> str:
+    """Convert an ISO 8601 timestamp to the format of ``sqlite_now``."""
+    when = datetime.fromisoformat(iso)
+    if when.tzinfo is not None:
+        when = when.astimezone(UTC)
+    return when.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def days_ago(days: int) -> str:
+    """The UTC day ``days`` before today as ``YYYY-MM-DD``."""
+    return (datetime.now(UTC) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+class SendLogWriter:
+    """Write-behind buffer for ``send_log`` rows.
+
+    Rows are kept in memory and written with a single ``executemany`` in one
+    transaction once ``max_rows`` are pending or the oldest pending row is
+    ``max_delay`` seconds old. ``flush`` writes whatever is pending right away.
+    The same transaction adds the rows to the per-day and per-run counters.
+    """
+
+    def __init__(self, db: "Database", max_rows: int = 50, max_delay: float = 5.0) -> None:
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows: List[Tuple] = []
+        # user_id -> DM channel id learned since the last flush
+        self._channels: Dict[int, int] = {}
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.Task | None = None
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def add(
+        self, guild_id: int, user_id: int, status: str, error: Optional[str], run_id: Optional[int] = None
+    ) -> None:
+        self._rows.append((guild_id, user_id, status, error, sqlite_now(), run_id))
+        if len(self._rows) >= self.max_rows:
+            try:
+                await self.flush()
+            except Exception:
+                # A failed write must not abort the run logging the row; the
+                # rows stay queued and the timer retries them.
+                self.logger.exception("send_log flush of %d rows failed", len(self._rows))
+        if self._rows and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def add_dm_channel(self, user_id: int, channel_id: int) -> None:
+        """Queue a DM channel id; it is saved with the next batch."""
+        self._channels[user_id] = channel_id
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            # Nobody awaits this task; the rows stay queued for the next flush.
+            self.logger.exception("Timed send_log flush of %d rows failed", len(self._rows))
+
+    async def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            channels, self._channels = self._channels, {}
+            if not rows and not channels:
+                return
+            conn = self.db.conn
+            assert conn is not None
+            async with self.db.write_lock:
+                try:
+                    with metrics.DB_WRITE.time(op="send_log"):
+                        await self._write(conn, rows, channels)
+                except Exception:
+                    # Undo the statements that did run, or the retry (or any
+                    # other commit on conn) would write them a second time.
+                    await conn.rollback()
+                    # Keep the rows so the next flush retries them.
+                    self._rows[:0] = rows
+                    self._channels = {**channels, **self._channels}
+                    raise
+
+    async def _write(self, conn: aiosqlite.Connection, rows: List[Tuple], channels: Dict[int, int]) -> None:
+        await conn.executemany(
+            "INSERT INTO send_log(guild_id, user_id, status, error, sent_at, run_id) VALUES (?,?,?,?,?,?)",
+            rows,
+        )
+        await conn.executemany(
+            "UPDATE dm_job SET status=?, error=? WHERE run_id=? AND user_id=?",
+            [(r[2], r[3], r[5], r[1]) for r in rows if r[5] is not None],
+        )
+        daily: Dict[Tuple[int, str], List[int]] = {}
+        runs: Dict[int, List[int]] = {}
+        for guild_id, _, status, _, sent_at, run_id in rows:
+            i = 0 if status == "sent" else 1
+            daily.setdefault((guild_id, sent_at[:10]), [0, 0])[i] += 1
+            if run_id is not None:
+                runs.setdefault(run_id, [0, 0])[i] += 1
+        await conn.executemany(
+            """INSERT INTO send_stats_daily(guild_id, day, sent, failed) VALUES (?,?,?,?)
+            ON CONFLICT(guild_id, day) DO UPDATE SET
+                sent=sent+excluded.sent,
+                failed=failed+excluded.failed
+            """,
+            [(guild_id, day, sent, failed) for (guild_id, day), (sent, failed) in daily.items()],
+        )
+        await conn.executemany(
+            "UPDATE dm_run SET sent=sent+?, failed=failed+? WHERE id=?",
+            [(sent, failed, run_id) for run_id, (sent, failed) in runs.items()],
+        )
+        await conn.executemany(
+            """INSERT INTO member_last_sent(guild_id, user_id, sent_at) VALUES (?,?,?)
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET sent_at=max(sent_at, excluded.sent_at)
+            """,
+            [(r[0], r[1], r[4]) for r in rows if r[2] == "sent"],
+        )
+        await conn.executemany(
+            "INSERT OR REPLACE INTO dm_channel(user_id, channel_id) VALUES (?, ?)",
+            list(channels.items()),
+        )
+        await conn.commit()
+
+
 class Database:
-    def __init__(self, path: str = "bot.db") -> None:
+    """SQLite implementation of ``storage.Storage``.
+
+    Several bot processes may open the same file: WAL mode and
+    ``busy_timeout`` serialize their writes, and ``write_lock`` does the same
+    for the tasks of one process.
+
+    ``conn`` is the only connection that writes. Reads go to a pool of
+    ``readers`` read-only connections, each with its own thread, so commands
+    are not queued behind send-log inserts; WAL lets them read while a write
+    is in progress. A reader with a statement still open reads from the
+    snapshot that statement started with, so run state that callers read
+    right after writing it (a new run's jobs, its counts) is read on
+    ``conn``. An in-memory database cannot be shared between connections, so
+    there every query uses ``conn``.
+    """
+
+    def __init__(self, path: str = "bot.db", readers: int = 2) -> None:
         self.path = path
+        self.readers = 0 if path == ":memory:" else readers
         self.conn: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._next_reader = 0
+        # Held for every write transaction so the statements and commits of
+        # concurrent callers never interleave on the shared connection.
+        self.write_lock = asyncio.Lock()
+        self.send_log = SendLogWriter(self)
+
+    async def _open(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return conn
 
     async def connect(self) -> None:
-        self.conn = await aiosqlite.connect(self.path)
+        self.conn = await self._open()
         await self.conn.execute(
             """CREATE TABLE IF NOT EXISTS guild_config(
             guild_id INTEGER PRIMARY KEY,
@@ -34,57 +252,198 @@ class Database:
             sent_at TEXT
         )"""
         )
+        await self._add_column("send_log", "run_id", "INTEGER")
         await self.conn.execute(
             "CREATE INDEX IF NOT EXISTS idx_send_log_guild_status ON send_log(guild_id, status)"
         )
+        # Exports read one guild's rows in time order without sorting them.
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_send_log_guild_sent ON send_log(guild_id, sent_at)"
+        )
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS dm_run(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            status TEXT CHECK(status IN ('running','done','cancelled')),
+            created_at TEXT,
+            finished_at TEXT,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0
+        )"""
+        )
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS dm_job(
+            run_id INTEGER,
+            user_id INTEGER,
+            status TEXT CHECK(status IN ('pending','sending','sent','failed')),
+            error TEXT,
+            PRIMARY KEY(run_id, user_id)
+        )"""
+        )
+        if await self._add_column("dm_run", "sent", "INTEGER NOT NULL DEFAULT 0"):
+            await self._add_column("dm_run", "failed", "INTEGER NOT NULL DEFAULT 0")
+            await self.conn.execute(
+                """UPDATE dm_run SET
+                sent=(SELECT COUNT(*) FROM dm_job WHERE run_id=dm_run.id AND status='sent'),
+                failed=(SELECT COUNT(*) FROM dm_job WHERE run_id=dm_run.id AND status='failed')"""
+            )
+        await self._add_column("dm_run", "skipped", "INTEGER NOT NULL DEFAULT 0")
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_dm_run_status ON dm_run(status)"
+        )
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_dm_run_guild ON dm_run(guild_id, id)"
+        )
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS undeliverable(
+            guild_id INTEGER,
+            user_id INTEGER,
+            code INTEGER,
+            reason TEXT,
+            marked_at TEXT,
+            expires_at TEXT,
+            PRIMARY KEY(guild_id, user_id)
+        ) WITHOUT ROWID"""
+        )
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS dm_channel(
+            user_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL
+        )"""
+        )
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS lease(
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )"""
+        )
+        await self.conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS guild_schedule(
+            guild_id INTEGER PRIMARY KEY,
+            next_fire_at REAL NOT NULL
+        )"""
+        )
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_guild_schedule_next ON guild_schedule(next_fire_at)"
+        )
+        if not await self._table_exists("member_last_sent"):
+            await self.conn.execute(
+                """CREATE TABLE member_last_sent(
+                guild_id INTEGER,
+                user_id INTEGER,
+                sent_at TEXT,
+                PRIMARY KEY(guild_id, user_id)
+            ) WITHOUT ROWID"""
+            )
+            await self.conn.execute(
+                """INSERT INTO member_last_sent(guild_id, user_id, sent_at)
+                SELECT guild_id, user_id, MAX(sent_at) FROM send_log
+                WHERE status='sent' GROUP BY guild_id, user_id"""
+            )
+        new_stats = not await self._table_exists("send_stats_daily")
+        await self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS send_stats_daily(
+            guild_id INTEGER,
+            day TEXT,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(guild_id, day)
+        ) WITHOUT ROWID"""
+        )
+        if new_stats:
+            # Roll up the history logged before the counters existed.
+            await self.conn.execute(
+                """INSERT INTO send_stats_daily(guild_id, day, sent, failed)
+                SELECT guild_id, substr(sent_at, 1, 10), SUM(status='sent'), SUM(status='failed')
+                FROM send_log GROUP BY guild_id, substr(sent_at, 1, 10)"""
+            )
         await self.conn.commit()
+        for _ in range(self.readers):
+            reader = await self._open()
+            await reader.execute("PRAGMA query_only=ON")
+            self._readers.append(reader)
+
+    @property
+    def connections(self) -> List[aiosqlite.Connection]:
+        return ([self.conn] if self.conn else []) + self._readers
+
+    def _reader(self) -> aiosqlite.Connection:
+        """Next read-only connection, or the writer if there is no pool."""
+        assert self.conn is not None
+        if not self._readers:
+            return self.conn
+        self._next_reader = (self._next_reader + 1) % len(self._readers)
+        return self._readers[self._next_reader]
+
+    async def _table_exists(self, table: str) -> bool:
+        assert self.conn is not None
+        async with self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+        ) as cur:
+            return await cur.fetchone() is not None
+
+    async def _add_column(self, table: str, column: str, decl: str) -> bool:
+        """Add ``column`` to an existing ``table`` created by an older version.
+
+        Returns whether the column was added.
+        """
+        assert self.conn is not None
+        async with self.conn.execute(f"PRAGMA table_info({table})") as cur:
+            columns = {row[1] for row in await cur.fetchall()}
+        if column in columns:
+            return False
+        await self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
 
     async def close(self) -> None:
         if self.conn:
+            await self.send_log.flush()
+            for reader in self._readers:
+                await reader.close()
+            self._readers = []
             await self.conn.close()
+            self.conn = None
 
     async def get_guild_config(self, guild_id: int) -> GuildConfig:
-        assert self.conn is not None
-        async with self.conn.execute(
-            "SELECT staff_role_id, reminder_message, schedule_cron, last_sent_at, log_channel_id FROM guild_config WHERE guild_id=?",
+        async with self._reader().execute(
+            f"SELECT {CONFIG_COLUMNS} FROM guild_config WHERE guild_id=?",
             (guild_id,),
         ) as cur:
             row = await cur.fetchone()
         if row:
-            return GuildConfig(
-                guild_id=guild_id,
-                staff_role_id=row[0],
-                reminder_message=row[1] or DEFAULT_MESSAGE,
-                schedule_cron=row[2],
-                last_sent_at=row[3],
-                log_channel_id=row[4],
-            )
+            return _config_from_row(row)
         cfg = GuildConfig(guild_id=guild_id)
         await self.upsert_guild_config(cfg)
         return cfg
 
+    async def get_guild_configs(self, guild_ids: Iterable[int]) -> List[GuildConfig]:
+        """Load the stored configs of ``guild_ids`` in one query.
+
+        Guilds without a stored row are left out.
+        """
+        async with self._reader().execute(
+            f"SELECT {CONFIG_COLUMNS} FROM guild_config WHERE guild_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(guild_ids)),),
+        ) as cur:
+            return [_config_from_row(row) for row in await cur.fetchall()]
+
     async def upsert_guild_config(self, cfg: GuildConfig) -> None:
         assert self.conn is not None
-        await self.conn.execute(
-            """INSERT INTO guild_config(guild_id, staff_role_id, reminder_message, schedule_cron, last_sent_at, log_channel_id)
-            VALUES(?,?,?,?,?,?)
-            ON CONFLICT(guild_id) DO UPDATE SET
-                staff_role_id=excluded.staff_role_id,
-                reminder_message=excluded.reminder_message,
-                schedule_cron=excluded.schedule_cron,
-                last_sent_at=excluded.last_sent_at,
-                log_channel_id=excluded.log_channel_id
-            """,
-            (
-                cfg.guild_id,
-                cfg.staff_role_id,
-                cfg.reminder_message,
-                cfg.schedule_cron,
-                cfg.last_sent_at,
-                cfg.log_channel_id,
-            ),
-        )
-        await self.conn.commit()
+        async with self.write_lock:
+            with metrics.DB_WRITE.time(op="config"):
+                await self.conn.execute(UPSERT_CONFIG, _config_params(cfg))
+                await self.conn.commit()
+
+    async def bulk_upsert_guild_configs(self, configs: Iterable[GuildConfig]) -> None:
+        """Upsert many configs in one transaction."""
+        assert self.conn is not None
+        async with self.write_lock:
+            with metrics.DB_WRITE.time(op="config"):
+                await self.conn.executemany(UPSERT_CONFIG, [_config_params(cfg) for cfg in configs])
+                await self.conn.commit()
 
     async def update_guild_config(self, guild_id: int, **fields) -> GuildConfig:
         cfg = await self.get_guild_config(guild_id)
@@ -93,10 +452,388 @@ class Database:
         await self.upsert_guild_config(cfg)
         return cfg
 
-    async def log_send(self, guild_id: int, user_id: int, status: str, error: Optional[str]) -> None:
+    async def log_send(
+        self, guild_id: int, user_id: int, status: str, error: Optional[str], run_id: Optional[int] = None
+    ) -> None:
+        """Queue a ``send_log`` row; it is written by the next batch flush.
+
+        When ``run_id`` is given the matching ``dm_job`` row is moved to
+        ``status`` in the same transaction.
+        """
+        await self.send_log.add(guild_id, user_id, status, error, run_id)
+
+    async def flush_send_log(self) -> None:
+        await self.send_log.flush()
+
+    async def create_run(self, guild_id: int, user_ids: Iterable[int], skipped: int = 0) -> int:
+        """Persist a run and one pending job per recipient; return the run id.
+
+        ``skipped`` counts staff members left out of the run up front.
+        """
         assert self.conn is not None
-        await self.conn.execute(
-            "INSERT INTO send_log(guild_id, user_id, status, error, sent_at) VALUES (?,?,?,?,datetime('now'))",
-            (guild_id, user_id, status, error),
-        )
-        await self.conn.commit()
+        async with self.write_lock:
+            cur = await self.conn.execute(
+                "INSERT INTO dm_run(guild_id, status, created_at, skipped) VALUES (?, 'running', ?, ?)",
+                (guild_id, sqlite_now(), skipped),
+            )
+            run_id = cur.lastrowid
+            await self.conn.executemany(
+                "INSERT OR IGNORE INTO dm_job(run_id, user_id, status) VALUES (?, ?, 'pending')",
+                [(run_id, user_id) for user_id in user_ids],
+            )
+            await self.conn.commit()
+            return run_id
+
+    async def get_run_jobs(self, run_id: int, status: str = "pending") -> List[int]:
+        assert self.conn is not None
+        async with self.conn.execute(
+            "SELECT user_id FROM dm_job WHERE run_id=? AND status=? ORDER BY rowid",
+            (run_id, status),
+        ) as cur:
+            return [row[0] for row in await cur.fetchall()]
+
+    async def claim_jobs(self, run_id: int, user_ids: Sequence[int]) -> Set[int]:
+        """Mark pending jobs as being sent; returns the ids claimed.
+
+        The ``(run_id, user_id)`` key acts as the idempotency key: only one
+        caller can move a job out of ``pending`` and the claim is committed
+        before the DM goes out, so a crash can never lead to a second send.
+        """
+        assert self.conn is not None
+        async with self.write_lock:
+            with metrics.DB_WRITE.time(op="claim"):
+                async with self.conn.execute(
+                    "UPDATE dm_job SET status='sending' WHERE run_id=? AND status='pending'"
+                    " AND user_id IN (SELECT value FROM json_each(?)) RETURNING user_id",
+                    (run_id, json.dumps(list(user_ids))),
+                ) as cur:
+                    claimed = {row[0] for row in await cur.fetchall()}
+                await self.conn.commit()
+            return claimed
+
+    async def release_jobs(self, run_id: int, user_ids: Sequence[int]) -> None:
+        """Return claimed jobs that were never sent to ``pending``."""
+        assert self.conn is not None
+        async with self.write_lock:
+            await self.conn.execute(
+                "UPDATE dm_job SET status='pending' WHERE run_id=? AND status='sending'"
+                " AND user_id IN (SELECT value FROM json_each(?))",
+                (run_id, json.dumps(list(user_ids))),
+            )
+            await self.conn.commit()
+
+    async def run_counts(self, run_id: int) -> Dict[str, int]:
+        assert self.conn is not None
+        async with self.conn.execute(
+            "SELECT status, COUNT(*) FROM dm_job WHERE run_id=? GROUP BY status",
+            (run_id,),
+        ) as cur:
+            return {status: count for status, count in await cur.fetchall()}
+
+    async def run_skipped(self, run_id: int) -> int:
+        assert self.conn is not None
+        async with self.conn.execute("SELECT skipped FROM dm_run WHERE id=?", (run_id,)) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else 0
+
+    async def last_sent(self, guild_id: int) -> Dict[int, str]:
+        """``{user_id: sent_at}`` of each member's latest successful DM."""
+        async with self._reader().execute(
+            "SELECT user_id, sent_at FROM member_last_sent WHERE guild_id=?", (guild_id,)
+        ) as cur:
+            return {user_id: sent_at for user_id, sent_at in await cur.fetchall()}
+
+    async def finish_run(self, run_id: int, status: str = "done") -> None:
+        assert self.conn is not None
+        async with self.write_lock:
+            await self.conn.execute(
+                "UPDATE dm_run SET status=?, finished_at=? WHERE id=?",
+                (status, sqlite_now(), run_id),
+            )
+            await self.conn.commit()
+
+    async def unfinished_runs(self) -> List[Tuple[int, int]]:
+        """Return ``(run_id, guild_id)`` for runs that never finished."""
+        assert self.conn is not None
+        async with self.conn.execute(
+            "SELECT id, guild_id FROM dm_run WHERE status='running' ORDER BY id"
+        ) as cur:
+            return [(row[0], row[1]) for row in await cur.fetchall()]
+
+    async def recover_run(self, run_id: int) -> None:
+        """Fail jobs that were claimed but never confirmed before a restart.
+
+        Whether those DMs went out is unknown, so they are not retried.
+        """
+        assert self.conn is not None
+        async with self.write_lock:
+            cur = await self.conn.execute(
+                "UPDATE dm_job SET status='failed', error='interrupted before delivery was confirmed' "
+                "WHERE run_id=? AND status='sending'",
+                (run_id,),
+            )
+            await self.conn.execute(
+                "UPDATE dm_run SET failed=failed+? WHERE id=?", (cur.rowcount, run_id)
+            )
+            await self.conn.commit()
+
+    async def send_stats(self, guild_id: int, days: Optional[int] = None) -> Tuple[int, int]:
+        """``(sent, failed)`` for the last ``days`` days including today, or all time."""
+        query = "SELECT COALESCE(SUM(sent), 0), COALESCE(SUM(failed), 0) FROM send_stats_daily WHERE guild_id=?"
+        params: Tuple = (guild_id,)
+        if days is not None:
+            query += " AND day>=?"
+            params += (days_ago(days - 1),)
+        async with self._reader().execute(query, params) as cur:
+            sent, failed = await cur.fetchone()
+        return sent, failed
+
+    async def recent_runs(self, guild_id: int, limit: int = 10) -> List[Tuple[int, str, str, int, int, int]]:
+        """Return ``(run_id, status, created_at, sent, failed, skipped)`` of the newest runs."""
+        async with self._reader().execute(
+            "SELECT id, status, created_at, sent, failed, skipped FROM dm_run WHERE guild_id=? ORDER BY id DESC LIMIT ?",
+            (guild_id, limit),
+        ) as cur:
+            return [tuple(row) for row in await cur.fetchall()]
+
+    async def run_send_history(
+        self, guild_id: int, since: str, limit: int = 20
+    ) -> List[Tuple[int, int, int, str, str]]:
+        """``(recipients, failed, undeliverable, first_sent_at, last_sent_at)``
+        of the guild's newest runs, from their ``send_log`` rows logged since
+        ``since``.
+
+        ``undeliverable`` counts the rows of members now marked undeliverable;
+        their failures are left out of ``failed``, as a new run skips them.
+        """
+        async with self._reader().execute(
+            """SELECT COUNT(*), SUM(s.status='failed' AND u.user_id IS NULL), COUNT(u.user_id),
+                MIN(s.sent_at), MAX(s.sent_at)
+            FROM send_log s LEFT JOIN undeliverable u
+                ON u.guild_id=s.guild_id AND u.user_id=s.user_id AND u.expires_at>?
+            WHERE s.guild_id=? AND s.sent_at>=? AND s.run_id IS NOT NULL
+            GROUP BY s.run_id ORDER BY s.run_id DESC LIMIT ?""",
+            (sqlite_now(), guild_id, since, limit),
+        ) as cur:
+            return [tuple(row) for row in await cur.fetchall()]
+
+    async def last_run_sizes(self, guild_ids: Iterable[int]) -> Dict[int, int]:
+        """``{guild_id: recipients}`` of each guild's latest complete run."""
+        async with self._reader().execute(
+            """SELECT guild_id, sent + failed FROM dm_run WHERE id IN (
+                SELECT MAX(id) FROM dm_run
+                WHERE status='done' AND guild_id IN (SELECT value FROM json_each(?))
+                GROUP BY guild_id
+            )""",
+            (json.dumps(list(guild_ids)),),
+        ) as cur:
+            return dict(await cur.fetchall())
+
+    async def iter_send_log(
+        self, guild_id: int, since: Optional[str] = None, until: Optional[str] = None, chunk_size: int = 1000
+    ) -> AsyncIterator[List[Tuple[str, int, str, Optional[str], Optional[int]]]]:
+        """Yield ``(sent_at, user_id, status, error, run_id)`` rows of a guild,
+        oldest first, in lists of at most ``chunk_size``.
+
+        ``since`` is inclusive and ``until`` exclusive, both ``sent_at``
+        timestamps. Rows are fetched from an open cursor one chunk at a time,
+        so memory use does not depend on how many rows match.
+
+        The cursor stays open for the whole export, and the connection holding
+        it reads from the snapshot it started with. It therefore gets its own
+        connection rather than a pooled reader that other queries share.
+        """
+        assert self.conn is not None
+        await self.send_log.flush()
+        if self.readers:
+            conn = await self._open()
+            await conn.execute("PRAGMA query_only=ON")
+        else:
+            conn = self.conn
+        try:
+            async with conn.execute(
+                "SELECT sent_at, user_id, status, error, run_id FROM send_log"
+                " WHERE guild_id=? AND sent_at>=? AND sent_at<? ORDER BY sent_at, id",
+                (guild_id, since or "", until or "9999"),
+            ) as cur:
+                while True:
+                    rows = await cur.fetchmany(chunk_size)
+                    if not rows:
+                        return
+                    yield [tuple(row) for row in rows]
+        finally:
+            if conn is not self.conn:
+                await conn.close()
+
+    async def compact_send_log(self, before: str) -> int:
+        """Delete raw history older than ``before`` (a ``sent_at`` timestamp).
+
+        The daily and per-run counters already include these rows, so stats
+        are unaffected; only the per-recipient detail is dropped. Returns the
+        number of ``send_log`` rows deleted.
+        """
+        assert self.conn is not None
+        await self.send_log.flush()
+        async with self.write_lock:
+            with metrics.DB_WRITE.time(op="compact"):
+                cur = await self.conn.execute("DELETE FROM send_log WHERE sent_at<?", (before,))
+                await self.conn.execute(
+                    "DELETE FROM dm_job WHERE run_id IN "
+                    "(SELECT id FROM dm_run WHERE status!='running' AND finished_at<?)",
+                    (before,),
+                )
+                await self.conn.commit()
+            return cur.rowcount
+
+    async def mark_undeliverable(
+        self, guild_id: int, user_id: int, code: int, reason: str, ttl: float
+    ) -> None:
+        """Remember that DMs to ``user_id`` fail permanently, for ``ttl`` seconds."""
+        assert self.conn is not None
+        now = datetime.now(UTC)
+        expires = (now + timedelta(seconds=ttl)).strftime("%Y-%m-%d %H:%M:%S")
+        async with self.write_lock:
+            await self.conn.execute(
+                """INSERT INTO undeliverable(guild_id, user_id, code, reason, marked_at, expires_at)
+                VALUES (?,?,?,?,?,?)
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                    code=excluded.code,
+                    reason=excluded.reason,
+                    marked_at=excluded.marked_at,
+                    expires_at=excluded.expires_at
+                """,
+                (guild_id, user_id, code, reason, now.strftime("%Y-%m-%d %H:%M:%S"), expires),
+            )
+            await self.conn.commit()
+
+    async def undeliverable_ids(self, guild_id: int) -> Set[int]:
+        """Members of ``guild_id`` whose undeliverable mark has not expired."""
+        async with self._reader().execute(
+            "SELECT user_id FROM undeliverable WHERE guild_id=? AND expires_at>?",
+            (guild_id, sqlite_now()),
+        ) as cur:
+            return {row[0] for row in await cur.fetchall()}
+
+    async def purge_undeliverable(self) -> int:
+        """Delete expired undeliverable marks; returns how many were removed."""
+        assert self.conn is not None
+        async with self.write_lock:
+            cur = await self.conn.execute("DELETE FROM undeliverable WHERE expires_at<=?", (sqlite_now(),))
+            await self.conn.commit()
+            return cur.rowcount
+
+    async def get_dm_channels(self) -> Dict[int, int]:
+        """Every saved DM channel as ``{user_id: channel_id}``."""
+        async with self._reader().execute("SELECT user_id, channel_id FROM dm_channel") as cur:
+            return {user_id: channel_id for user_id, channel_id in await cur.fetchall()}
+
+    async def forget_dm_channel(self, user_id: int) -> None:
+        assert self.conn is not None
+        async with self.write_lock:
+            await self.conn.execute("DELETE FROM dm_channel WHERE user_id=?", (user_id,))
+            await self.conn.commit()
+
+    async def save_dm_channel(self, user_id: int, channel_id: int) -> None:
+        """Queue a DM channel id; it is saved with the next send_log batch."""
+        self.send_log.add_dm_channel(user_id, channel_id)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew the lease ``name`` for ``ttl`` seconds.
+
+        Returns ``False`` while another owner holds an unexpired lease. Expiry
+        uses wall-clock time so it is comparable between processes.
+        """
+        assert self.conn is not None
+        now = time.time()
+        async with self.write_lock:
+            cur = await self.conn.execute(
+                """INSERT INTO lease(name, owner, expires_at) VALUES (?,?,?)
+                ON CONFLICT(name) DO UPDATE SET
+                    owner=excluded.owner,
+                    expires_at=excluded.expires_at
+                WHERE lease.expires_at<=? OR lease.owner=excluded.owner
+                """,
+                (name, owner, now + ttl, now),
+            )
+            await self.conn.commit()
+            return cur.rowcount == 1
+
+    async def release_lease(self, name: str, owner: str) -> None:
+        assert self.conn is not None
+        async with self.write_lock:
+            await self.conn.execute("DELETE FROM lease WHERE name=? AND owner=?", (name, owner))
+            await self.conn.commit()
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        async with self._reader().execute("SELECT value FROM meta WHERE key=?", (key,)) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def set_meta(self, key: str, value: str) -> None:
+        assert self.conn is not None
+        async with self.write_lock:
+            await self.conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?,?)", (key, value))
+            await self.conn.commit()
+
+    async def set_next_fires(self, fires: Iterable[Tuple[int, Optional[float]]]) -> None:
+        """Store each guild's next cron fire time (epoch seconds); ``None`` unschedules it."""
+        fires = list(fires)
+        assert self.conn is not None
+        async with self.write_lock:
+            await self.conn.executemany(
+                "DELETE FROM guild_schedule WHERE guild_id=?", [(g,) for g, at in fires if at is None]
+            )
+            await self.conn.executemany(
+                "INSERT OR REPLACE INTO guild_schedule(guild_id, next_fire_at) VALUES (?,?)",
+                [(g, at) for g, at in fires if at is not None],
+            )
+            await self.conn.commit()
+
+    # The schedule is read on the writer connection: the scheduler must see
+    # the fire times it has just advanced, not a reader's older snapshot.
+    async def next_fire_at(self, shard_count: int = 1, shard_ids: Sequence[int] = (0,)) -> Optional[float]:
+        """Earliest scheduled fire time among the guilds of ``shard_ids``."""
+        assert self.conn is not None
+        async with self.conn.execute(
+            f"SELECT MIN(next_fire_at) FROM guild_schedule WHERE {SHARD_FILTER}",
+            (shard_count, json.dumps(list(shard_ids))),
+        ) as cur:
+            row = await cur.fetchone()
+        return row[0]
+
+    async def due_fires(
+        self, now: float, shard_count: int = 1, shard_ids: Sequence[int] = (0,), limit: int = 500
+    ) -> List[Tuple[int, float]]:
+        """Up to ``limit`` ``(guild_id, next_fire_at)`` at or before ``now``, earliest first."""
+        assert self.conn is not None
+        async with self.conn.execute(
+            f"""SELECT guild_id, next_fire_at FROM guild_schedule
+            WHERE next_fire_at<=? AND {SHARD_FILTER}
+            ORDER BY next_fire_at LIMIT ?""",
+            (now, shard_count, json.dumps(list(shard_ids)), limit),
+        ) as cur:
+            return list(await cur.fetchall())
+
+    async def scheduled_between(
+        self, start: float, end: float, shard_count: int = 1, shard_ids: Sequence[int] = (0,)
+    ) -> List[int]:
+        """Guilds of ``shard_ids`` whose next fire time is in ``[start, end)``."""
+        assert self.conn is not None
+        async with self.conn.execute(
+            f"""SELECT guild_id FROM guild_schedule
+            WHERE next_fire_at>=? AND next_fire_at<? AND {SHARD_FILTER}""",
+            (start, end, shard_count, json.dumps(list(shard_ids))),
+        ) as cur:
+            return [row[0] for row in await cur.fetchall()]
+
+    async def unscheduled_crons(self, shard_count: int = 1, shard_ids: Sequence[int] = (0,)) -> List[Tuple[int, str]]:
+        """``(guild_id, schedule_cron)`` of guilds with a cron but no stored fire time."""
+        assert self.conn is not None
+        async with self.conn.execute(
+            f"""SELECT guild_id, schedule_cron FROM guild_config
+            WHERE schedule_cron IS NOT NULL
+                AND guild_id NOT IN (SELECT guild_id FROM guild_schedule)
+                AND {SHARD_FILTER}""",
+            (shard_count, json.dumps(list(shard_ids))),
+        ) as cur:
+            return list(await cur.fetchall())
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, UTC
+from typing import Callable, Dict, List
+
+import discord
+
+from config import GuildConfig
+from dm_queue import DMQueue, ProgressCallback, RunProgress
+
+
+class RunTooSoon(Exception):
+    """Raised when a guild's last complete run is less than ``min_gap`` old."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"The last run finished recently; try again in {retry_after / 60:.0f} min")
+        self.retry_after = retry_after
+
+
+class RunDispatcher:
+    """Runs reminder DMs in background tasks so callers get a run id at once.
+
+    There is at most one run per guild: triggering a guild whose run is in
+    flight (a command during a cron run, two managers at once) joins that
+    run, and the caller's progress callback is attached to it. A new run is
+    refused with ``RunTooSoon`` until ``min_gap`` seconds after the guild's
+    ``last_sent_at``.
+
+    Progress callbacks are throttled to one call every ``progress_interval``
+    seconds each; the final state of a run is always reported.
+    """
+
+    def __init__(
+        self,
+        dm_queue: DMQueue,
+        configs,
+        progress_interval: float = 5.0,
+        time_func: Callable[[], float] = time.monotonic,
+        min_gap: float = 0.0,
+    ) -> None:
+        self.dm_queue = dm_queue
+        self.configs = configs
+        self.progress_interval = progress_interval
+        self.time_func = time_func
+        self.min_gap = min_gap
+        self.runs: Dict[int, RunProgress] = {}
+        self._guild_runs: Dict[int, RunProgress] = {}
+        self._listeners: Dict[int, List[ProgressCallback]] = {}
+        # Guilds whose run is being created, so a concurrent start waits for it.
+        self._starting: Dict[int, asyncio.Future] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.logger = logging.getLogger(__name__)
+
+    def active_run(self, guild_id: int) -> RunProgress | None:
+        return self._guild_runs.get(guild_id)
+
+    def join(self, guild_id: int, on_progress: ProgressCallback | None = None) -> RunProgress | None:
+        """Attach ``on_progress`` to the guild's run in flight, if there is one."""
+        progress = self._guild_runs.get(guild_id)
+        if progress is not None and on_progress is not None:
+            self._listeners[progress.run_id].append(self._throttle(on_progress))
+        return progress
+
+    async def start(
+        self,
+        guild: discord.Guild,
+        cfg: GuildConfig,
+        on_progress: ProgressCallback | None = None,
+        delta: bool = False,
+        budget: float | None = None,
+    ) -> RunProgress | None:
+        """Persist a run and dispatch it, or join the guild's run in flight.
+
+        Returns ``None`` if the guild has no staff role, and raises
+        ``RunTooSoon`` inside the minimum gap. ``delta`` and ``budget`` are
+        passed to ``DMQueue.enqueue`` and ``DMQueue.process_run``; a joined
+        run keeps its own.
+        """
+        while (starting := self._starting.get(guild.id)) is not None:
+            await asyncio.shield(starting)
+        progress = self.join(guild.id, on_progress)
+        if progress is not None:
+            return progress
+        starting = self._starting[guild.id] = asyncio.get_running_loop().create_future()
+        try:
+            # Re-read: a run that just finished has moved last_sent_at.
+            cfg = await self.configs.get_guild_config(guild.id)
+            self._check_gap(cfg)
+            run_id = await self.dm_queue.enqueue(guild, cfg, delta)
+            if run_id is None:
+                return None
+            return self._dispatch(guild, cfg, run_id, on_progress, resume=False, budget=budget)
+        finally:
+            del self._starting[guild.id]
+            starting.set_result(None)
+
+    def retry_after(self, cfg: GuildConfig) -> float:
+        """Seconds until the guild's minimum gap allows a new run; 0 if it does now."""
+        if not self.min_gap or not cfg.last_sent_at:
+            return 0.0
+        since = (datetime.now(UTC) - datetime.fromisoformat(cfg.last_sent_at)).total_seconds()
+        return max(self.min_gap - since, 0.0)
+
+    def _check_gap(self, cfg: GuildConfig) -> None:
+        retry_after = self.retry_after(cfg)
+        if retry_after > 0:
+            raise RunTooSoon(retry_after)
+
+    async def resume(self, guild: discord.Guild, cfg: GuildConfig, run_id: int) -> RunProgress:
+        """Continue an interrupted run; a second one of the same guild is cancelled."""
+        progress = self._guild_runs.get(guild.id)
+        if progress is not None:
+            self.logger.info("Cancelling run %s: run %s of guild %s is in flight", run_id, progress.run_id, guild.id)
+            await self.dm_queue.db.finish_run(run_id, "cancelled")
+            return progress
+        return self._dispatch(guild, cfg, run_id, None, resume=True)
+
+    def cancel(self, run_id: int) -> bool:
+        if run_id not in self.runs:
+            return False
+        self.dm_queue.cancel(run_id)
+        return True
+
+    async def wait(self, run_id: int) -> None:
+        task = self._tasks.get(run_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+    def _dispatch(
+        self,
+        guild: discord.Guild,
+        cfg: GuildConfig,
+        run_id: int,
+        on_progress: ProgressCallback | None,
+        resume: bool,
+        budget: float | None = None,
+    ) -> RunProgress:
+        progress = RunProgress(run_id, guild.id, self.time_func)
+        self.runs[run_id] = progress
+        self._guild_runs[guild.id] = progress
+        self._listeners[run_id] = [self._throttle(on_progress)] if on_progress is not None else []
+        task = asyncio.create_task(self._run(guild, cfg, progress, self._fan_out(run_id), resume, budget))
+        self._tasks[run_id] = task
+        return progress
+
+    def _fan_out(self, run_id: int) -> ProgressCallback:
+        async def report(progress: RunProgress) -> None:
+            for listener in list(self._listeners.get(run_id, ())):
+                await listener(progress)
+
+        return report
+
+    def _throttle(self, on_progress: ProgressCallback) -> ProgressCallback:
+        last: float | None = None
+
+        async def report(progress: RunProgress) -> None:
+            nonlocal last
+            now = self.time_func()
+            if not progress.done and last is not None and now - last < self.progress_interval:
+                return
+            last = now
+            try:
+                await on_progress(progress)
+            except Exception:
+                self.logger.exception("Progress callback failed for run %s", progress.run_id)
+
+        return report
+
+    async def _run(
+        self,
+        guild: discord.Guild,
+        cfg: GuildConfig,
+        progress: RunProgress,
+        on_progress: ProgressCallback,
+        resume: bool,
+        budget: float | None = None,
+    ) -> None:
+        run_id = progress.run_id
+        try:
+            if resume:
+                await self.dm_queue.resume(guild, cfg, run_id, progress, on_progress)
+            else:
+                await self.dm_queue.process_run(guild, cfg, run_id, progress, on_progress, budget)
+            # Only a run that reached everyone starts a new delta cycle.
+            if not progress.cancelled and progress.remaining == 0:
+                await self.configs.update_guild_config(
+                    guild.id, last_sent_at=datetime.now(UTC).isoformat()
+                )
+        except Exception:
+            self.logger.exception("Run %s for guild %s failed", run_id, guild.id)
+            # Left running, the run would be resumed after a restart and its
+            # pending members DMed by it and by the next run alike.
+            try:
+                await self.dm_queue.db.finish_run(run_id, "cancelled")
+            except Exception:
+                self.logger.exception("Could not close failed run %s", run_id)
+        finally:
+            self.runs.pop(run_id, None)
+            self._listeners.pop(run_id, None)
+            self._tasks.pop(run_id, None)
+            if self._guild_runs.get(guild.id) is progress:
+                del self._guild_runs[guild.id]
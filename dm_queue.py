@@ -3,32 +3,128 @@ from __future__ import annotations
 import asyncio
 import time
 import logging
-from typing import Callable, Tuple
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
 
 import discord
 
-from config import GuildConfig, render_message
+import metrics
+from config import GuildConfig
+from db import sqlite_time
+from ratelimit import AdaptiveRateLimiter, FairRateLimiter, RateLimiter, retry_after_from
+from reporting import RunReporter
+from staff_index import StaffIndex
+from storage import Storage
 
+# Discord error codes after which DMs to a member keep failing.
+PERMANENT_ERRORS = {
+    50007: "cannot send messages to this user",
+    10013: "unknown user",
+}
+# Errors on a saved DM channel after which it is reopened through the member.
+# 50007 (DMs closed) is not one: a new channel fails the same way.
+STALE_CHANNEL_ERRORS = (10003,)
+# Recipients rendered ahead of the send stage, and outcomes not yet recorded,
+# before the stage filling the queue has to wait.
+PIPELINE_DEPTH = 16
+# Jobs claimed per commit by the render stage.
+CLAIM_BATCH = PIPELINE_DEPTH
 
-class RateLimiter:
-    def __init__(self, min_interval: float, time_func: Callable[[], float] = time.monotonic) -> None:
-        self.min_interval = min_interval
-        self.time_func = time_func
-        self._last: float | None = None
 
-    async def wait(self) -> None:
-        now = self.time_func()
-        if self._last is not None:
-            delta = now - self._last
-            if delta < self.min_interval:
-                await asyncio.sleep(self.min_interval - delta)
-        self._last = self.time_func()
+@dataclass
+class Outcome:
+    """Result of one recipient of a run, handed from the send to the record stage."""
+
+    user_id: int
+    target: str
+    message: str | None
+    error: str | None = None
+    # Discord error code of a failed send
+    code: int | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class RunProgress:
+    """Live counters for a run, updated by ``DMQueue.process_run``."""
+
+    run_id: int
+    guild_id: int
+    time_func: Callable[[], float] = field(default=time.monotonic, repr=False)
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    # Members left out of the run as undeliverable.
+    skipped: int = 0
+    done: bool = False
+    cancelled: bool = False
+    started_at: float = 0.0
+    finished_at: float | None = None
+    # Recipients handled by this process; ETA is measured from these only.
+    _handled: int = field(default=0, repr=False)
+
+    def __post_init__(self) -> None:
+        self.started_at = self.time_func()
+
+    @property
+    def remaining(self) -> int:
+        return max(self.total - self.sent - self.failed, 0)
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else self.time_func()
+        return end - self.started_at
+
+    def eta(self, fallback_interval: float) -> float:
+        """Seconds left, from the throughput measured so far in this run."""
+        if self.done:
+            return 0.0
+        per_member = self.elapsed / self._handled if self._handled else fallback_interval
+        return self.remaining * per_member
+
+    def record(self, ok: bool) -> None:
+        self._handled += 1
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    def finish(self, cancelled: bool = False) -> None:
+        self.done = True
+        self.cancelled = cancelled
+        self.finished_at = self.time_func()
+
+
+ProgressCallback = Callable[[RunProgress], Awaitable[None]]
 
 
 class DMQueue:
-    def __init__(self, db, rate_limiter: RateLimiter | None = None) -> None:
+    def __init__(
+        self,
+        db: Storage,
+        rate_limiter: RateLimiter | None = None,
+        max_attempts: int = 3,
+        staff: StaffIndex | None = None,
+        undeliverable_ttl: float = 7 * 24 * 3600,
+        client: discord.Client | None = None,
+    ) -> None:
         self.db = db
-        self.rate_limiter = rate_limiter or RateLimiter(2.0)
+        self.client = client
+        # user_id -> DM channel id, so known channels are not reopened.
+        self.dm_channels: Dict[int, int] = {}
+        self.staff = staff if staff is not None else StaffIndex()
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(2.0)
+        # Shared by every guild: slots are paced by ``rate_limiter``, held back
+        # by 429s discord.py raised, and handed out round-robin across guilds.
+        self.limiter = FairRateLimiter(self.rate_limiter)
+        self.max_attempts = max_attempts
+        # Members failing with a PERMANENT_ERRORS code are skipped this long.
+        self.undeliverable_ttl = undeliverable_ttl
+        self._cancelled: Set[int] = set()
         self.logger = logging.getLogger(__name__)
 
     async def log(self, guild: discord.Guild, cfg: GuildConfig, target: str, status: str, message: str, error: str | None = None) -> None:
@@ -45,41 +141,263 @@ class DMQueue:
                 embed.add_field(name="Message", value=message[:1024], inline=False)
                 await channel.send(embed=embed)
 
-    async def send(self, guild: discord.Guild, cfg: GuildConfig) -> Tuple[int, int, int, float]:
+    async def recipients(
+        self, guild: discord.Guild, cfg: GuildConfig, delta: bool = False
+    ) -> Tuple[List[int], int, int] | None:
+        """Members a run would DM, with how many were left out as undeliverable
+        and by ``delta``; ``None`` if the guild has no staff role.
+
+        Recipients are ordered stalest first: members never reminded, then
+        by the time of their last successful DM, so a run cut short reaches
+        different members next time. With ``delta`` only members without a
+        successful DM since ``cfg.last_sent_at`` are included. Members
+        recently marked undeliverable are left out.
+        """
         role = guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
         if not role:
+            return None
+        await self.staff.refresh(guild, role.id, force=True)
+        member_ids = self.staff.member_ids(guild, role.id)
+        undeliverable = await self.db.undeliverable_ids(guild.id)
+        recipients = [m for m in member_ids if m not in undeliverable]
+        skipped = len(member_ids) - len(recipients)
+        last_sent = await self.db.last_sent(guild.id)
+        reminded = 0
+        if delta and cfg.last_sent_at:
+            since = sqlite_time(cfg.last_sent_at)
+            before = len(recipients)
+            recipients = [m for m in recipients if last_sent.get(m, "") < since]
+            reminded = before - len(recipients)
+        recipients.sort(key=lambda m: last_sent.get(m, ""))
+        return recipients, skipped, reminded
+
+    async def enqueue(self, guild: discord.Guild, cfg: GuildConfig, delta: bool = False) -> int | None:
+        """Persist a run for the guild's ``recipients``; ``None`` if no staff role.
+
+        Undeliverable members are only counted on the run. Raises
+        ``TemplateError`` before anything is persisted if the reminder
+        message is invalid.
+        """
+        cfg.validate()
+        selected = await self.recipients(guild, cfg, delta)
+        if selected is None:
+            return None
+        recipients, skipped, _ = selected
+        return await self.db.create_run(guild.id, recipients, skipped=skipped)
+
+    async def send(
+        self, guild: discord.Guild, cfg: GuildConfig, delta: bool = False, budget: float | None = None
+    ) -> Tuple[int, int, int, float]:
+        run_id = await self.enqueue(guild, cfg, delta)
+        if run_id is None:
             return 0, 0, 0, 0.0
-        members = [m for m in role.members if not m.bot]
-        total = len(members)
-        sent = failed = 0
-        for member in members:
-            await self.rate_limiter.wait()
-            msg = render_message(cfg.reminder_message, guild.name, member.display_name)
+        return await self.process_run(guild, cfg, run_id, budget=budget)
+
+    async def resume(
+        self,
+        guild: discord.Guild,
+        cfg: GuildConfig,
+        run_id: int,
+        progress: RunProgress | None = None,
+        on_progress: ProgressCallback | None = None,
+    ) -> Tuple[int, int, int, float]:
+        """Finish a run left unfinished by a previous process."""
+        await self.db.recover_run(run_id)
+        self.logger.info("Resuming run %s for guild %s", run_id, guild.id)
+        return await self.process_run(guild, cfg, run_id, progress, on_progress)
+
+    def cancel(self, run_id: int) -> None:
+        """Stop ``run_id`` before its next recipient; pending jobs are left unsent."""
+        self._cancelled.add(run_id)
+
+    async def process_run(
+        self,
+        guild: discord.Guild,
+        cfg: GuildConfig,
+        run_id: int,
+        progress: RunProgress | None = None,
+        on_progress: ProgressCallback | None = None,
+        budget: float | None = None,
+    ) -> Tuple[int, int, int, float]:
+        """Deliver every pending job of ``run_id`` and mark the run finished.
+
+        The run is a pipeline of three stages joined by bounded queues:
+        jobs are claimed and their messages rendered ahead, the send stage
+        only waits for a slot and sends, and outcomes are recorded (send log,
+        log channel, ``progress``) while the next DM goes out. A full queue
+        makes the stage feeding it wait, so no stage runs away from the
+        others.
+
+        Jobs are claimed ``CLAIM_BATCH`` at a time, one commit per batch, and
+        every claim is committed before its DM goes out. Claims the run does
+        not get to send are released when it stops. After a crash the
+        claimed but unconfirmed jobs, at most a batch, are failed rather than
+        retried, as with single claims.
+
+        ``progress`` is updated after every recipient and passed to
+        ``on_progress`` when given. Once ``budget`` seconds have passed no
+        further recipient is started; their jobs stay pending. Returns
+        ``(total, sent, failed, eta)`` where ``eta`` estimates the seconds
+        still needed for pending jobs from this run's measured throughput.
+        """
+        if progress is None:
+            progress = RunProgress(run_id, guild.id, self.rate_limiter.time_func)
+        deadline = self.rate_limiter.time_func() + budget if budget is not None else None
+        template = cfg.template.bind(guild.name, datetime.now(UTC).isoformat())
+        status = "done"
+        channel = guild.get_channel(cfg.log_channel_id) if cfg.log_channel_id else None
+        reporter = RunReporter(channel, run_id, time_func=self.rate_limiter.time_func) if channel else None
+        try:
+            pending = await self.db.get_run_jobs(run_id)
+            # A resumed run may find the staff not loaded yet.
+            await self.staff.refresh(guild, cfg.staff_role_id)
+            progress.skipped = await self.db.run_skipped(run_id)
+            if reporter is not None:
+                reporter.skipped = progress.skipped
+            counts = await self.db.run_counts(run_id)
+            progress.total = sum(counts.values())
+            progress.sent = counts.get("sent", 0)
+            progress.failed = counts.get("failed", 0)
+
+            rendered: asyncio.Queue[Tuple[int, discord.Member | None, str | None] | None] = asyncio.Queue(PIPELINE_DEPTH)
+            outcomes: asyncio.Queue[Outcome | None] = asyncio.Queue(PIPELINE_DEPTH)
+
+            # Set when the send stage stops early; no further batch is claimed.
+            stopping = asyncio.Event()
+
+            async def render() -> None:
+                for start in range(0, len(pending), CLAIM_BATCH):
+                    if stopping.is_set():
+                        break
+                    batch = pending[start : start + CLAIM_BATCH]
+                    claimed = await self.db.claim_jobs(run_id, batch)
+                    for user_id in batch:
+                        if user_id not in claimed:
+                            continue
+                        member = self.staff.get_member(guild, user_id)
+                        message = template.render(member.display_name) if member is not None else None
+                        await rendered.put((user_id, member, message))
+                await rendered.put(None)
+
+            async def record() -> None:
+                while (outcome := await outcomes.get()) is not None:
+                    await self._record(guild.id, run_id, outcome, reporter)
+                    progress.record(outcome.ok)
+                    if on_progress is not None:
+                        await on_progress(progress)
+
+            def out_of_time() -> bool:
+                if deadline is None or self.rate_limiter.time_func() < deadline:
+                    return False
+                self.logger.info("Run %s stopped at its time budget of %.0fs", run_id, budget)
+                return True
+
+            async with asyncio.TaskGroup() as stages:
+                renderer = stages.create_task(render())
+                stages.create_task(record())
+                while (item := await rendered.get()) is not None:
+                    user_id, member, message = item
+                    if run_id in self._cancelled:
+                        status = "cancelled"
+                        break
+                    if out_of_time():
+                        break
+                    if member is None:
+                        await outcomes.put(Outcome(user_id, str(user_id), None, "member not found"))
+                        continue
+                    await self.limiter.acquire(guild.id)
+                    if out_of_time():
+                        break
+                    await outcomes.put(await self._deliver(guild, member, message))
+                if item is not None:
+                    # Stopped early: release this claim and those rendered ahead.
+                    stopping.set()
+                    unsent = [item[0]]
+                    while (item := await rendered.get()) is not None:
+                        unsent.append(item[0])
+                    await self.db.release_jobs(run_id, unsent)
+                await renderer
+                await outcomes.put(None)
+        finally:
+            self._cancelled.discard(run_id)
+            await self.db.flush_send_log()
+            if reporter is not None:
+                await reporter.flush(final=True)
+        await self.db.finish_run(run_id, status)
+        counts = await self.db.run_counts(run_id)
+        total = sum(counts.values())
+        eta = progress.eta(self.limiter.slot_interval())
+        progress.finish(cancelled=status == "cancelled")
+        if on_progress is not None:
+            await on_progress(progress)
+        return total, counts.get("sent", 0), counts.get("failed", 0), eta
+
+    async def _record(self, guild_id: int, run_id: int, outcome: Outcome, reporter: RunReporter | None) -> None:
+        """Log one run outcome: send_log, console, and the batched channel report."""
+        status = "sent" if outcome.ok else "failed"
+        if outcome.code in PERMANENT_ERRORS:
+            await self.db.mark_undeliverable(
+                guild_id, outcome.user_id, outcome.code, PERMANENT_ERRORS[outcome.code], self.undeliverable_ttl
+            )
+        await self.db.log_send(guild_id, outcome.user_id, status, outcome.error, run_id)
+        metrics.DMS.inc(guild=guild_id, status=status)
+        self.logger.info("%s -> %s: %s", status.upper(), outcome.target, outcome.error or outcome.message)
+        if reporter is not None:
+            await reporter.add(outcome.target, status, outcome.error)
+
+    async def _send_dm(self, member: discord.Member, content: str) -> None:
+        """Send to the member's saved DM channel, opening one only when needed."""
+        channel_id = self.dm_channels.get(member.id)
+        if channel_id is not None and self.client is not None:
+            channel = self.client.get_partial_messageable(channel_id, type=discord.ChannelType.private)
             try:
-                await member.send(msg)
-                await self.db.log_send(guild.id, member.id, "sent", None)
-                await self.log(guild, cfg, f"{member} ({member.id})", "sent", msg)
-                sent += 1
+                await channel.send(content)
+                return
             except discord.HTTPException as e:
-                if e.status == 429 and getattr(e, "retry_after", None):
-                    await asyncio.sleep(e.retry_after)
-                    try:
-                        await member.send(msg)
-                        await self.db.log_send(guild.id, member.id, "sent", None)
-                        await self.log(guild, cfg, f"{member} ({member.id})", "sent", msg)
-                        sent += 1
-                        continue
-                    except Exception as e2:  # fall through to failure
-                        err = str(e2)
-                else:
-                    err = str(e)
-                failed += 1
-                await self.db.log_send(guild.id, member.id, "failed", err)
-                await self.log(guild, cfg, f"{member} ({member.id})", "failed", msg, err)
-            except Exception as e:
-                failed += 1
+                if e.code not in STALE_CHANNEL_ERRORS:
+                    raise
+            del self.dm_channels[member.id]
+            await self.db.forget_dm_channel(member.id)
+        dm = await member.create_dm()
+        await dm.send(content)
+        if self.dm_channels.get(member.id) != dm.id:
+            self.dm_channels[member.id] = dm.id
+            await self.db.save_dm_channel(member.id, dm.id)
+
+    async def _deliver(self, guild: discord.Guild, member: discord.Member, msg: str) -> Outcome:
+        """Send ``msg``, retrying 429s and server errors; recording is left to the caller.
+
+        discord.py sleeps through short 429s itself. The ones seen here are
+        longer than the client's ``max_ratelimit_timeout`` (``RateLimited``)
+        or outlasted its retries (an ``HTTPException`` with status 429).
+        """
+        target = f"{member} ({member.id})"
+        attempt = 1
+        while True:
+            try:
+                await self._send_dm(member, msg)
+            except discord.RateLimited as e:
+                self.limiter.on_429(e.retry_after)
+                if attempt < self.max_attempts:
+                    attempt += 1
+                    await self.limiter.acquire(guild.id)
+                    continue
                 err = str(e)
-                await self.db.log_send(guild.id, member.id, "failed", err)
-                await self.log(guild, cfg, f"{member} ({member.id})", "failed", msg, err)
-        eta = total * self.rate_limiter.min_interval
-        return total, sent, failed, eta
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    headers = getattr(e.response, "headers", None) or {}
+                    retry_after = getattr(e, "retry_after", None) or retry_after_from(headers) or 2.0 ** attempt
+                    self.limiter.on_429(retry_after, headers)
+                if attempt < self.max_attempts and (e.status == 429 or e.status >= 500):
+                    if e.status >= 500:
+                        await asyncio.sleep(2.0 ** attempt)
+                    attempt += 1
+                    await self.limiter.acquire(guild.id)
+                    continue
+                return Outcome(member.id, target, msg, str(e), e.code)
+            except Exception as e:
+                return Outcome(member.id, target, msg, str(e))
+            else:
+                self.limiter.on_success()
+                return Outcome(member.id, target, msg)
+            return Outcome(member.id, target, msg, err)
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+from typing import Dict, List, Tuple
+
 import discord
 
+import metrics
 from config import GuildConfig
+from dm_queue import RunProgress
+from planner import RunPlan
 
 def build_status_embed(cfg: GuildConfig, guild: discord.Guild, queued: int) -> discord.Embed:
     role = guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
@@ -16,6 +21,85 @@ def build_status_embed(cfg: GuildConfig, guild: discord.Guild, queued: int) -> d
     return discord.Embed(title="Staff Reminder Status", description="\n".join(desc))
 
 
-def build_summary_embed(total: int, sent: int, failed: int, eta: float) -> discord.Embed:
-    desc = f"Total: {total}\nSent: {sent}\nFailed: {failed}\nEstimated time: {eta:.1f}s"
-    return discord.Embed(title="Reminder Summary", description=desc)
+def build_plan_embed(plan: RunPlan) -> discord.Embed:
+    basis = f"{plan.history_runs} recent runs" if plan.history_runs else "the current send rate"
+    desc = [
+        f"**Recipients:** {plan.recipients}",
+        f"**Left out:** {plan.undeliverable} undeliverable, {plan.reminded} already reminded",
+        f"**API calls:** {plan.api_calls} ({plan.channel_opens} DM channel opens)",
+        f"**Expected failures:** {plan.expected_failures} ({plan.failure_rate:.1%})",
+        f"**Estimated time:** {plan.duration / 60:.1f} min ({plan.seconds_per_dm:.2f}s per DM from {basis})",
+    ]
+    if plan.contending:
+        desc.append(
+            f"**Contention:** +{plan.contention_seconds / 60:.1f} min sharing the send rate with "
+            f"{len(plan.contending)} other runs ({sum(plan.contending.values())} recipients)"
+        )
+    if plan.retry_after:
+        desc.append(f"**Blocked:** the minimum gap allows a run in {plan.retry_after / 60:.0f} min")
+    return discord.Embed(title="Reminder Plan (dry run)", description="\n".join(desc))
+
+
+def build_stats_embed(
+    sent: int, failed: int, days: int | None, runs: List[Tuple[int, str, str, int, int, int]] | None = None
+) -> discord.Embed:
+    period = f"last {days} days" if days else "all time"
+    embed = discord.Embed(title=f"Send stats ({period})")
+    embed.add_field(name="Sent", value=str(sent))
+    embed.add_field(name="Failed", value=str(failed))
+    if runs is not None:
+        lines = [
+            f"#{run_id} {created_at or '?'} ({status}): {run_sent} sent, {run_failed} failed"
+            + (f", {run_skipped} skipped" if run_skipped else "")
+            for run_id, status, created_at, run_sent, run_failed, run_skipped in runs
+        ]
+        embed.add_field(name="Recent runs", value="\n".join(lines) or "none", inline=False)
+    return embed
+
+
+def build_progress_embed(progress: RunProgress, eta: float) -> discord.Embed:
+    if progress.cancelled:
+        state = "cancelled"
+    elif progress.done and progress.remaining:
+        state = "stopped at time budget"
+    elif progress.done:
+        state = "finished"
+    else:
+        state = "running"
+    desc = (
+        f"Sent: {progress.sent}\nFailed: {progress.failed}\nRemaining: {progress.remaining}\n"
+        f"Elapsed: {progress.elapsed:.0f}s\nETA: {eta:.0f}s"
+    )
+    if progress.skipped:
+        desc += f"\nSkipped (DMs closed or unknown user): {progress.skipped}"
+    return discord.Embed(title=f"Reminder Run #{progress.run_id} ({state})", description=desc)
+
+
+def build_memory_embed(rss: int, caches: Dict[str, int], top: List[Tuple[str, int, int]] | None) -> discord.Embed:
+    desc = [f"**Resident memory:** {rss / 1024 / 1024:.1f} MiB"]
+    desc += [f"**{name.capitalize()}:** {size}" for name, size in caches.items()]
+    embed = discord.Embed(title="Memory", description="\n".join(desc))
+    if top is None:
+        value = "tracemalloc is off; set TRACEMALLOC_FRAMES to enable it"
+    else:
+        value = "\n".join(f"`{where}` {size / 1024:.0f} KiB in {count} blocks" for where, size, count in top)
+    embed.add_field(name="Top allocators", value=value[:1024] or "none", inline=False)
+    return embed
+
+
+def build_metrics_embed(guild_id: int) -> discord.Embed:
+    sent = metrics.DMS.get(guild=guild_id, status="sent")
+    failed = metrics.DMS.get(guild=guild_id, status="failed")
+    desc = [
+        f"**DMs (this guild):** {sent:.0f} sent, {failed:.0f} failed",
+        f"**DMs (all guilds):** {metrics.DMS.total():.0f}",
+        f"**429s:** {metrics.RATE_LIMITED.total():.0f} ({metrics.RETRY_AFTER.total():.1f}s retry_after)",
+        f"**Send slot wait:** {metrics.SLOT_WAIT.mean():.2f}s avg",
+        f"**Send rate:** {metrics.SEND_RATE.get():.2f}/s allowed",
+        f"**Send-log write:** {metrics.DB_WRITE.mean(op='send_log') * 1000:.1f}ms avg",
+        f"**Config cache hit ratio:** {metrics.CONFIG_CACHE_HIT_RATIO.get():.1%}",
+        f"**Scheduler lag:** {metrics.SCHEDULER_LAG.mean():.2f}s avg",
+        f"**Queue:** {metrics.SEND_QUEUE_DEPTH.get():.0f} waiting, "
+        f"{metrics.RUNS_ACTIVE.get():.0f} runs, {metrics.RUN_RECIPIENTS_REMAINING.get():.0f} recipients left",
+    ]
+    return discord.Embed(title="Metrics", description="\n".join(desc))
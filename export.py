@@ -0,0 +1,154 @@
+"""Export of a guild's send history as CSV or JSON Lines.
+
+Rows are read from the database in chunks and written straight to a file,
+so memory use stays flat however many rows are exported. From the
+repository root::
+
+    python -m export --guild 123 --since 2024-01-01 --until 2024-01-31 -o january.csv.gz
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import gzip
+import io
+import json
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import BinaryIO, TextIO, Tuple
+
+from db import Database
+from storage import Storage
+
+FORMATS = ("csv", "jsonl")
+COLUMNS = ("sent_at", "user_id", "status", "error", "run_id")
+# Attachments above this size are gzip-compressed.
+GZIP_THRESHOLD = 1024 * 1024
+
+
+def day_range(since: str | None, until: str | None) -> Tuple[str | None, str | None]:
+    """``sent_at`` bounds for the days ``since`` through ``until`` (YYYY-MM-DD).
+
+    Raises ``ValueError`` for a malformed date.
+    """
+    start = f"{date.fromisoformat(since)} 00:00:00" if since else None
+    end = f"{date.fromisoformat(until) + timedelta(days=1)} 00:00:00" if until else None
+    return start, end
+
+
+async def write_send_log(
+    db: Storage,
+    guild_id: int,
+    out: TextIO,
+    fmt: str = "csv",
+    since: str | None = None,
+    until: str | None = None,
+    chunk_size: int = 1000,
+) -> int:
+    """Write the guild's ``send_log`` rows to ``out``; returns the row count."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(COLUMNS)
+    count = 0
+    async for rows in db.iter_send_log(guild_id, since, until, chunk_size):
+        if writer is not None:
+            writer.writerows(rows)
+        else:
+            out.writelines(json.dumps(dict(zip(COLUMNS, row))) + "\n" for row in rows)
+        count += len(rows)
+    return count
+
+
+@dataclass
+class Export:
+    file: BinaryIO  # a temporary file positioned at its start; the caller closes it
+    filename: str
+    rows: int
+    size: int
+    compressed: bool
+
+
+def _gzip(src: BinaryIO) -> Tuple[BinaryIO, int]:
+    src.seek(0)
+    dst = tempfile.TemporaryFile()
+    with gzip.GzipFile(fileobj=dst, mode="wb") as gz:
+        shutil.copyfileobj(src, gz)
+    size = dst.tell()
+    dst.seek(0)
+    return dst, size
+
+
+async def export_send_log(
+    db: Storage,
+    guild_id: int,
+    fmt: str = "csv",
+    since: str | None = None,
+    until: str | None = None,
+    gzip_threshold: int = GZIP_THRESHOLD,
+    chunk_size: int = 1000,
+) -> Export:
+    """Export to a temporary file, compressed once it exceeds ``gzip_threshold`` bytes."""
+    raw = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    try:
+        rows = await write_send_log(db, guild_id, text, fmt, since, until, chunk_size)
+        text.flush()
+    except BaseException:
+        text.close()
+        raise
+    text.detach()
+    filename = f"send-log-{guild_id}.{fmt}"
+    size = raw.tell()
+    if size <= gzip_threshold:
+        raw.seek(0)
+        return Export(raw, filename, rows, size, False)
+    with raw:
+        compressed, size = await asyncio.to_thread(_gzip, raw)
+    return Export(compressed, filename + ".gz", rows, size, True)
+
+
+async def _export_to(args: argparse.Namespace) -> int:
+    since, until = day_range(args.since, args.until)
+    db = Database(args.db, readers=1)
+    await db.connect()
+    try:
+        with contextlib.ExitStack() as stack:
+            out: BinaryIO = sys.stdout.buffer if args.output == "-" else stack.enter_context(open(args.output, "wb"))
+            if args.gzip or args.output.endswith(".gz"):
+                out = stack.enter_context(gzip.GzipFile(fileobj=out, mode="wb"))
+            text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+            rows = await write_send_log(db, args.guild, text, args.format, since, until)
+            text.flush()
+            text.detach()
+    finally:
+        await db.close()
+    return rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Export a guild's send history as CSV or JSON Lines.")
+    parser.add_argument("--db", default="bot.db", help="SQLite database file")
+    parser.add_argument("--guild", type=int, required=True)
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--since", help="first day, YYYY-MM-DD")
+    parser.add_argument("--until", help="last day, YYYY-MM-DD")
+    parser.add_argument("-o", "--output", default="-", help="output file; - for stdout")
+    parser.add_argument("--gzip", action="store_true", help="compress (implied by a .gz output name)")
+    args = parser.parse_args(argv)
+    try:
+        day_range(args.since, args.until)
+    except ValueError as e:
+        parser.error(str(e))
+    rows = asyncio.run(_export_to(args))
+    print(f"Exported {rows} rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,40 @@
 from __future__ import annotations
 
-from datetime import datetime, UTC
+import time
+
+# Taken before the heavy imports below so the startup report includes them.
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import logging
+import tracemalloc
+from typing import Dict, Literal
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from config import EnvConfig
+from cache import GuildConfigCache
+from config import EnvConfig, TemplateError, compile_template
 from db import Database
-from dm_queue import DMQueue
-from embeds import build_status_embed, build_summary_embed
+from dispatcher import RunDispatcher, RunTooSoon
+from dm_queue import AdaptiveRateLimiter, DMQueue, RunProgress
+from embeds import (
+    build_memory_embed,
+    build_metrics_embed,
+    build_plan_embed,
+    build_progress_embed,
+    build_stats_embed,
+    build_status_embed,
+)
+from export import day_range, export_send_log
+import memory
+import metrics
+from planner import plan_run
 from scheduler import Scheduler
+from staff_index import StaffIndex
+from startup import StartupTimer, sync_commands
+from storage import Storage
 
 # Optionally hardcode the bot token here. If None, token from `.env` is used.
 HARDCODED_TOKEN: str | None = None
@@ -26,31 +49,151 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class StaffBot(commands.Bot):
+class StaffBot(commands.AutoShardedBot):
     def __init__(self, config: EnvConfig) -> None:
-        super().__init__(command_prefix=",", intents=intents)
+        staff_only = config.member_cache == "staff"
+        super().__init__(
+            command_prefix=",",
+            intents=intents,
+            shard_count=config.shard_count,
+            shard_ids=config.shard_ids,
+            member_cache_flags=discord.MemberCacheFlags.none() if staff_only else None,
+            chunk_guilds_at_startup=not staff_only,
+            max_ratelimit_timeout=config.rate_limit_timeout,
+        )
         self.config = config
-        self.db = Database()
-        self.dm_queue = DMQueue(self.db)
-        self.scheduler = Scheduler(self, self.db, self.dm_queue)
+        if config.tracemalloc_frames:
+            memory.start_tracing(config.tracemalloc_frames)
+        self.db: Storage = Database(config.db_path, readers=config.db_readers)
+        self.configs = GuildConfigCache(self.db)
+        self.staff = StaffIndex(chunk=staff_only)
+        self.dm_queue = DMQueue(
+            self.db,
+            AdaptiveRateLimiter(config.send_interval, fastest=config.send_interval_min),
+            staff=self.staff,
+            undeliverable_ttl=config.undeliverable_ttl_days * 24 * 3600,
+            client=self,
+        )
+        self.dispatcher = RunDispatcher(self.dm_queue, self.configs, min_gap=config.min_run_gap_minutes * 60)
+        sharded = bool(config.shard_count and config.shard_ids)
+        self.scheduler = Scheduler(
+            self,
+            self.db,
+            self.dispatcher,
+            spread=config.schedule_spread_seconds,
+            misfire_grace_time=config.schedule_misfire_grace,
+            catch_up=config.schedule_catch_up,
+            shard_count=config.shard_count if sharded else 1,
+            shard_ids=config.shard_ids if sharded else (0,),
+        )
+        self.startup_timer = StartupTimer(IMPORT_STARTED)
+        self._startup_task: asyncio.Task | None = None
+        self._metrics_runner = None
+        metrics.CONFIG_CACHE_HIT_RATIO.set_function(lambda: self.configs.hit_ratio)
+        metrics.SEND_QUEUE_DEPTH.set_function(lambda: self.dm_queue.limiter.waiting)
+        metrics.SEND_RATE.set_function(lambda: self.dm_queue.rate_limiter.rate)
+        metrics.RUNS_ACTIVE.set_function(lambda: len(self.dispatcher.runs))
+        metrics.RUN_RECIPIENTS_REMAINING.set_function(
+            lambda: sum(p.remaining for p in self.dispatcher.runs.values())
+        )
 
     async def setup_hook(self) -> None:
+        timer = self.startup_timer
+        timer.lap("login")
         await self.db.connect()
+        timer.lap("database")
+        if self.config.metrics_port:
+            self._metrics_runner = await metrics.start_http_server(
+                self.config.metrics_host, self.config.metrics_port
+            )
+            timer.lap("metrics server")
+        self.scheduler.schedule_compaction(self.config.send_log_retention_days)
+        # Guilds are only known once the gateway is ready; load them in the
+        # background so the command tree sync is not held up.
+        self._startup_task = asyncio.create_task(self.startup())
+        if await sync_commands(self.tree, self.db, self.application_id):
+            timer.lap("command sync")
+        else:
+            timer.skip("command sync")
+
+    async def startup(self) -> None:
+        timer = self.startup_timer
+        await self.wait_until_ready()
+        timer.lap("gateway")
+        configs = await self.db.get_guild_configs(g.id for g in self.guilds)
+        self.configs.prime(configs)
+        logger.info("Loaded %d guild configs", len(configs))
+        self.dm_queue.dm_channels.update(await self.db.get_dm_channels())
+        timer.lap("guild state")
+        await self.resume_runs()
+        timer.lap("resume runs")
+        # Fire times are stored, so nothing is rebuilt per guild; started
+        # last so a catch-up run joins a resumed one instead of racing it.
         self.scheduler.start()
-        for guild in self.guilds:
-            cfg = await self.db.get_guild_config(guild.id)
-            if cfg.schedule_cron:
-                self.scheduler.schedule_guild(guild.id, cfg)
-        await self.tree.sync()
+        logger.info(timer.report())
+
+    def cache_sizes(self) -> Dict[str, int]:
+        sizes = memory.cache_sizes(self.configs, self.staff, self.dm_queue, self.dispatcher)
+        sizes["discord members"] = sum(len(g.members) for g in self.guilds)
+        sizes["discord users"] = len(self.users)
+        return sizes
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether ``guild_id`` belongs to one of this process's shards."""
+        if self.shard_ids is None or not self.shard_count:
+            return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def resume_runs(self) -> None:
+        """Finish DM runs of our guilds interrupted by a restart.
+
+        Newest first: if a guild has several, the latest one is resumed.
+        """
+        for run_id, guild_id in reversed(await self.db.unfinished_runs()):
+            if not self.owns_guild(guild_id):
+                continue
+            guild = self.get_guild(guild_id)
+            if guild is None:
+                await self.db.finish_run(run_id, "cancelled")
+                continue
+            cfg = await self.configs.get_guild_config(guild_id)
+            await self.dispatcher.resume(guild, cfg, run_id)
+
+    async def close(self) -> None:
+        self.scheduler.shutdown()
+        await super().close()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+        await self.db.close()
 
     async def on_ready(self) -> None:
         logger.info("Logged in as %s (%s)", self.user, self.user.id)
 
     async def on_guild_join(self, guild: discord.Guild) -> None:
-        await self.db.get_guild_config(guild.id)
+        cfg = await self.configs.get_guild_config(guild.id)
+        if cfg.schedule_cron:
+            await self.scheduler.schedule_guild(guild.id, cfg)
 
     async def on_guild_remove(self, guild: discord.Guild) -> None:
-        self.scheduler.cancel_guild(guild.id)
+        await self.scheduler.cancel_guild(guild.id)
+        self.configs.evict(guild.id)
+        self.staff.invalidate(guild.id)
+
+    async def on_guild_available(self, guild: discord.Guild) -> None:
+        self.staff.invalidate(guild.id)
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        self.staff.on_member_update(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        if before.roles != after.roles:
+            self.staff.on_member_update(after)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent) -> None:
+        self.staff.on_member_remove(payload.guild_id, payload.user.id)
+
+    async def on_guild_role_delete(self, role: discord.Role) -> None:
+        self.staff.on_role_delete(role)
 
 
 bot_config = EnvConfig()
@@ -93,7 +236,7 @@ async def staffdm_group(ctx: commands.Context) -> None:
 @staffdm_group.command(name="logchannel")
 @manager_only_ctx()
 async def staffdm_logchannel(ctx: commands.Context, channel: discord.TextChannel) -> None:
-    cfg = await bot.db.update_guild_config(ctx.guild.id, log_channel_id=channel.id)
+    cfg = await bot.configs.update_guild_config(ctx.guild.id, log_channel_id=channel.id)
     await ctx.send(embed=discord.Embed(description=f"Log channel set to {channel.mention}"))
 
 
@@ -103,21 +246,30 @@ staff_group = app_commands.Group(name="staff", description="Staff reminders")
 @staff_group.command(name="setrole", description="Set staff role")
 @manager_only()
 async def setrole(inter: discord.Interaction, role: discord.Role) -> None:
-    cfg = await bot.db.update_guild_config(inter.guild.id, staff_role_id=role.id)
-    queued = len([m for m in role.members if not m.bot])
+    # With MEMBER_CACHE=staff the refresh loads the member list from the gateway.
+    await inter.response.defer(ephemeral=True)
+    cfg = await bot.configs.update_guild_config(inter.guild.id, staff_role_id=role.id)
+    await bot.staff.refresh(inter.guild, role.id)
+    queued = bot.staff.count(inter.guild, role.id)
     embed = build_status_embed(cfg, inter.guild, queued)
-    await inter.response.send_message(embed=embed, ephemeral=True)
+    await inter.followup.send(embed=embed, ephemeral=True)
 
 
 @staff_group.command(name="setmessage", description="Set reminder message")
 @manager_only()
 async def setmessage(inter: discord.Interaction, text: str) -> None:
     message = text.replace("\\n", "\n")
-    cfg = await bot.db.update_guild_config(inter.guild.id, reminder_message=message)
-    role = inter.guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
-    queued = len([m for m in role.members if not m.bot]) if role else 0
+    try:
+        compile_template(message)
+    except TemplateError as e:
+        await inter.response.send_message(embed=discord.Embed(description=str(e)), ephemeral=True)
+        return
+    await inter.response.defer(ephemeral=True)
+    cfg = await bot.configs.update_guild_config(inter.guild.id, reminder_message=message)
+    await bot.staff.refresh(inter.guild, cfg.staff_role_id)
+    queued = bot.staff.count(inter.guild, cfg.staff_role_id)
     embed = build_status_embed(cfg, inter.guild, queued)
-    await inter.response.send_message(embed=embed, ephemeral=True)
+    await inter.followup.send(embed=embed, ephemeral=True)
 
 
 @staff_group.command(name="ping", description="Show bot latency")
@@ -145,7 +297,7 @@ async def getmanager(inter: discord.Interaction) -> None:
 
 @staff_group.command(name="showrole", description="Show staff role")
 async def showrole(inter: discord.Interaction) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
     role = inter.guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
     msg = role.mention if role else "No staff role set"
     await inter.response.send_message(msg, ephemeral=True)
@@ -153,31 +305,62 @@ async def showrole(inter: discord.Interaction) -> None:
 
 @staff_group.command(name="liststaff", description="List staff members")
 async def liststaff(inter: discord.Interaction) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
     role = inter.guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
     if not role:
         await inter.response.send_message("No staff role set", ephemeral=True)
         return
-    members = [m.mention for m in role.members if not m.bot]
+    await inter.response.defer(ephemeral=True)
+    await bot.staff.refresh(inter.guild, role.id)
+    members = [m.mention for m in bot.staff.members(inter.guild, role.id)]
     text = ", ".join(members) if members else "No staff members found"
-    await inter.response.send_message(text, ephemeral=True)
+    await inter.followup.send(text, ephemeral=True)
 
 
 @staff_group.command(name="stats", description="Show reminder statistics")
-async def stats(inter: discord.Interaction) -> None:
-    assert bot.db.conn is not None
-    async with bot.db.conn.execute(
-        "SELECT status, COUNT(*) FROM send_log WHERE guild_id=? GROUP BY status",
-        (inter.guild.id,),
-    ) as cur:
-        rows = await cur.fetchall()
-    data = {status: count for status, count in rows}
-    embed = discord.Embed(title="Send stats")
-    embed.add_field(name="Sent", value=str(data.get("sent", 0)))
-    embed.add_field(name="Failed", value=str(data.get("failed", 0)))
+@app_commands.describe(days="Only count the last N days", runs="List the most recent runs")
+async def stats(
+    inter: discord.Interaction, days: app_commands.Range[int, 1, 3650] | None = None, runs: bool = False
+) -> None:
+    sent, failed = await bot.db.send_stats(inter.guild.id, days)
+    recent = await bot.db.recent_runs(inter.guild.id) if runs else None
+    embed = build_stats_embed(sent, failed, days, recent)
     await inter.response.send_message(embed=embed, ephemeral=True)
 
 
+@staff_group.command(name="export", description="Export send history as a file")
+@app_commands.describe(fmt="File format", since="First day, YYYY-MM-DD", until="Last day, YYYY-MM-DD")
+@app_commands.rename(fmt="format")
+@manager_only()
+async def export_cmd(
+    inter: discord.Interaction, fmt: Literal["csv", "jsonl"] = "csv", since: str | None = None, until: str | None = None
+) -> None:
+    try:
+        start, end = day_range(since, until)
+    except ValueError:
+        await inter.response.send_message(embed=discord.Embed(description="Dates must be YYYY-MM-DD"), ephemeral=True)
+        return
+    await inter.response.defer(ephemeral=True)
+    export = await export_send_log(bot.db, inter.guild.id, fmt, start, end)
+    with export.file:
+        if export.size > inter.guild.filesize_limit:
+            mib = export.size / 1024 / 1024
+            await inter.followup.send(
+                embed=discord.Embed(description=f"Export is {mib:.1f} MiB, over the upload limit; narrow the dates"),
+                ephemeral=True,
+            )
+            return
+        await inter.followup.send(
+            f"{export.rows} rows", file=discord.File(export.file, filename=export.filename), ephemeral=True
+        )
+
+
+@staff_group.command(name="metrics", description="Show throughput metrics")
+@manager_only()
+async def metrics_cmd(inter: discord.Interaction) -> None:
+    await inter.response.send_message(embed=build_metrics_embed(inter.guild.id), ephemeral=True)
+
+
 @staff_group.command(name="version", description="Show bot version")
 async def version_cmd(inter: discord.Interaction) -> None:
     await inter.response.send_message(f"Version {BOT_VERSION}", ephemeral=True)
@@ -186,24 +369,77 @@ async def version_cmd(inter: discord.Interaction) -> None:
 remind_group = app_commands.Group(name="remind", description="Reminder actions")
 
 
+def progress_embed(progress: RunProgress) -> discord.Embed:
+    return build_progress_embed(progress, progress.eta(bot.dm_queue.limiter.slot_interval()))
+
+
 @remind_group.command(name="now", description="Send reminders now")
+@app_commands.describe(
+    delta="Only members not reminded since the last complete run",
+    budget_minutes="Stop starting new DMs after this many minutes",
+)
+@manager_only()
+async def remind_now(
+    inter: discord.Interaction, delta: bool = False, budget_minutes: app_commands.Range[int, 1, 1440] | None = None
+) -> None:
+    await inter.response.defer(ephemeral=True)
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+
+    async def report(progress: RunProgress) -> None:
+        try:
+            await inter.edit_original_response(embed=progress_embed(progress))
+        except discord.HTTPException:
+            pass  # the interaction token expires after 15 minutes
+
+    progress = bot.dispatcher.join(inter.guild.id, report)
+    if progress is not None:
+        await inter.edit_original_response(
+            content=f"Run #{progress.run_id} is already in progress; following it", embed=progress_embed(progress)
+        )
+        return
+    try:
+        budget = budget_minutes * 60 if budget_minutes else None
+        progress = await bot.dispatcher.start(inter.guild, cfg, report, delta=delta, budget=budget)
+    except (TemplateError, RunTooSoon) as e:
+        await inter.followup.send(embed=discord.Embed(description=str(e)), ephemeral=True)
+        return
+    if progress is None:
+        await inter.followup.send(embed=discord.Embed(description="No staff role set"), ephemeral=True)
+        return
+    await inter.edit_original_response(embed=progress_embed(progress))
+
+
+@remind_group.command(name="plan", description="Predict a run without sending anything")
+@app_commands.describe(delta="Only members not reminded since the last complete run")
 @manager_only()
-async def remind_now(inter: discord.Interaction) -> None:
+async def remind_plan(inter: discord.Interaction, delta: bool = False) -> None:
+    # Planning reloads the staff index and reads 30 days of send history.
     await inter.response.defer(ephemeral=True)
-    cfg = await bot.db.get_guild_config(inter.guild.id)
-    total, sent, failed, eta = await bot.dm_queue.send(inter.guild, cfg)
-    await bot.db.update_guild_config(
-        inter.guild.id, last_sent_at=datetime.now(UTC).isoformat()
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+    plan = await plan_run(bot.dispatcher, inter.guild, cfg, delta, bot.scheduler)
+    if plan is None:
+        await inter.followup.send(embed=discord.Embed(description="No staff role set"), ephemeral=True)
+        return
+    await inter.followup.send(embed=build_plan_embed(plan), ephemeral=True)
+
+
+@remind_group.command(name="cancel", description="Cancel the running reminder run")
+@manager_only()
+async def remind_cancel(inter: discord.Interaction) -> None:
+    progress = bot.dispatcher.active_run(inter.guild.id)
+    if progress is None or not bot.dispatcher.cancel(progress.run_id):
+        await inter.response.send_message(embed=discord.Embed(description="No run in progress"), ephemeral=True)
+        return
+    await inter.response.send_message(
+        embed=discord.Embed(description=f"Cancelling run #{progress.run_id}"), ephemeral=True
     )
-    embed = build_summary_embed(total, sent, failed, eta)
-    await inter.followup.send(embed=embed, ephemeral=True)
 
 
 @remind_group.command(name="user", description="Send reminder to a user")
 @manager_only()
 async def remind_user(inter: discord.Interaction, member: discord.Member) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
-    message = cfg.reminder_message.replace("\\n", "\n")
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+    message = cfg.template.render(inter.guild.name, member.display_name)
     await member.send(message)
     await bot.dm_queue.log(inter.guild, cfg, f"{member} ({member.id})", "sent", message)
     await inter.response.send_message(embed=discord.Embed(description="Sent"), ephemeral=True)
@@ -214,8 +450,9 @@ async def remind_user(inter: discord.Interaction, member: discord.Member) -> Non
 async def remind_channel(
     inter: discord.Interaction, channel: discord.TextChannel
 ) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
-    message = cfg.reminder_message.replace("\\n", "\n")
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+    role = inter.guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
+    message = cfg.template.render(inter.guild.name, role.mention if role else "staff")
     await channel.send(message)
     await bot.dm_queue.log(
         inter.guild,
@@ -229,24 +466,25 @@ async def remind_channel(
 
 @remind_group.command(name="preview", description="Preview reminder message")
 async def remind_preview(inter: discord.Interaction) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
-    message = cfg.reminder_message.replace("\\n", "\n")
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+    message = cfg.template.render(inter.guild.name, inter.user.display_name)
     await inter.response.send_message(message, ephemeral=True)
 
 
 @staff_group.command(name="status", description="Show current status")
 async def status(inter: discord.Interaction) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
-    role = inter.guild.get_role(cfg.staff_role_id) if cfg.staff_role_id else None
-    queued = len([m for m in role.members if not m.bot]) if role else 0
+    await inter.response.defer(ephemeral=True)
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+    await bot.staff.refresh(inter.guild, cfg.staff_role_id)
+    queued = bot.staff.count(inter.guild, cfg.staff_role_id)
     embed = build_status_embed(cfg, inter.guild, queued)
-    await inter.response.send_message(embed=embed, ephemeral=True)
+    await inter.followup.send(embed=embed, ephemeral=True)
 
 
 @staff_group.command(name="test", description="DM yourself a reminder")
 async def test(inter: discord.Interaction) -> None:
-    cfg = await bot.db.get_guild_config(inter.guild.id)
-    message = cfg.reminder_message.replace("\\n", "\n")
+    cfg = await bot.configs.get_guild_config(inter.guild.id)
+    message = cfg.template.render(inter.guild.name, inter.user.display_name)
     await inter.user.send(message)
     await bot.dm_queue.log(inter.guild, cfg, f"{inter.user} ({inter.user.id})", "sent", message)
     await inter.response.send_message(embed=discord.Embed(description="Sent"), ephemeral=True)
@@ -258,20 +496,33 @@ schedule_group = app_commands.Group(name="schedule", description="Scheduling")
 @schedule_group.command(name="set", description="Set schedule")
 @manager_only()
 async def schedule_set(inter: discord.Interaction, cron: str) -> None:
-    cfg = await bot.db.update_guild_config(inter.guild.id, schedule_cron=cron)
-    bot.scheduler.schedule_guild(inter.guild.id, cfg)
+    cfg = await bot.configs.update_guild_config(inter.guild.id, schedule_cron=cron)
+    await bot.scheduler.schedule_guild(inter.guild.id, cfg)
     await inter.response.send_message(embed=discord.Embed(description="Scheduled"), ephemeral=True)
 
 
 @schedule_group.command(name="clear", description="Clear schedule")
 @manager_only()
 async def schedule_clear(inter: discord.Interaction) -> None:
-    await bot.db.update_guild_config(inter.guild.id, schedule_cron=None)
-    bot.scheduler.cancel_guild(inter.guild.id)
+    await bot.configs.update_guild_config(inter.guild.id, schedule_cron=None)
+    await bot.scheduler.cancel_guild(inter.guild.id)
     await inter.response.send_message(embed=discord.Embed(description="Cleared"), ephemeral=True)
 
+debug_group = app_commands.Group(name="debug", description="Diagnostics")
+
+
+@debug_group.command(name="memory", description="Show memory use, top allocators and cache sizes")
+@manager_only()
+async def debug_memory(inter: discord.Interaction) -> None:
+    top = memory.top_allocations(memory.take_snapshot()) if tracemalloc.is_tracing() else None
+    embed = build_memory_embed(memory.rss_bytes(), bot.cache_sizes(), top)
+    await inter.response.send_message(embed=embed, ephemeral=True)
+
+
 staff_group.add_command(remind_group)
 staff_group.add_command(schedule_group)
+if bot_config.debug_commands:
+    staff_group.add_command(debug_group)
 bot.tree.add_command(staff_group)
 
 
@@ -296,4 +547,5 @@ async def on_command_error(ctx: commands.Context, error: commands.CommandError):
 
 if __name__ == "__main__":
     token = HARDCODED_TOKEN or bot_config.token
+    bot.startup_timer.lap("import")
     bot.run(token)
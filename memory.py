@@ -0,0 +1,66 @@
+"""Memory profiling hooks: resident size, tracemalloc top allocators and cache sizes."""
+from __future__ import annotations
+
+import os
+import sys
+import tracemalloc
+from typing import Dict, List, Tuple
+
+# Allocations of the profiler and the import system are not the bot's.
+FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def start_tracing(frames: int = 1) -> None:
+    """Start tracemalloc, keeping ``frames`` frames per allocation."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process; its peak where the current one is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(FILTERS)
+
+
+def _where(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[0]
+    return f"{os.sep.join(frame.filename.split(os.sep)[-2:])}:{frame.lineno}"
+
+
+def top_allocations(
+    snapshot: tracemalloc.Snapshot, limit: int = 10, baseline: tracemalloc.Snapshot | None = None
+) -> List[Tuple[str, int, int]]:
+    """``(file:line, bytes, blocks)`` of the largest allocating lines, or of
+    the largest growth since ``baseline``."""
+    if baseline is None:
+        return [(_where(s.traceback), s.size, s.count) for s in snapshot.statistics("lineno")[:limit]]
+    stats = snapshot.compare_to(baseline, "lineno")
+    return [(_where(s.traceback), s.size_diff, s.count_diff) for s in stats[:limit]]
+
+
+def cache_sizes(configs, staff, dm_queue, dispatcher) -> Dict[str, int]:
+    """Entries held by the bot's own in-memory caches."""
+    return {
+        "guild configs": len(configs),
+        "staff index guilds": len(staff),
+        "staff members indexed": staff.size,
+        "DM channel ids": len(dm_queue.dm_channels),
+        "rate-limit buckets": len(dm_queue.limiter.buckets),
+        "send log rows pending": len(getattr(dm_queue.db, "send_log", ())),
+        "active runs": len(dispatcher.runs),
+    }
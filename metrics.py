@@ -0,0 +1,200 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Metrics are module-level objects registered with ``REGISTRY``; the optional
+HTTP endpoint started by ``start_http_server`` serves ``REGISTRY.render()``
+at ``/metrics``.
+"""
+from __future__ import annotations
+
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: "_Metric") -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelKey:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """A value that is set directly or read from a callback at render time."""
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def get(self, **labels) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self.get())}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # label key -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelKey, List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def sum(self, **labels) -> float:
+        entry = self._values.get(self._key(labels))
+        return entry[1] if entry else 0.0
+
+    def mean(self, **labels) -> float:
+        count = self.count(**labels)
+        return self.sum(**labels) / count if count else 0.0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+DMS = Counter("staffbot_dms_total", "Reminder DMs by guild and outcome", ("guild", "status"))
+RATE_LIMITED = Counter("staffbot_rate_limited_total", "429 responses seen while sending DMs")
+RETRY_AFTER = Counter("staffbot_retry_after_seconds_total", "Seconds of retry_after imposed by 429 responses")
+SLOT_WAIT = Histogram("staffbot_send_slot_wait_seconds", "Time spent waiting for a send slot")
+DB_WRITE = Histogram("staffbot_db_write_seconds", "Database write latency", ("op",))
+SCHEDULER_LAG = Histogram("staffbot_scheduler_lag_seconds", "Delay between planned and actual cron fire time")
+CONFIG_CACHE_HIT_RATIO = Gauge("staffbot_config_cache_hit_ratio", "Guild config cache hit ratio")
+SEND_QUEUE_DEPTH = Gauge("staffbot_send_queue_depth", "Sends waiting for a rate-limit slot")
+SEND_RATE = Gauge("staffbot_send_rate", "DMs per second currently allowed by the rate limiter")
+RUNS_ACTIVE = Gauge("staffbot_runs_active", "Reminder runs in progress")
+RUN_RECIPIENTS_REMAINING = Gauge("staffbot_run_recipients_remaining", "Recipients left in runs in progress")
+
+
+async def start_http_server(host: str, port: int, registry: Registry = REGISTRY):
+    """Serve ``registry`` at ``http://host:port/metrics``; returns the runner."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
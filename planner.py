@@ -0,0 +1,127 @@
+"""Dry run of a reminder run: who it would DM, and what it would cost.
+
+Nothing is persisted or sent. The prediction comes from the guild's own
+recent runs in ``send_log``, and from the other runs that would share the
+send rate with it: runs in flight and cron runs due before it would end.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import discord
+
+from config import GuildConfig
+from db import days_ago
+from dispatcher import RunDispatcher
+
+HISTORY_DAYS = 30
+HISTORY_RUNS = 20
+
+
+@dataclass
+class RunPlan:
+    guild_id: int
+    recipients: int
+    # Members left out as undeliverable, and as reminded since the last run.
+    undeliverable: int
+    reminded: int
+    # Recipients without a saved DM channel, which costs a request to open.
+    channel_opens: int
+    seconds_per_dm: float
+    failure_rate: float
+    # Past runs the two figures above come from; 0 means the live send rate.
+    history_runs: int
+    slot_interval: float
+    # guild_id -> recipients of the other runs sharing the send rate.
+    contending: Dict[int, int] = field(default_factory=dict)
+    # Seconds until the minimum gap allows the run.
+    retry_after: float = 0.0
+
+    @property
+    def api_calls(self) -> int:
+        """Requests without retries: one DM each, plus the channel opens."""
+        return self.recipients + self.channel_opens
+
+    @property
+    def expected_failures(self) -> int:
+        return round(self.recipients * self.failure_rate)
+
+    @property
+    def solo_seconds(self) -> float:
+        return self.recipients * self.seconds_per_dm
+
+    @property
+    def contention_seconds(self) -> float:
+        # Slots go round-robin across guilds, so until this run's last
+        # recipient every other run takes one slot for each of ours.
+        return self.slot_interval * sum(min(n, self.recipients) for n in self.contending.values())
+
+    @property
+    def duration(self) -> float:
+        return self.solo_seconds + self.contention_seconds
+
+
+def _throughput(history: List[Tuple[int, int, int, str, str]]) -> Tuple[float | None, float, int]:
+    """``(seconds per DM, failure rate, runs used)`` from ``run_send_history`` rows.
+
+    Members now marked undeliverable took send slots, so they count towards
+    the spacing, but not towards the failure rate: the run leaves them out.
+    """
+    span = gaps = total = failed = 0
+    for count, run_failed, undeliverable, first, last in history:
+        total += count - undeliverable
+        failed += run_failed or 0
+        if count > 1:
+            span += (datetime.fromisoformat(last) - datetime.fromisoformat(first)).total_seconds()
+            gaps += count - 1
+    seconds_per_dm = span / gaps if gaps and span > 0 else None
+    return seconds_per_dm, failed / total if total else 0.0, len(history)
+
+
+async def plan_run(
+    dispatcher: RunDispatcher,
+    guild: discord.Guild,
+    cfg: GuildConfig,
+    delta: bool = False,
+    scheduler=None,
+) -> RunPlan | None:
+    """Plan the run ``dispatcher.start`` would make now; ``None`` without a staff role.
+
+    With ``scheduler``, cron runs of this process due while the run would
+    last are counted as contending with it.
+    """
+    queue = dispatcher.dm_queue
+    selected = await queue.recipients(guild, cfg, delta)
+    if selected is None:
+        return None
+    recipients, undeliverable, reminded = selected
+    history = await queue.db.run_send_history(guild.id, days_ago(HISTORY_DAYS), HISTORY_RUNS)
+    seconds_per_dm, failure_rate, history_runs = _throughput(history)
+    slot_interval = queue.limiter.slot_interval()
+    if seconds_per_dm is None:
+        seconds_per_dm, history_runs = slot_interval, 0
+    plan = RunPlan(
+        guild_id=guild.id,
+        recipients=len(recipients),
+        undeliverable=undeliverable,
+        reminded=reminded,
+        channel_opens=sum(1 for m in recipients if m not in queue.dm_channels),
+        seconds_per_dm=seconds_per_dm,
+        failure_rate=failure_rate,
+        history_runs=history_runs,
+        slot_interval=slot_interval,
+        retry_after=dispatcher.retry_after(cfg),
+    )
+    for progress in dispatcher.runs.values():
+        if progress.guild_id != guild.id and not progress.done:
+            plan.contending[progress.guild_id] = progress.remaining
+    if scheduler is not None:
+        now = scheduler.time_func()
+        due = await queue.db.scheduled_between(
+            now, now + plan.solo_seconds, scheduler.shard_count, scheduler.shard_ids
+        )
+        due = [g for g in due if g != guild.id and g not in plan.contending]
+        plan.contending.update(await queue.db.last_run_sizes(due))
+    return plan
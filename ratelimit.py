@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Mapping
+
+import metrics
+
+DM_ROUTE = "POST /channels/{channel_id}/messages"
+
+
+class RateLimiter:
+    """Spaces requests at least ``min_interval`` seconds apart."""
+
+    def __init__(self, min_interval: float, time_func: Callable[[], float] = time.monotonic) -> None:
+        self.min_interval = min_interval
+        self.time_func = time_func
+        self._last: float | None = None
+
+    @property
+    def rate(self) -> float:
+        """Requests per second allowed by the current spacing."""
+        return 1.0 / self.min_interval if self.min_interval > 0 else float("inf")
+
+    async def wait(self) -> None:
+        now = self.time_func()
+        if self._last is not None:
+            delta = now - self._last
+            if delta < self.min_interval:
+                await asyncio.sleep(self.min_interval - delta)
+        self._last = self.time_func()
+
+    def on_success(self) -> None:
+        """A request went through; a fixed limiter ignores it."""
+
+    def on_429(self) -> None:
+        """A request was rate limited; a fixed limiter ignores it."""
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """A ``RateLimiter`` whose spacing adapts to 429s (AIMD).
+
+    Every 429 halves the rate (``backoff``), at most once per interval so a
+    burst of 429s from requests already in flight counts once, and the rate
+    it happened at is remembered as the ceiling. Every success adds
+    ``increase`` requests per second, up to ``headroom`` times that ceiling
+    and never faster than one request per ``fastest`` seconds. A ceiling not
+    hit again within ``ceiling_ttl`` seconds is forgotten, so a one-off 429
+    does not cap the rate for good.
+
+    ``fastest`` defaults to ``interval``: the limiter only slows down after
+    429s and recovers to where it started. Passing a smaller ``fastest``
+    opts in to speeding up past it.
+    """
+
+    def __init__(
+        self,
+        interval: float = 2.0,
+        time_func: Callable[[], float] = time.monotonic,
+        fastest: float | None = None,
+        slowest: float = 30.0,
+        increase: float = 0.01,
+        backoff: float = 0.5,
+        headroom: float = 0.9,
+        ceiling_ttl: float = 600.0,
+    ) -> None:
+        super().__init__(interval, time_func)
+        self.fastest = interval if fastest is None else fastest
+        self.slowest = slowest
+        self.increase = increase
+        self.backoff = backoff
+        self.headroom = headroom
+        self.ceiling_ttl = ceiling_ttl
+        self.ceiling: float | None = None
+        self._ceiling_at = 0.0
+        self._backoff_at: float | None = None
+
+    def _max_rate(self) -> float:
+        max_rate = 1.0 / self.fastest
+        if self.ceiling is not None:
+            if self.time_func() - self._ceiling_at > self.ceiling_ttl:
+                self.ceiling = None
+            else:
+                max_rate = min(max_rate, self.ceiling * self.headroom)
+        return max_rate
+
+    def on_success(self) -> None:
+        rate = min(self.rate + self.increase, self._max_rate())
+        # Never speed up past the limit by the increase itself, but do not
+        # slow down either when the ceiling sits below the current rate.
+        self.min_interval = min(self.min_interval, 1.0 / rate)
+
+    def on_429(self) -> None:
+        now = self.time_func()
+        if self._backoff_at is not None and now - self._backoff_at < self.min_interval:
+            return
+        self._backoff_at = now
+        self.ceiling = self.rate if self.ceiling is None else min(self.ceiling, self.rate)
+        self._ceiling_at = now
+        self.min_interval = min(self.min_interval / self.backoff, self.slowest)
+
+
+class RateLimitBuckets:
+    """Routes blocked by 429s that discord.py did not wait out itself.
+
+    discord.py follows the ``X-RateLimit-*`` headers of every bucket and
+    sleeps through short 429s on its own. A 429 longer than the client's
+    ``max_ratelimit_timeout`` is raised instead, and so is one that is still
+    there after its retries. ``on_429`` records it, and ``delay`` then holds
+    back every request on the route (or every route, for a global limit)
+    until ``retry_after`` has passed, rather than each waiting DM hitting it.
+    """
+
+    def __init__(self, time_func: Callable[[], float] = time.monotonic) -> None:
+        self.time_func = time_func
+        self._global_until = 0.0
+        self._blocked_until: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._blocked_until)
+
+    def delay(self, route: str) -> float:
+        """Seconds to wait before a request on ``route`` is allowed."""
+        now = self.time_func()
+        wait = max(self._global_until, self._blocked_until.get(route, 0.0)) - now
+        if wait <= 0 and route in self._blocked_until:
+            del self._blocked_until[route]
+        return max(wait, 0.0)
+
+    def on_429(
+        self,
+        route: str,
+        retry_after: float,
+        headers: Mapping[str, str] | None = None,
+        is_global: bool = False,
+    ) -> None:
+        """Record a 429; no request on ``route`` is allowed for ``retry_after``."""
+        until = self.time_func() + retry_after
+        headers = headers or {}
+        if is_global or headers.get("X-RateLimit-Global") == "true" or headers.get("X-RateLimit-Scope") == "global":
+            self._global_until = max(self._global_until, until)
+        else:
+            self._blocked_until[route] = max(self._blocked_until.get(route, 0.0), until)
+
+
+def retry_after_from(headers: Mapping[str, str]) -> float | None:
+    value = headers.get("X-RateLimit-Reset-After") or headers.get("Retry-After")
+    return float(value) if value is not None else None
+
+
+class FairRateLimiter:
+    """Hands out send slots to guilds in round-robin order.
+
+    Every slot is spaced by ``limiter`` and held back while ``buckets``
+    reports the route as blocked by a 429, so all guilds together wait it
+    out, and a guild with a large run cannot starve the others: each guild
+    waiting for a slot gets one before any guild gets a second.
+    """
+
+    def __init__(
+        self, limiter: RateLimiter, buckets: RateLimitBuckets | None = None, route: str = DM_ROUTE, smoothing: float = 0.1
+    ) -> None:
+        self.limiter = limiter
+        self.buckets = buckets if buckets is not None else RateLimitBuckets(limiter.time_func)
+        self.route = route
+        self._queues: OrderedDict[int, Deque[asyncio.Future]] = OrderedDict()
+        self._task: asyncio.Task | None = None
+        # Moving average of the time between two granted slots while busy,
+        # retries and rate-limit waits included.
+        self.smoothing = smoothing
+        self._slot_interval: float | None = None
+
+    def slot_interval(self) -> float:
+        """Measured seconds per slot, or the limiter's spacing before any were measured."""
+        return self._slot_interval if self._slot_interval is not None else self.limiter.min_interval
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, guild_id: int) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(guild_id, deque()).append(fut)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._grant())
+        start = self.limiter.time_func()
+        await fut
+        metrics.SLOT_WAIT.observe(self.limiter.time_func() - start)
+
+    def on_429(self, retry_after: float, headers: Mapping[str, str] | None = None, is_global: bool = False) -> None:
+        metrics.RATE_LIMITED.inc()
+        metrics.RETRY_AFTER.inc(retry_after)
+        self.limiter.on_429()
+        self.buckets.on_429(self.route, retry_after, headers, is_global)
+
+    def on_success(self) -> None:
+        self.limiter.on_success()
+
+    async def _grant(self) -> None:
+        last: float | None = None
+        while self._queues:
+            guild_id, waiters = next(iter(self._queues.items()))
+            fut = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+            if fut.done():  # the waiter was cancelled
+                continue
+            # A 429 reported while we waited on the limiter must be honoured,
+            # so the bucket is checked again after every wait.
+            while True:
+                await self.limiter.wait()
+                delay = self.buckets.delay(self.route)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            now = self.limiter.time_func()
+            if last is not None:
+                gap = now - last
+                previous = self._slot_interval
+                self._slot_interval = gap if previous is None else previous + self.smoothing * (gap - previous)
+            last = now
+            if not fut.done():
+                fut.set_result(None)
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import time
+from typing import Callable, List, Tuple
+
+import discord
+
+FIELD_LIMIT = 1024
+FIELDS_PER_EMBED = 25
+EMBED_CHAR_LIMIT = 5500  # Discord allows 6000 per message; leave headroom
+
+
+class RunReporter:
+    """Aggregates per-recipient outcomes of a run for the guild log channel.
+
+    Outcomes are buffered and posted as a few multi-field summary embeds every
+    ``flush_interval`` seconds and at the end of the run. Batches larger than
+    ``csv_threshold`` are posted as a CSV attachment instead.
+    """
+
+    def __init__(
+        self,
+        channel,
+        run_id: int,
+        flush_interval: float = 60.0,
+        csv_threshold: int = 100,
+        time_func: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.channel = channel
+        self.run_id = run_id
+        self.flush_interval = flush_interval
+        self.csv_threshold = csv_threshold
+        self.time_func = time_func
+        self.sent = 0
+        self.failed = 0
+        # Members left out of the run as undeliverable; set by the caller.
+        self.skipped = 0
+        self._entries: List[Tuple[str, str, str | None]] = []
+        self._last_flush = time_func()
+        self.logger = logging.getLogger(__name__)
+
+    async def add(self, target: str, status: str, error: str | None = None) -> None:
+        self._entries.append((target, status, error))
+        if status == "sent":
+            self.sent += 1
+        else:
+            self.failed += 1
+        if self.time_func() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self, final: bool = False) -> None:
+        entries, self._entries = self._entries, []
+        self._last_flush = self.time_func()
+        if not entries and not final:
+            return
+        title = f"Reminder Run #{self.run_id}"
+        if final:
+            title += f" finished: {self.sent} sent, {self.failed} failed"
+            if self.skipped:
+                title += f", {self.skipped} skipped"
+        try:
+            if len(entries) > self.csv_threshold:
+                await self._send_csv(title, entries)
+            else:
+                for embed in self._build_embeds(title, entries):
+                    await self.channel.send(embed=embed)
+        except (discord.HTTPException, discord.RateLimited):
+            # RateLimited: a 429 longer than the client's max_ratelimit_timeout.
+            self.logger.warning("Could not post report for run %s", self.run_id, exc_info=True)
+
+    async def _send_csv(self, title: str, entries: List[Tuple[str, str, str | None]]) -> None:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["target", "status", "error"])
+        writer.writerows((target, status, error or "") for target, status, error in entries)
+        data = io.BytesIO(buf.getvalue().encode())
+        file = discord.File(data, filename=f"run-{self.run_id}.csv")
+        embed = discord.Embed(title=title, description=f"{len(entries)} recipients, see attachment")
+        await self.channel.send(embed=embed, file=file)
+
+    def _build_embeds(self, title: str, entries: List[Tuple[str, str, str | None]]) -> List[discord.Embed]:
+        fields: List[Tuple[str, str]] = []
+        for status in ("sent", "failed"):
+            lines = [
+                f"{target}: {error}" if error else target
+                for target, s, error in entries
+                if s == status
+            ]
+            chunks = _chunk_lines(lines)
+            for i, chunk in enumerate(chunks):
+                name = f"{status.capitalize()} ({len(lines)})" if i == 0 else "\u200b"  # continuation field, blank name
+                fields.append((name, chunk))
+        embeds = [discord.Embed(title=title)]
+        size = len(title)
+        for name, value in fields:
+            embed = embeds[-1]
+            if len(embed.fields) >= FIELDS_PER_EMBED or size + len(name) + len(value) > EMBED_CHAR_LIMIT:
+                embed = discord.Embed(title=title)
+                embeds.append(embed)
+                size = len(title)
+            embed.add_field(name=name, value=value, inline=False)
+            size += len(name) + len(value)
+        return embeds
+
+
+def _chunk_lines(lines: List[str]) -> List[str]:
+    """Join ``lines`` into newline-separated chunks that fit in one field."""
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    for line in lines:
+        line = line[:FIELD_LIMIT]
+        if current and length + len(line) + 1 > FIELD_LIMIT:
+            chunks.append("\n".join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
@@ -1,44 +1,249 @@
 from __future__ import annotations
 
-from datetime import datetime, UTC
-from typing import Dict
-
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import socket
+import time
+import zlib
+from datetime import datetime, timedelta, tzinfo, UTC
+from typing import Callable, List, Sequence, Set, Tuple
 
+import metrics
 from config import GuildConfig
+from db import days_ago
+from dispatcher import RunDispatcher, RunTooSoon
+from storage import Storage
+
+CATCH_UP_POLICIES = ("once", "skip")
+# Longest sleep of the timer loop, so a wall-clock jump is noticed.
+MAX_SLEEP = 300.0
+
+
+def spread_offset(guild_id: int, spread: float) -> float:
+    """Deterministic per-guild delay in ``[0, spread)`` seconds."""
+    if spread <= 0:
+        return 0.0
+    return zlib.crc32(str(guild_id).encode()) / 2**32 * spread
+
+
+def seconds_until(hour: int, now: datetime) -> float:
+    """Seconds from ``now`` to the next ``hour``:00 in ``now``'s timezone."""
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
 
 
 class Scheduler:
-    def __init__(self, bot, db, dm_queue) -> None:
+    """Runs each guild's cron reminder from one timer loop.
+
+    Each guild's next fire time is kept in the storage, indexed by time. The
+    loop sleeps until the earliest one, fires every guild due by then in
+    batches of ``batch_size`` and stores their following fire times, so
+    neither memory nor startup work grows with the number of scheduled
+    guilds, and fire times survive a restart.
+
+    Guilds sharing a popular cron expression are spread over ``spread``
+    seconds by a fixed per-guild offset. A fire found more than
+    ``misfire_grace_time`` seconds late, as after downtime, follows
+    ``catch_up``: ``"once"`` runs it once now however many fire times were
+    missed, ``"skip"`` drops it. Only guilds on ``shard_ids`` out of
+    ``shard_count`` shards are fired by this process.
+
+    Each run first takes a lease in the shared storage that outlives it by
+    ``lease_ttl`` seconds, so when several processes schedule the same guild
+    only one of them sends. Runs are started through ``dispatcher``, so a
+    cron run joins a run already in flight for the guild and respects its
+    minimum gap between runs.
+
+    APScheduler's cron parser is imported when the first fire time is
+    computed, so a process whose guilds have no cron never loads it.
+    """
+
+    def __init__(
+        self,
+        bot,
+        db: Storage,
+        dispatcher: RunDispatcher,
+        spread: float = 0.0,
+        misfire_grace_time: int = 300,
+        catch_up: str = "once",
+        owner: str | None = None,
+        lease_ttl: float = 55.0,
+        shard_count: int = 1,
+        shard_ids: Sequence[int] = (0,),
+        batch_size: int = 500,
+        timezone: tzinfo | None = None,
+        time_func: Callable[[], float] = time.time,
+    ) -> None:
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy {catch_up!r}")
         self.bot = bot
         self.db = db
-        self.dm_queue = dm_queue
-        self.scheduler = AsyncIOScheduler()
-        self.jobs: Dict[int, str] = {}
+        self.dispatcher = dispatcher
+        self.spread = spread
+        self.misfire_grace_time = misfire_grace_time
+        self.catch_up = catch_up
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        # Below the one minute between two fire times of a cron expression.
+        self.lease_ttl = lease_ttl
+        self.shard_count = shard_count
+        self.shard_ids = list(shard_ids)
+        self.batch_size = batch_size
+        # Of the cron expressions; None is the host's local timezone.
+        self.timezone = timezone
+        # Wall-clock time, comparable between processes and restarts.
+        self.time_func = time_func
+        self._wake = asyncio.Event()
+        self._loop_task: asyncio.Task | None = None
+        self._runs: Set[asyncio.Task] = set()
+        self._maintenance: asyncio.Task | None = None
+        self.logger = logging.getLogger(__name__)
 
     def start(self) -> None:
-        self.scheduler.start()
+        self._loop_task = asyncio.create_task(self._loop())
+
+    def shutdown(self) -> None:
+        for task in (self._maintenance, self._loop_task):
+            if task is not None:
+                task.cancel()
+
+    def _next_fire(self, guild_id: int, cron: str, after: float) -> float | None:
+        from triggers import next_fire_time
 
-    def schedule_guild(self, guild_id: int, cfg: GuildConfig) -> None:
+        offset = spread_offset(guild_id, self.spread)
+        fire_time = next_fire_time(cron, datetime.fromtimestamp(after, UTC), offset, self.timezone)
+        return fire_time.timestamp() if fire_time else None
+
+    async def schedule_guild(self, guild_id: int, cfg: GuildConfig) -> None:
+        """Schedule the guild's next fire after now, or unschedule a guild without a cron.
+
+        Raises ``ValueError`` for an invalid cron expression.
+        """
         if not cfg.schedule_cron:
+            await self.cancel_guild(guild_id)
             return
-        self.cancel_guild(guild_id)
-        trigger = CronTrigger.from_crontab(cfg.schedule_cron)
-        job = self.scheduler.add_job(self._run_job, trigger, args=[guild_id])
-        self.jobs[guild_id] = job.id
+        await self.db.set_next_fires([(guild_id, self._next_fire(guild_id, cfg.schedule_cron, self.time_func()))])
+        self._wake.set()
+
+    async def cancel_guild(self, guild_id: int) -> None:
+        await self.db.set_next_fires([(guild_id, None)])
+
+    async def _loop(self) -> None:
+        try:
+            await self._schedule_missing()
+        except Exception:
+            self.logger.exception("Scheduling guilds without a fire time failed")
+        while True:
+            # Cleared before reading the schedule, so a change made while
+            # this tick runs still wakes the next wait.
+            self._wake.clear()
+            try:
+                next_at = await self.tick()
+            except Exception:
+                self.logger.exception("Scheduler tick failed")
+                next_at = self.time_func() + MAX_SLEEP
+            timeout = MAX_SLEEP if next_at is None else min(max(next_at - self.time_func(), 0.0), MAX_SLEEP)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), timeout)
+
+    async def _schedule_missing(self) -> None:
+        """Give a fire time to every guild whose cron has none yet, e.g. one
+        set before fire times were stored."""
+        now = self.time_func()
+        fires: List[Tuple[int, float | None]] = []
+        for guild_id, cron in await self.db.unscheduled_crons(self.shard_count, self.shard_ids):
+            try:
+                fires.append((guild_id, self._next_fire(guild_id, cron, now)))
+            except ValueError:
+                self.logger.warning("Invalid cron %r for guild %s", cron, guild_id)
+        if fires:
+            await self.db.set_next_fires(fires)
+
+    async def tick(self) -> float | None:
+        """Fire every guild due by now; returns the next fire time, if any."""
+        while True:
+            now = self.time_func()
+            due = await self.db.due_fires(now, self.shard_count, self.shard_ids, self.batch_size)
+            if due:
+                await self._fire(due, now)
+            if len(due) < self.batch_size:
+                return await self.db.next_fire_at(self.shard_count, self.shard_ids)
+
+    async def _fire(self, due: List[Tuple[int, float]], now: float) -> None:
+        fires: List[Tuple[int, float | None]] = []
+        to_run: List[int] = []
+        configs = await self.dispatcher.configs.get_guild_configs(guild_id for guild_id, _ in due)
+        for guild_id, fire_at in due:
+            cfg = configs.get(guild_id)
+            next_at = None
+            if cfg is not None and cfg.schedule_cron:
+                try:
+                    next_at = self._next_fire(guild_id, cfg.schedule_cron, now)
+                except ValueError:
+                    self.logger.warning("Invalid cron %r for guild %s", cfg.schedule_cron, guild_id)
+            fires.append((guild_id, next_at))
+            if next_at is None:
+                continue
+            late = now - fire_at
+            if late > self.misfire_grace_time and self.catch_up == "skip":
+                self.logger.info("Skipped cron run for guild %s missed by %.0fs", guild_id, late)
+                continue
+            metrics.SCHEDULER_LAG.observe(late)
+            to_run.append(guild_id)
+        # Stored before the runs start: a crash in between loses these runs
+        # rather than sending them twice.
+        await self.db.set_next_fires(fires)
+        for guild_id in to_run:
+            task = asyncio.create_task(self._fire_guild(guild_id))
+            self._runs.add(task)
+            task.add_done_callback(self._runs.discard)
 
-    def cancel_guild(self, guild_id: int) -> None:
-        job_id = self.jobs.pop(guild_id, None)
-        if job_id:
-            self.scheduler.remove_job(job_id)
+    async def _fire_guild(self, guild_id: int) -> None:
+        try:
+            await self._run_job(guild_id)
+        except Exception:
+            self.logger.exception("Cron run for guild %s failed", guild_id)
+
+    def schedule_compaction(self, retention_days: int, hour: int = 4, jitter: float = 600.0) -> None:
+        """Once a day after ``hour``:00 UTC, prune ``send_log`` rows older than
+        ``retention_days`` (unless it is 0) and expired undeliverable marks."""
+        self._maintenance = asyncio.create_task(self._maintenance_loop(retention_days, hour, jitter))
+
+    async def _maintenance_loop(self, retention_days: int, hour: int, jitter: float) -> None:
+        while True:
+            await asyncio.sleep(seconds_until(hour, datetime.now(UTC)) + random.uniform(0, jitter))
+            try:
+                await self._compact(retention_days)
+            except Exception:
+                self.logger.exception("Daily maintenance failed")
+
+    async def _compact(self, retention_days: int) -> None:
+        if not await self.db.acquire_lease("maintenance", self.owner, 3600):
+            return
+        if retention_days > 0:
+            deleted = await self.db.compact_send_log(days_ago(retention_days))
+            self.logger.info("Compacted send log: %d rows older than %d days removed", deleted, retention_days)
+        expired = await self.db.purge_undeliverable()
+        self.logger.info("Removed %d expired undeliverable marks", expired)
 
     async def _run_job(self, guild_id: int) -> None:
         guild = self.bot.get_guild(guild_id)
         if guild is None:
             return
-        cfg = await self.db.get_guild_config(guild_id)
-        await self.dm_queue.send(guild, cfg)
-        await self.db.update_guild_config(
-            guild_id, last_sent_at=datetime.now(UTC).isoformat()
-        )
+        # Not released after the run: a late duplicate fire elsewhere must
+        # still find it taken.
+        if not await self.db.acquire_lease(f"cron:{guild_id}", self.owner, self.lease_ttl):
+            self.logger.info("Cron run for guild %s already taken by another process", guild_id)
+            return
+        cfg = await self.dispatcher.configs.get_guild_config(guild_id)
+        try:
+            progress = await self.dispatcher.start(guild, cfg)
+        except RunTooSoon as e:
+            self.logger.info("Cron run for guild %s skipped: %s", guild_id, e)
+            return
+        if progress is not None:
+            await self.dispatcher.wait(progress.run_id)
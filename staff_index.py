@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import discord
+
+
+class StaffIndex:
+    """Per-guild index of non-bot members holding the staff role.
+
+    ``role.members`` scans the guild's whole member cache, so the index is
+    built from it once per guild and then kept current from member and role
+    gateway events. Counts are O(1) and iteration is O(staff).
+
+    With ``chunk`` discord.py keeps no member cache (``MEMBER_CACHE=staff``),
+    so ``role.members`` is empty. ``refresh`` then requests the guild's
+    member list from the gateway without caching it, and the index holds on
+    to the staff members only. Uncached members send no update events, so a
+    run refreshes the index before reading it.
+    """
+
+    def __init__(self, chunk: bool = False) -> None:
+        self.chunk = chunk
+        # guild_id -> (staff_role_id, members by id in insertion order)
+        self._guilds: Dict[int, Tuple[int, Dict[int, discord.Member]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    @property
+    def size(self) -> int:
+        """Staff members indexed across all guilds."""
+        return sum(len(ids) for _, ids in self._guilds.values())
+
+    def _ids(self, guild: discord.Guild, role_id: int | None) -> Dict[int, discord.Member]:
+        if not role_id:
+            return {}
+        entry = self._guilds.get(guild.id)
+        if entry is None or entry[0] != role_id:
+            role = guild.get_role(role_id)
+            if role is None or self.chunk:
+                return {}
+            entry = (role_id, {m.id: m for m in role.members if not m.bot})
+            self._guilds[guild.id] = entry
+        return entry[1]
+
+    async def refresh(self, guild: discord.Guild, role_id: int | None, force: bool = False) -> None:
+        """With ``chunk``, load the guild's staff from the gateway unless
+        already loaded for ``role_id``; ``force`` reloads it."""
+        if not self.chunk or not role_id:
+            return
+        entry = self._guilds.get(guild.id)
+        if entry is not None and entry[0] == role_id and not force:
+            return
+        members = await guild.chunk(cache=False)
+        self._guilds[guild.id] = (role_id, {m.id: m for m in members if not m.bot and m.get_role(role_id)})
+
+    def count(self, guild: discord.Guild, role_id: int | None) -> int:
+        return len(self._ids(guild, role_id))
+
+    def member_ids(self, guild: discord.Guild, role_id: int | None) -> List[int]:
+        return list(self._ids(guild, role_id))
+
+    def members(self, guild: discord.Guild, role_id: int | None) -> List[discord.Member]:
+        members = (self.get_member(guild, member_id) for member_id in self._ids(guild, role_id))
+        return [m for m in members if m is not None]
+
+    def get_member(self, guild: discord.Guild, member_id: int) -> discord.Member | None:
+        """The cached member, or the indexed one where members are not cached."""
+        member = guild.get_member(member_id)
+        if member is None:
+            entry = self._guilds.get(guild.id)
+            member = entry[1].get(member_id) if entry is not None else None
+        return member
+
+    def invalidate(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+    def on_member_update(self, member: discord.Member) -> None:
+        """Apply a join or role change of ``member``."""
+        entry = self._guilds.get(member.guild.id)
+        if entry is None or member.bot:
+            return
+        role_id, ids = entry
+        if member.get_role(role_id) is not None:
+            ids[member.id] = member
+        else:
+            ids.pop(member.id, None)
+
+    def on_member_remove(self, guild_id: int, member_id: int) -> None:
+        entry = self._guilds.get(guild_id)
+        if entry is not None:
+            entry[1].pop(member_id, None)
+
+    def on_role_delete(self, role: discord.Role) -> None:
+        entry = self._guilds.get(role.guild.id)
+        if entry is not None and entry[0] == role.id:
+            self.invalidate(role.guild.id)
@@ -0,0 +1,57 @@
+"""Cold-start helpers: phase timing and command tree sync only on change."""
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from typing import List, Tuple
+
+from storage import Storage
+
+
+class StartupTimer:
+    """Records how long each startup phase took, in the order they ran."""
+
+    def __init__(self, start: float | None = None) -> None:
+        self.start = time.perf_counter() if start is None else start
+        self._last = self.start
+        self.phases: List[Tuple[str, float]] = []
+
+    def lap(self, phase: str) -> float:
+        """End ``phase`` now; it started where the previous one ended."""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.phases.append((phase, elapsed))
+        return elapsed
+
+    def skip(self, phase: str) -> None:
+        """Note a phase that did not need to run."""
+        self.lap(phase + " (skipped)")
+
+    def report(self) -> str:
+        total = self._last - self.start
+        parts = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        return f"Started in {total:.2f}s: {parts}"
+
+
+def command_tree_hash(tree) -> str:
+    """Hash of the payload ``tree.sync()`` would upload for the global commands."""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_commands(tree, db: Storage, application_id: int | None) -> bool:
+    """Sync ``tree`` with Discord unless it is unchanged since the last sync.
+
+    The hash of the last synced tree is kept per application in ``db``, so a
+    restart with the same commands skips the rate-limited sync call. Returns
+    whether a sync was made.
+    """
+    key = f"command_tree_hash:{application_id}"
+    digest = command_tree_hash(tree)
+    if await db.get_meta(key) == digest:
+        return False
+    await tree.sync()
+    await db.set_meta(key, digest)
+    return True
@@ -0,0 +1,109 @@
+"""The storage interface the bot is written against.
+
+``db.Database`` (SQLite) implements it. Every process of a sharded
+deployment may share one store: writes are transactional, run jobs are
+claimed atomically, and ``acquire_lease`` lets exactly one process act on a
+named task such as a guild's cron run.
+"""
+from __future__ import annotations
+
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Protocol, Sequence, Set, Tuple
+
+from config import GuildConfig
+
+
+class Storage(Protocol):
+    async def connect(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    # Guild configuration
+    async def get_guild_config(self, guild_id: int) -> GuildConfig: ...
+
+    async def get_guild_configs(self, guild_ids: Iterable[int]) -> List[GuildConfig]: ...
+
+    async def upsert_guild_config(self, cfg: GuildConfig) -> None: ...
+
+    async def bulk_upsert_guild_configs(self, configs: Iterable[GuildConfig]) -> None: ...
+
+    # Runs and their per-member jobs
+    async def create_run(self, guild_id: int, user_ids: Iterable[int], skipped: int = 0) -> int: ...
+
+    async def get_run_jobs(self, run_id: int, status: str = "pending") -> List[int]: ...
+
+    async def claim_jobs(self, run_id: int, user_ids: Sequence[int]) -> Set[int]: ...
+
+    async def release_jobs(self, run_id: int, user_ids: Sequence[int]) -> None: ...
+
+    async def run_counts(self, run_id: int) -> Dict[str, int]: ...
+
+    async def run_skipped(self, run_id: int) -> int: ...
+
+    async def last_sent(self, guild_id: int) -> Dict[int, str]: ...
+
+    async def finish_run(self, run_id: int, status: str = "done") -> None: ...
+
+    async def unfinished_runs(self) -> List[Tuple[int, int]]: ...
+
+    async def recover_run(self, run_id: int) -> None: ...
+
+    # Send log and stats
+    async def log_send(
+        self, guild_id: int, user_id: int, status: str, error: Optional[str], run_id: Optional[int] = None
+    ) -> None: ...
+
+    async def flush_send_log(self) -> None: ...
+
+    async def send_stats(self, guild_id: int, days: Optional[int] = None) -> Tuple[int, int]: ...
+
+    async def recent_runs(self, guild_id: int, limit: int = 10) -> List[Tuple[int, str, str, int, int, int]]: ...
+
+    async def run_send_history(
+        self, guild_id: int, since: str, limit: int = 20
+    ) -> List[Tuple[int, int, int, str, str]]: ...
+
+    async def last_run_sizes(self, guild_ids: Iterable[int]) -> Dict[int, int]: ...
+
+    def iter_send_log(
+        self, guild_id: int, since: Optional[str] = None, until: Optional[str] = None, chunk_size: int = 1000
+    ) -> AsyncIterator[List[Tuple[str, int, str, Optional[str], Optional[int]]]]: ...
+
+    async def compact_send_log(self, before: str) -> int: ...
+
+    # Delivery state
+    async def mark_undeliverable(self, guild_id: int, user_id: int, code: int, reason: str, ttl: float) -> None: ...
+
+    async def undeliverable_ids(self, guild_id: int) -> Set[int]: ...
+
+    async def purge_undeliverable(self) -> int: ...
+
+    async def get_dm_channels(self) -> Dict[int, int]: ...
+
+    async def save_dm_channel(self, user_id: int, channel_id: int) -> None: ...
+
+    async def forget_dm_channel(self, user_id: int) -> None: ...
+
+    # Persisted cron fire times, for the guilds of the given shards
+    async def set_next_fires(self, fires: Iterable[Tuple[int, Optional[float]]]) -> None: ...
+
+    async def next_fire_at(self, shard_count: int = 1, shard_ids: Sequence[int] = (0,)) -> Optional[float]: ...
+
+    async def due_fires(
+        self, now: float, shard_count: int = 1, shard_ids: Sequence[int] = (0,), limit: int = 500
+    ) -> List[Tuple[int, float]]: ...
+
+    async def scheduled_between(
+        self, start: float, end: float, shard_count: int = 1, shard_ids: Sequence[int] = (0,)
+    ) -> List[int]: ...
+
+    async def unscheduled_crons(self, shard_count: int = 1, shard_ids: Sequence[int] = (0,)) -> List[Tuple[int, str]]: ...
+
+    # Coordination between processes
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool: ...
+
+    async def release_lease(self, name: str, owner: str) -> None: ...
+
+    # Small key/value state of the bot itself, e.g. the synced command tree hash
+    async def get_meta(self, key: str) -> Optional[str]: ...
+
+    async def set_meta(self, key: str, value: str) -> None: ...
@@ -0,0 +1,297 @@
+"""Minimal stand-ins for the discord.py objects the bot touches."""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import random
+
+import discord
+
+_real_sleep = asyncio.sleep
+
+
+class VirtualClock:
+    """Monotonic clock whose ``sleep`` jumps time forward instead of waiting.
+
+    Sleepers are woken in deadline order. Time only advances once the event
+    loop has had a brief real pause to finish other work, and never while
+    ``busy()`` reports work running outside the loop (such as aiosqlite calls
+    in their thread), so that work takes no virtual time.
+    """
+
+    def __init__(self, start: float = 0.0, settle: float = 0.0005, busy=None) -> None:
+        self.now = start
+        self.settle = settle
+        self.busy = busy
+        self._sleepers: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = 0
+        self._driver: asyncio.Task | None = None
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float, result=None):
+        if delay <= 0:
+            await _real_sleep(0)
+            return result
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._sleepers, (self.now + delay, self._seq, fut))
+        if self._driver is None or self._driver.done():
+            self._driver = asyncio.create_task(self._drive())
+        await fut
+        return result
+
+    async def _drive(self) -> None:
+        while self._sleepers:
+            await _real_sleep(self.settle)
+            if self.busy is not None and self.busy():
+                continue
+            # Tasks woken but not yet run (a queue getter, say) would see the jump.
+            if asyncio.get_running_loop()._ready:
+                continue
+            if not self._sleepers:
+                break
+            deadline, _, fut = heapq.heappop(self._sleepers)
+            if fut.done():
+                # A cancelled sleep, such as a flush timer; time does not advance for it.
+                continue
+            self.now = max(self.now, deadline)
+            fut.set_result(None)
+
+
+def track_db_calls(db, clock: VirtualClock) -> None:
+    """Hold the virtual clock while a query runs in an aiosqlite thread."""
+    in_flight = 0
+
+    def track(conn) -> None:
+        execute = conn._execute
+
+        async def tracked(fn, *args, **kwargs):
+            nonlocal in_flight
+            in_flight += 1
+            try:
+                return await execute(fn, *args, **kwargs)
+            finally:
+                in_flight -= 1
+
+        conn._execute = tracked
+
+    for conn in db.connections:
+        track(conn)
+    clock.busy = lambda: in_flight > 0
+
+
+class FakeResponse:
+    def __init__(self, status: int, reason: str = "", headers=None) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeHTTP:
+    """Discord HTTP, as seen through discord.py, with one bucket of ``limit``
+    requests per ``window``.
+
+    Like Discord, the window opens on the first request, and every response
+    carries ``X-RateLimit-*`` headers; like discord.py, a request on an
+    exhausted bucket waits for it to reset instead of getting a 429. Each
+    request takes ``latency`` seconds of (virtual) time. On top of the
+    bucket, ``rate_429`` injects random 429s lasting ``retry_after`` seconds.
+    discord.py sleeps through those and retries, up to 5 tries, unless
+    ``retry_after`` exceeds ``max_ratelimit_timeout``; then it raises
+    ``RateLimited``. A ``forbidden_rate`` share of users have DMs closed (403,
+    code 50007).
+    """
+
+    def __init__(
+        self,
+        clock: VirtualClock,
+        limit: int = 5,
+        window: float = 5.0,
+        latency: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: float = 1.0,
+        forbidden_rate: float = 0.0,
+        seed: int = 0,
+        record: bool = True,
+        max_ratelimit_timeout: float | None = 30.0,
+    ) -> None:
+        self.clock = clock
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.max_ratelimit_timeout = max_ratelimit_timeout
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.record = record
+        self.window_start: float | None = None
+        self.used = 0
+        self.requests: list[tuple[float, str]] = []
+        self.request_count = 0
+        self.rate_limited = 0
+        self.forbidden = 0
+        self.channel_opens = 0
+
+    def _headers(self, remaining: int, reset_after: float) -> dict:
+        return {
+            "X-RateLimit-Bucket": "fake-dm-bucket",
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Scope": "user",
+        }
+
+    def _rate_limited(self, headers: dict, retry_after: float) -> discord.HTTPException:
+        self.rate_limited += 1
+        headers["Retry-After"] = str(int(retry_after) + 1)
+        return discord.HTTPException(
+            FakeResponse(429, "Too Many Requests", headers),
+            {"message": "You are being rate limited.", "retry_after": retry_after, "global": False, "code": 0},
+        )
+
+    def dms_closed(self, key: str) -> bool:
+        """Whether the user behind ``key`` has DMs closed; fixed per user."""
+        if not self.forbidden_rate:
+            return False
+        return random.Random(f"{self.seed}:{key}").random() < self.forbidden_rate
+
+    async def request(self, key: str) -> dict:
+        tries = 0
+        while True:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            # discord.py waits out a bucket the last response showed exhausted.
+            while self.used >= self.limit and self.clock.time() < self.window_start + self.window:
+                await asyncio.sleep(self.window_start + self.window - self.clock.time())
+            now = self.clock.time()
+            if self.window_start is None or now >= self.window_start + self.window:
+                self.window_start = now
+                self.used = 0
+            reset_after = self.window_start + self.window - now
+            if self.rate_429 and self.random.random() < self.rate_429:
+                tries += 1
+                if self.max_ratelimit_timeout is not None and self.retry_after > self.max_ratelimit_timeout:
+                    self.rate_limited += 1
+                    raise discord.RateLimited(self.retry_after)
+                if tries == 5:
+                    raise self._rate_limited(self._headers(0, self.retry_after), self.retry_after)
+                self.rate_limited += 1
+                await asyncio.sleep(self.retry_after)
+                continue
+            self.used += 1
+            self.request_count += 1
+            if self.record:
+                self.requests.append((now, key))
+            if self.dms_closed(key):
+                self.forbidden += 1
+                raise discord.Forbidden(
+                    FakeResponse(403, "Forbidden"),
+                    {"message": "Cannot send messages to this user", "code": 50007},
+                )
+            return self._headers(self.limit - self.used, reset_after)
+
+
+class FakeDMChannel:
+    """DM channel of ``member``; ``member=None`` stands for a deleted channel."""
+
+    def __init__(self, channel_id: int, member: "FakeMember | None") -> None:
+        self.id = channel_id
+        self.member = member
+
+    async def send(self, content: str) -> None:
+        if self.member is None:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), {"message": "Unknown Channel", "code": 10003})
+        await self.member.send(content)
+
+
+class FakeMember:
+    def __init__(
+        self, member_id: int, name: str | None = None, bot: bool = False, roles=(), http: FakeHTTP | None = None
+    ) -> None:
+        self.id = member_id
+        self.display_name = name or f"member{member_id}"
+        self.bot = bot
+        self.roles = list(roles)
+        self.received: list[str] = []
+        self.http = http
+        self.guild = None
+        self.dm_channel: FakeDMChannel | None = None
+
+    def __str__(self) -> str:
+        return self.display_name
+
+    def get_role(self, role_id: int):
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    async def create_dm(self) -> FakeDMChannel:
+        if self.dm_channel is None:
+            if self.http is not None:
+                self.http.channel_opens += 1
+                if self.http.latency:
+                    await asyncio.sleep(self.http.latency)
+            self.dm_channel = FakeDMChannel(self.id + 1, self)
+        return self.dm_channel
+
+    async def send(self, content: str) -> None:
+        if self.http is not None:
+            await self.http.request(str(self.id))
+        self.received.append(content)
+
+
+class FakeRole:
+    def __init__(self, role_id: int, members=()) -> None:
+        self.id = role_id
+        self.members = list(members)
+        self.guild = None
+        self.mention = f"<@&{role_id}>"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str = "Guild", roles=(), members=()) -> None:
+        self.id = guild_id
+        self.name = name
+        self._roles = {r.id: r for r in roles}
+        self._members = {m.id: m for m in members}
+        self._channels = {}
+        for role in self._roles.values():
+            role.guild = self
+        for member in self._members.values():
+            member.guild = self
+
+    def get_role(self, role_id: int):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id: int):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id: int):
+        return self._channels.get(channel_id)
+
+    async def chunk(self, *, cache: bool = True):
+        return list(self._members.values())
+
+
+def staff_guild(guild_id: int, count: int, role_id: int = 100, http: FakeHTTP | None = None) -> FakeGuild:
+    """Build a guild whose staff role holds ``count`` members."""
+    members = [FakeMember(guild_id * 100_000 + i, http=http) for i in range(count)]
+    role = FakeRole(role_id, members)
+    for m in members:
+        m.roles.append(role)
+    return FakeGuild(guild_id, f"Guild {guild_id}", roles=[role], members=members)
+
+
+class FakeClient:
+    """Resolves DM channel ids of the members of ``guilds`` like the bot would."""
+
+    def __init__(self, guilds) -> None:
+        self._channels = {m.id + 1: m for g in guilds for m in g._members.values()}
+
+    def get_partial_messageable(self, channel_id: int, *, guild_id=None, type=None) -> FakeDMChannel:
+        member = self._channels.get(channel_id)
+        if member is None or member.dm_channel is None:
+            return FakeDMChannel(channel_id, None)
+        return member.dm_channel
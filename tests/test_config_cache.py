@@ -0,0 +1,75 @@
+import asyncio
+
+from cache import GuildConfigCache
+from config import GuildConfig
+from db import Database
+
+
+def test_cache_hits_write_through_and_lru(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        cache = GuildConfigCache(db, max_size=2)
+
+        await cache.get_guild_config(1)
+        await cache.get_guild_config(1)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        await cache.update_guild_config(1, staff_role_id=42)
+        assert (await db.get_guild_config(1)).staff_role_id == 42
+
+        await cache.get_guild_config(2)
+        await cache.get_guild_config(1)  # 1 becomes most recently used
+        await cache.get_guild_config(3)
+        assert 1 in cache and 3 in cache and 2 not in cache
+
+        cache.evict(1)
+        assert 1 not in cache
+
+        # A batch read serves cached guilds and loads the rest in one query.
+        configs = await cache.get_guild_configs([1, 3, 99])
+        assert configs.keys() == {1, 3} and configs[1].staff_role_id == 42
+        assert (cache.hits, cache.misses) == (4, 5)
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_bulk_upsert_and_reads_from_the_reader_pool(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"), readers=2)
+        await db.connect()
+        await db.bulk_upsert_guild_configs(GuildConfig(guild_id=g, staff_role_id=g * 10) for g in range(1, 1001))
+        configs = await db.get_guild_configs([5, 999, 5000])
+        assert sorted((c.guild_id, c.staff_role_id) for c in configs) == [(5, 50), (999, 9990)]
+
+        # Readers see committed data only and are not blocked by an open write.
+        async with db.write_lock:
+            await db.conn.execute("UPDATE guild_config SET staff_role_id=1 WHERE guild_id=5")
+            cfg = await asyncio.wait_for(db.get_guild_config(5), 1)
+            assert cfg.staff_role_id == 50
+            await db.conn.commit()
+        assert (await db.get_guild_config(5)).staff_role_id == 1
+        assert len(db.connections) == 3
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_run_jobs_are_visible_while_a_reader_is_busy(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"), readers=1)
+        await db.connect()
+        try:
+            await db.bulk_upsert_guild_configs(GuildConfig(guild_id=g) for g in range(1, 4))
+            # A statement left open keeps its reader on an older snapshot.
+            cur = await db._readers[0].execute("SELECT guild_id FROM guild_config")
+            await cur.fetchone()
+            run_id = await db.create_run(1, [10, 11])
+            assert await db.get_run_jobs(run_id) == [10, 11]
+            assert await db.run_counts(run_id) == {"pending": 2}
+            await cur.close()
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from cache import GuildConfigCache
+from db import Database
+from dispatcher import RunDispatcher, RunTooSoon
+from dm_queue import DMQueue, RateLimiter
+from fake_discord import staff_guild
+
+
+def test_dispatch_reports_progress_and_cancels(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        configs = GuildConfigCache(db)
+        cfg = await configs.update_guild_config(1, staff_role_id=100)
+        guild = staff_guild(1, 10)
+        dispatcher = RunDispatcher(DMQueue(db, RateLimiter(0.0)), configs, progress_interval=0.0)
+
+        reports = []
+
+        async def on_progress(progress):
+            reports.append((progress.sent, progress.remaining, progress.done))
+            if progress.sent == 3:
+                dispatcher.cancel(progress.run_id)
+
+        try:
+            progress = await dispatcher.start(guild, cfg, on_progress)
+            assert dispatcher.active_run(1) is progress
+            await dispatcher.wait(progress.run_id)
+
+            # Outcomes are recorded behind the send stage, so a DM or two may
+            # already be out when the cancel is seen; no more start after it.
+            assert progress.cancelled and progress.done
+            assert 3 <= progress.sent < 10
+            assert reports[-1] == (progress.sent, 10 - progress.sent, True)
+            assert sum(len(m.received) for m in guild.get_role(100).members) == progress.sent
+            assert dispatcher.active_run(1) is None
+            assert await db.unfinished_runs() == []
+            # Only complete runs count as the last send for delta runs.
+            assert (await configs.get_guild_config(1)).last_sent_at is None
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_triggers_join_one_run_and_min_gap(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            configs = GuildConfigCache(db)
+            cfg = await configs.update_guild_config(1, staff_role_id=100)
+            guild = staff_guild(1, 5)
+            dispatcher = RunDispatcher(DMQueue(db, RateLimiter(0.0)), configs, progress_interval=0.0, min_gap=3600)
+            finals = []
+
+            async def on_progress(progress):
+                if progress.done:
+                    finals.append(progress.run_id)
+
+            first, second = await asyncio.gather(
+                dispatcher.start(guild, cfg, on_progress), dispatcher.start(guild, cfg, on_progress)
+            )
+            assert first is second
+            third = dispatcher.join(1, on_progress)
+            assert third is first
+            await dispatcher.wait(first.run_id)
+
+            assert finals == [first.run_id] * 3
+            assert [len(m.received) for m in guild.get_role(100).members] == [1] * 5
+            assert len(await db.recent_runs(1)) == 1
+            assert dispatcher.join(1) is None
+
+            # The complete run set last_sent_at, so the next one is too soon.
+            with pytest.raises(RunTooSoon) as e:
+                await dispatcher.start(guild, cfg)
+            assert 3500 < e.value.retry_after <= 3600
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_failed_run_is_closed_instead_of_left_for_resume(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            configs = GuildConfigCache(db)
+            cfg = await configs.update_guild_config(1, staff_role_id=100)
+            dispatcher = RunDispatcher(DMQueue(db, RateLimiter(0.0)), configs, progress_interval=0.0)
+
+            async def failing_claim(run_id, user_ids):
+                raise RuntimeError("database is locked")
+
+            db.claim_jobs = failing_claim
+            progress = await dispatcher.start(staff_guild(1, 5), cfg)
+            await dispatcher.wait(progress.run_id)
+            assert await db.unfinished_runs() == []
+            assert (await db.recent_runs(1))[0][1] == "cancelled"
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,196 @@
+import asyncio
+
+import discord
+
+from config import GuildConfig
+from db import Database
+from dm_queue import DMQueue, RateLimiter, RunProgress
+from fake_discord import FakeClient, FakeHTTP, FakeResponse, VirtualClock, staff_guild, track_db_calls
+
+
+def test_resume_skips_claimed_and_sent_members(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        guild = staff_guild(1, 4)
+        members = guild.get_role(100).members
+        cfg = GuildConfig(guild_id=1, staff_role_id=100)
+
+        # Simulate a crash: one member sent, one claimed but unconfirmed.
+        run_id = await db.create_run(1, [m.id for m in members])
+        assert await db.claim_jobs(run_id, [members[0].id]) == {members[0].id}
+        await db.log_send(1, members[0].id, "sent", None, run_id)
+        await db.flush_send_log()
+        assert await db.claim_jobs(run_id, [members[1].id]) == {members[1].id}
+        assert await db.claim_jobs(run_id, [members[1].id]) == set()
+        assert await db.unfinished_runs() == [(run_id, 1)]
+
+        queue = DMQueue(db, RateLimiter(0.0))
+        total, sent, failed, _ = await queue.resume(guild, cfg, run_id)
+
+        assert (total, sent, failed) == (4, 3, 1)
+        assert [len(m.received) for m in members] == [0, 0, 1, 1]
+        assert await db.unfinished_runs() == []
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_permanently_undeliverable_members_are_skipped(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        guild = staff_guild(1, 4)
+        closed = guild.get_role(100).members[0]
+
+        async def send(content):
+            raise discord.Forbidden(FakeResponse(403, "Forbidden"), {"message": "closed", "code": 50007})
+
+        closed.send = send
+        cfg = GuildConfig(guild_id=1, staff_role_id=100)
+        queue = DMQueue(db, RateLimiter(0.0))
+
+        assert (await queue.send(guild, cfg))[:3] == (4, 3, 1)
+        assert await db.undeliverable_ids(1) == {closed.id}
+        assert (await queue.send(guild, cfg))[:3] == (3, 3, 0)
+        assert (await db.recent_runs(1))[0][3:] == (3, 0, 1)
+
+        # Once the mark expires the member is tried (and marked) again.
+        await db.conn.execute("UPDATE undeliverable SET expires_at='2000-01-01 00:00:00'")
+        assert await db.purge_undeliverable() == 1
+        assert (await queue.send(guild, cfg))[:3] == (4, 3, 1)
+        assert await db.undeliverable_ids(1) == {closed.id}
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_saved_dm_channels_are_reused_after_restart(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        guild = staff_guild(1, 3)
+        members = guild.get_role(100).members
+        cfg = GuildConfig(guild_id=1, staff_role_id=100)
+        opened = []
+        for m in members:
+            create_dm = m.create_dm
+
+            async def counted(create_dm=create_dm, m=m):
+                opened.append(m.id)
+                return await create_dm()
+
+            m.create_dm = counted
+
+        await DMQueue(db, RateLimiter(0.0), client=FakeClient([guild])).send(guild, cfg)
+        assert len(opened) == 3
+        saved = await db.get_dm_channels()
+        assert saved == {m.id: m.dm_channel.id for m in members}
+
+        # A new process sends straight to the saved channels; a stale one is reopened.
+        opened.clear()
+        queue = DMQueue(db, RateLimiter(0.0), client=FakeClient([guild]))
+        queue.dm_channels.update(saved)
+        queue.dm_channels[members[0].id] = 999
+        assert (await queue.send(guild, cfg))[:3] == (3, 3, 0)
+        assert opened == [members[0].id]
+        assert [len(m.received) for m in members] == [2, 2, 2]
+        assert await db.get_dm_channels() == saved
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_closed_dms_on_a_saved_channel_are_not_retried(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            http = FakeHTTP(VirtualClock(), forbidden_rate=1.0)
+            guild = staff_guild(1, 1, http=http)
+            [member] = guild.get_role(100).members
+            member.dm_channel = await member.create_dm()
+            queue = DMQueue(db, RateLimiter(0.0), client=FakeClient([guild]))
+            queue.dm_channels[member.id] = member.dm_channel.id
+            opens = http.channel_opens
+
+            assert (await queue.send(guild, GuildConfig(guild_id=1, staff_role_id=100)))[:3] == (1, 0, 1)
+            assert (http.request_count, http.channel_opens) == (1, opens)
+            assert await db.undeliverable_ids(1) == {member.id}
+            assert queue.dm_channels == {member.id: member.dm_channel.id}
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_stale_first_order_delta_runs_and_time_budget(tmp_path, monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(asyncio, "sleep", clock.sleep)
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        track_db_calls(db, clock)
+        try:
+            guild = staff_guild(1, 5)
+            ids = [m.id for m in guild.get_role(100).members]
+            cfg = GuildConfig(guild_id=1, staff_role_id=100, last_sent_at="2000-01-01T00:00:00+00:00")
+
+            # A crashed run reached the last two members.
+            run_id = await db.create_run(1, ids)
+            for user_id in ids[3:]:
+                await db.log_send(1, user_id, "sent", None, run_id)
+            await db.flush_send_log()
+            await db.finish_run(run_id, "cancelled")
+
+            queue = DMQueue(db, RateLimiter(1.0, clock.time))
+            full = await queue.enqueue(guild, cfg)
+            assert (await db.get_run_jobs(full))[:3] == ids[:3]
+            await db.finish_run(full, "cancelled")
+            delta = await queue.enqueue(guild, cfg, delta=True)
+            assert await db.get_run_jobs(delta) == ids[:3]
+            await db.finish_run(delta, "cancelled")
+
+            total, sent, failed, eta = await queue.send(guild, cfg, budget=1.5)
+            assert (total, sent, failed) == (5, 2, 0)
+            # Three members left at the measured one per second.
+            assert 2.5 <= eta <= 3.5
+            assert [len(m.received) for m in guild.get_role(100).members] == [1, 1, 0, 0, 0]
+            # The members claimed ahead but not reached are released, not left claimed.
+            run_id = (await db.recent_runs(1))[0][0]
+            assert await db.run_counts(run_id) == {"sent": 2, "pending": 3}
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_slow_bookkeeping_overlaps_the_next_send(tmp_path, monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(asyncio, "sleep", clock.sleep)
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        track_db_calls(db, clock)
+        try:
+            guild = staff_guild(1, 5, http=FakeHTTP(clock, latency=0.5, limit=100))
+            cfg = GuildConfig(guild_id=1, staff_role_id=100)
+            queue = DMQueue(db, RateLimiter(1.0, clock.time))
+            run_id = await queue.enqueue(guild, cfg)
+            progress = RunProgress(run_id, 1, clock.time)
+
+            async def on_progress(progress):
+                await asyncio.sleep(0.9)  # e.g. editing the interaction response
+
+            assert (await queue.process_run(guild, cfg, run_id, progress, on_progress))[:3] == (5, 5, 0)
+            # Opening the DM channel and sending take 0.5s each. DMs still go
+            # out one slot apart, each reported while the next is sent: 4
+            # slots + 1s + 0.9s for the last report. Sending and reporting in
+            # turn would take 5 * (1 + 0.9) = 9.5s.
+            assert progress.elapsed <= 6.0
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+from db import Database
+from export import day_range, export_send_log, main, write_send_log
+
+
+async def _history(db):
+    days = ["2024-01-01 10:00:00", "2024-01-02 10:00:00", "2024-01-02 23:59:59", "2024-01-03 00:00:00"]
+    for i, day in enumerate(days):
+        await db.log_send(1, 100 + i, "failed" if i == 1 else "sent", "Forbidden" if i == 1 else None)
+        await db.log_send(2, 200 + i, "sent", None)
+    await db.flush_send_log()
+    for i, day in enumerate(days):
+        await db.conn.execute("UPDATE send_log SET sent_at=? WHERE user_id IN (?,?)", (day, 100 + i, 200 + i))
+    await db.conn.commit()
+
+
+def test_export_streams_a_guild_date_range_in_chunks():
+    async def run():
+        db = Database(":memory:")
+        await db.connect()
+        try:
+            await _history(db)
+            out = io.StringIO()
+            since, until = day_range("2024-01-02", "2024-01-02")
+            assert await write_send_log(db, 1, out, "csv", since, until, chunk_size=1) == 2
+            rows = list(csv.reader(io.StringIO(out.getvalue())))
+            assert rows[0] == ["sent_at", "user_id", "status", "error", "run_id"]
+            assert [r[1:4] for r in rows[1:]] == [["101", "failed", "Forbidden"], ["102", "sent", ""]]
+
+            chunks = [len(c) async for c in db.iter_send_log(1, chunk_size=3)]
+            assert chunks == [3, 1]
+
+            export = await export_send_log(db, 1, "jsonl")
+            with export.file:
+                assert not export.compressed and export.filename == "send-log-1.jsonl"
+                lines = export.file.read().decode().splitlines()
+            assert [json.loads(line)["user_id"] for line in lines] == [100, 101, 102, 103]
+            assert export.rows == 4
+
+            export = await export_send_log(db, 2, "csv", gzip_threshold=0)
+            with export.file:
+                assert export.compressed and export.filename == "send-log-2.csv.gz"
+                data = gzip.decompress(export.file.read()).decode()
+            assert data.count("\n") == 5
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_export_cli_writes_gzip_file(tmp_path):
+    path = str(tmp_path / "bot.db")
+
+    async def setup():
+        db = Database(path)
+        await db.connect()
+        try:
+            await _history(db)
+        finally:
+            await db.close()
+
+    asyncio.run(setup())
+    out = tmp_path / "out.jsonl.gz"
+    main(["--db", path, "--guild", "2", "--format", "jsonl", "--since", "2024-01-03", "-o", str(out)])
+    rows = [json.loads(line) for line in gzip.decompress(out.read_bytes()).splitlines()]
+    assert [r["user_id"] for r in rows] == [203]
+
+
+def test_open_export_does_not_pin_pooled_readers_to_its_snapshot(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            await _history(db)
+            await db.update_guild_config(5, staff_role_id=1)
+            rows = db.iter_send_log(1, chunk_size=1)
+            assert len(await rows.__anext__()) == 1
+            await db.update_guild_config(5, staff_role_id=2)
+            # Every pooled reader sees the commit made while the export is open.
+            for _ in db._readers:
+                assert (await db.get_guild_config(5)).staff_role_id == 2
+            assert len([r async for r in rows]) == 3
+        finally:
+            await db.close()
+
+    asyncio.run(run())
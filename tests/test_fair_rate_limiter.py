@@ -0,0 +1,75 @@
+import asyncio
+
+from dm_queue import RateLimiter
+from fake_discord import FakeHTTP, VirtualClock, track_db_calls
+from ratelimit import FairRateLimiter
+
+
+def test_guilds_are_served_round_robin(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(asyncio, "sleep", clock.sleep)
+    limiter = FairRateLimiter(RateLimiter(1.0, clock.time))
+    order = []
+
+    async def run_guild(guild_id, count):
+        for _ in range(count):
+            await limiter.acquire(guild_id)
+            order.append(guild_id)
+
+    async def run():
+        await asyncio.gather(run_guild(1, 6), run_guild(2, 2), run_guild(3, 2))
+
+    asyncio.run(run())
+    assert order[:6] == [1, 2, 3, 1, 2, 3]
+    assert order[6:] == [1, 1, 1, 1]
+    assert limiter.slot_interval() == 1.0
+
+
+def test_raised_429_pauses_every_guild(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(asyncio, "sleep", clock.sleep)
+    limiter = FairRateLimiter(RateLimiter(0.5, clock.time))
+    granted = []
+
+    async def run_guild(guild_id, count):
+        for _ in range(count):
+            await limiter.acquire(guild_id)
+            granted.append((clock.time(), guild_id))
+            if len(granted) == 2:
+                limiter.on_429(60.0)
+
+    async def run():
+        await asyncio.gather(run_guild(1, 2), run_guild(2, 2))
+
+    asyncio.run(run())
+    assert [g for _, g in granted] == [1, 2, 1, 2]
+    assert granted[2][0] >= granted[1][0] + 60.0
+    assert len(limiter.buckets) == 0
+
+
+def test_dm_queue_retries_429_and_delivers_everyone(monkeypatch, tmp_path):
+    from config import GuildConfig
+    from db import Database
+    from dm_queue import DMQueue
+    from fake_discord import staff_guild
+
+    clock = VirtualClock()
+    monkeypatch.setattr(asyncio, "sleep", clock.sleep)
+    http = FakeHTTP(clock, limit=3, window=6.0, rate_429=0.3, retry_after=45.0)
+    guilds = [staff_guild(1, 6, http=http), staff_guild(2, 6, http=http)]
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        track_db_calls(db, clock)
+        queue = DMQueue(db, RateLimiter(0.5, clock.time))
+        results = await asyncio.gather(
+            *(queue.send(g, GuildConfig(guild_id=g.id, staff_role_id=100)) for g in guilds)
+        )
+        await db.close()
+        return results
+
+    results = asyncio.run(run())
+    assert [r[:3] for r in results] == [(6, 6, 0), (6, 6, 0)]
+    # 429s longer than max_ratelimit_timeout reach the queue, which retries.
+    assert http.rate_limited >= 1
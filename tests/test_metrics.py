@@ -0,0 +1,43 @@
+import asyncio
+
+import aiohttp
+
+from metrics import Counter, Gauge, Histogram, Registry, start_http_server
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    dms = Counter("dms_total", "DMs", ("guild", "status"), registry=registry)
+    depth = Gauge("depth", "Queue depth", registry=registry)
+    wait = Histogram("wait_seconds", "Wait", buckets=(0.1, 1.0), registry=registry)
+    dms.inc(guild=1, status="sent")
+    dms.inc(2, guild=1, status="sent")
+    depth.set_function(lambda: 4)
+    wait.observe(0.05)
+    wait.observe(0.5)
+    wait.observe(5)
+
+    text = registry.render()
+    assert '# TYPE dms_total counter' in text
+    assert 'dms_total{guild="1",status="sent"} 3' in text
+    assert "depth 4" in text
+    assert 'wait_seconds_bucket{le="0.1"} 1' in text
+    assert 'wait_seconds_bucket{le="1.0"} 2' in text
+    assert 'wait_seconds_bucket{le="+Inf"} 3' in text
+    assert "wait_seconds_count 3" in text
+
+
+def test_metrics_endpoint_serves_registry():
+    registry = Registry()
+    Counter("up_total", "Up", registry=registry).inc()
+
+    async def run():
+        runner = await start_http_server("127.0.0.1", 0, registry)
+        port = runner.addresses[0][1]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                body = await resp.text()
+        await runner.cleanup()
+        return body
+
+    assert "up_total 1" in asyncio.run(run())
@@ -6,3 +6,24 @@ def test_render_message_replaces_placeholders():
     assert "User" in msg
     assert "Guild" in msg
     assert "now_iso" not in msg
+
+
+def test_bound_template_only_varies_user():
+    import pytest
+
+    from config import GuildConfig, TemplateError, compile_template
+
+    cfg = GuildConfig(guild_id=1, reminder_message="Hi {user}\\n{guild} {{x}} {now_iso}")
+    bound = cfg.template.bind("Guild", "T")
+    assert bound.render("A") == "Hi A\nGuild {x} T"
+    assert bound.render("B") == "Hi B\nGuild {x} T"
+
+    cfg.reminder_message = "Bye {user}"
+    assert cfg.template.render("Guild", "A") == "Bye A"
+
+    for bad in ("{foo}", "{user!r}", "{user:>5}", "{"):
+        with pytest.raises(TemplateError):
+            compile_template(bad)
+    cfg.reminder_message = "{foo}"
+    with pytest.raises(TemplateError):
+        cfg.validate()
@@ -0,0 +1,100 @@
+import asyncio
+
+from cache import GuildConfigCache
+from db import Database
+from dispatcher import RunDispatcher
+from dm_queue import DMQueue, RateLimiter
+from fake_discord import staff_guild
+from planner import plan_run
+from scheduler import Scheduler
+
+
+class _Bot:
+    def get_guild(self, guild_id):
+        return None
+
+
+def test_plan_predicts_from_history_without_sending(tmp_path):
+    guild = staff_guild(1, 10)
+    now = 1_700_000_000.0
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            configs = GuildConfigCache(db)
+            cfg = await configs.update_guild_config(1, staff_role_id=100)
+            queue = DMQueue(db, RateLimiter(1.0))
+            dispatcher = RunDispatcher(queue, configs)
+            scheduler = Scheduler(_Bot(), db, dispatcher, time_func=lambda: now)
+            members = sorted(m.id for m in guild.get_role(100).members)
+
+            # A past run: 5 DMs three seconds apart, one of them failed.
+            run_id = await db.create_run(1, members[:5])
+            await db.conn.executemany(
+                "INSERT INTO send_log(guild_id, user_id, status, error, run_id, sent_at) VALUES (1,?,?,?,?,?)",
+                [
+                    (m, "failed" if i == 0 else "sent", None, run_id, f"2099-01-01 09:00:{i * 3:02d}")
+                    for i, m in enumerate(members[:5])
+                ],
+            )
+            await db.conn.execute("UPDATE dm_run SET status='done'")
+            # Guild 2 is due by cron within the run and had 4 recipients last time.
+            other = await db.create_run(2, [1, 2, 3, 4])
+            await db.conn.execute("UPDATE dm_run SET status='done', sent=4 WHERE id=?", (other,))
+            await db.conn.commit()
+            await db.set_next_fires([(2, now + 10)])
+            await db.mark_undeliverable(1, members[9], 50007, "cannot send messages to this user", 3600)
+            queue.dm_channels.update({members[0]: 1, members[1]: 2})
+
+            plan = await plan_run(dispatcher, guild, cfg, scheduler=scheduler)
+            assert (plan.recipients, plan.undeliverable, plan.reminded) == (9, 1, 0)
+            assert plan.api_calls == 9 + 7
+            assert (plan.seconds_per_dm, plan.history_runs) == (3.0, 1)
+            assert (plan.failure_rate, plan.expected_failures) == (0.2, 2)
+            assert plan.contending == {2: 4}
+            assert plan.duration == 9 * 3.0 + 4 * 1.0
+            assert len(await db.recent_runs(1)) == 1
+            assert not any(m.received for m in guild.get_role(100).members)
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_undeliverable_members_are_left_out_of_the_failure_rate(tmp_path):
+    guild = staff_guild(1, 10)
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            configs = GuildConfigCache(db)
+            cfg = await configs.update_guild_config(1, staff_role_id=100)
+            queue = DMQueue(db, RateLimiter(1.0))
+            dispatcher = RunDispatcher(queue, configs)
+            members = sorted(m.id for m in guild.get_role(100).members)
+
+            # A past run of 6 DMs two seconds apart: two members have DMs
+            # closed and are now undeliverable, one more failed once.
+            run_id = await db.create_run(1, members[:6])
+            await db.conn.executemany(
+                "INSERT INTO send_log(guild_id, user_id, status, error, run_id, sent_at) VALUES (1,?,?,?,?,?)",
+                [
+                    (m, "failed" if i < 3 else "sent", None, run_id, f"2099-01-01 09:00:{i * 2:02d}")
+                    for i, m in enumerate(members[:6])
+                ],
+            )
+            await db.conn.commit()
+            for user_id in members[:2]:
+                await db.mark_undeliverable(1, user_id, 50007, "cannot send messages to this user", 3600)
+
+            plan = await plan_run(dispatcher, guild, cfg)
+            assert (plan.recipients, plan.undeliverable) == (8, 2)
+            # Their send slots still count towards the spacing.
+            assert (plan.seconds_per_dm, plan.history_runs) == (2.0, 1)
+            assert (plan.failure_rate, plan.expected_failures) == (0.25, 2)
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -1,6 +1,9 @@
 import asyncio
 
+import pytest
+
 from dm_queue import RateLimiter
+from ratelimit import AdaptiveRateLimiter
 
 
 def test_rate_limiter_spacing(monkeypatch):
@@ -28,3 +31,42 @@ def test_rate_limiter_spacing(monkeypatch):
 
     asyncio.run(run())
     assert sleeps == [1.0]
+
+
+def test_adaptive_rate_limiter_backs_off_and_stays_below_the_ceiling():
+    now = 0.0
+    rl = AdaptiveRateLimiter(1.0, lambda: now, fastest=0.25, increase=0.1, ceiling_ttl=100.0)
+    for _ in range(10):
+        rl.on_success()
+    assert rl.rate == pytest.approx(2.0)
+
+    rl.on_429()
+    rl.on_429()  # the same burst only backs off once
+    assert rl.rate == pytest.approx(1.0)
+    assert rl.ceiling == pytest.approx(2.0)
+    for _ in range(50):
+        rl.on_success()
+    assert rl.rate == pytest.approx(1.8)
+
+    # Without another 429 the ceiling is forgotten, up to ``fastest``.
+    now = 101.0
+    for _ in range(50):
+        rl.on_success()
+    assert rl.rate == pytest.approx(4.0)
+
+
+def test_adaptive_rate_limiter_only_recovers_up_to_its_fastest_spacing():
+    now = 0.0
+    # Without ``fastest`` the limiter never speeds up past its interval.
+    rl = AdaptiveRateLimiter(2.0, lambda: now, increase=0.1)
+    assert rl.fastest == 2.0
+    for _ in range(100):
+        rl.on_success()
+    assert rl.min_interval == pytest.approx(2.0)
+
+    rl.on_429()
+    assert rl.min_interval == pytest.approx(4.0)
+    now = 1000.0
+    for _ in range(100):
+        rl.on_success()
+    assert rl.min_interval == pytest.approx(2.0)
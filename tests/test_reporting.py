@@ -0,0 +1,79 @@
+import asyncio
+
+import discord
+
+from fake_discord import VirtualClock
+from reporting import RunReporter
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, embed=None, file=None):
+        self.messages.append((embed, file))
+
+
+def test_reporter_batches_outcomes_into_few_messages():
+    clock = VirtualClock()
+    channel = FakeChannel()
+    reporter = RunReporter(channel, 7, flush_interval=60.0, csv_threshold=500, time_func=clock.time)
+
+    async def run():
+        for i in range(200):
+            clock.now += 1.0
+            await reporter.add(f"member{i} ({i})", "sent" if i % 10 else "failed", None if i % 10 else "closed")
+        await reporter.flush(final=True)
+
+    asyncio.run(run())
+    # 200 recipients at one per second: flushes at 60s, 120s, 180s and the end.
+    assert len(channel.messages) == 4
+    embed = channel.messages[-1][0]
+    assert embed.title == "Reminder Run #7 finished: 180 sent, 20 failed"
+    for embed, _ in channel.messages:
+        assert all(len(f.value) <= 1024 for f in embed.fields)
+
+
+def test_reporter_attaches_csv_for_large_batches():
+    channel = FakeChannel()
+    reporter = RunReporter(channel, 8, csv_threshold=10)
+
+    async def run():
+        for i in range(20):
+            await reporter.add(f"member{i}", "sent")
+        await reporter.flush(final=True)
+
+    asyncio.run(run())
+    assert len(channel.messages) == 1
+    assert channel.messages[0][1].filename == "run-8.csv"
+
+
+def test_rate_limited_log_channel_does_not_stop_the_run(tmp_path, monkeypatch):
+    from config import GuildConfig
+    from db import Database
+    from dm_queue import DMQueue, RateLimiter
+    from fake_discord import staff_guild, track_db_calls
+
+    class RateLimitedChannel:
+        async def send(self, embed=None, file=None):
+            raise discord.RateLimited(120.0)
+
+    clock = VirtualClock()
+    monkeypatch.setattr(asyncio, "sleep", clock.sleep)
+    guild = staff_guild(1, 3)
+    guild._channels[5] = RateLimitedChannel()
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        track_db_calls(db, clock)
+        try:
+            # 40s between DMs, so the report is also posted mid-run.
+            queue = DMQueue(db, RateLimiter(40.0, clock.time))
+            result = await queue.send(guild, GuildConfig(guild_id=1, staff_role_id=100, log_channel_id=5))
+            assert result[:3] == (3, 3, 0)
+            assert await db.unfinished_runs() == []
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, UTC
+
+import pytest
+
+from cache import GuildConfigCache
+from db import Database
+from dispatcher import RunDispatcher
+from dm_queue import DMQueue, RateLimiter
+from fake_discord import staff_guild
+from scheduler import Scheduler, spread_offset
+from triggers import next_fire_time
+
+
+def test_spread_offset_is_deterministic_and_bounded():
+    offsets = [spread_offset(guild_id, 600) for guild_id in range(1000, 1100)]
+    assert offsets == [spread_offset(guild_id, 600) for guild_id in range(1000, 1100)]
+    assert all(0 <= o < 600 for o in offsets)
+    assert len({int(o // 60) for o in offsets}) > 5
+    assert spread_offset(1234, 0) == 0.0
+
+
+def test_next_fire_time_is_shifted_by_the_offset():
+    now = datetime(2024, 1, 1, 9, 0, 30, tzinfo=UTC)
+    first = next_fire_time("0 9 * * *", now, 90, UTC)
+    assert first == datetime(2024, 1, 1, 9, 1, 30, tzinfo=UTC)
+    second = next_fire_time("0 9 * * *", first, 90, UTC)
+    assert second == datetime(2024, 1, 2, 9, 1, 30, tzinfo=UTC)
+
+
+class _Bot:
+    def __init__(self, *guilds) -> None:
+        self.guilds = {g.id: g for g in guilds}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+
+def test_cron_run_executes_once_across_processes(tmp_path):
+    path = str(tmp_path / "bot.db")
+    guild = staff_guild(1, 3)
+
+    async def run():
+        schedulers = []
+        for owner in ("host:1", "host:2"):
+            db = Database(path)
+            await db.connect()
+            configs = GuildConfigCache(db)
+            await configs.update_guild_config(1, staff_role_id=100)
+            queue = DMQueue(db, RateLimiter(0.0))
+            schedulers.append(Scheduler(_Bot(guild), db, RunDispatcher(queue, configs), owner=owner))
+
+        try:
+            await asyncio.gather(*(s._run_job(1) for s in schedulers))
+            assert [len(m.received) for m in guild.get_role(100).members] == [1, 1, 1]
+
+            # The owner may renew its own lease; the other process gets it once expired.
+            first, second = schedulers
+            assert await first.db.acquire_lease("maintenance", first.owner, 60)
+            assert not await second.db.acquire_lease("maintenance", second.owner, 60)
+            assert await first.db.acquire_lease("maintenance", first.owner, 0)
+            assert await second.db.acquire_lease("maintenance", second.owner, 60)
+        finally:
+            for s in schedulers:
+                await s.db.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("catch_up", ["once", "skip"])
+def test_stored_fire_times_and_missed_runs(catch_up):
+    guilds = [staff_guild(1, 2), staff_guild(2, 2)]
+    now = datetime(2024, 1, 3, 12, 0, tzinfo=UTC).timestamp()
+    tomorrow = datetime(2024, 1, 4, 9, 0, tzinfo=UTC).timestamp()
+
+    async def run():
+        db = Database(":memory:")
+        await db.connect()
+        try:
+            configs = GuildConfigCache(db)
+            dispatcher = RunDispatcher(DMQueue(db, RateLimiter(0.0)), configs)
+            scheduler = Scheduler(
+                _Bot(*guilds), db, dispatcher, catch_up=catch_up, batch_size=1, timezone=UTC, time_func=lambda: now
+            )
+            cfg = await configs.update_guild_config(1, staff_role_id=100, schedule_cron="0 9 * * *")
+            await scheduler.schedule_guild(1, cfg)
+            assert await db.next_fire_at() == tomorrow
+            # A cron set before fire times were stored gets one at startup.
+            await configs.update_guild_config(2, staff_role_id=100, schedule_cron="0 9 * * *")
+            await scheduler._schedule_missing()
+            assert await db.due_fires(tomorrow) == [(1, tomorrow), (2, tomorrow)]
+            # Both fires were missed during two days of downtime.
+            missed = datetime(2024, 1, 1, 9, 0, tzinfo=UTC).timestamp()
+            await db.set_next_fires([(1, missed), (2, missed)])
+            assert await scheduler.tick() == tomorrow
+            await asyncio.gather(*scheduler._runs)
+            expected = 1 if catch_up == "once" else 0
+            for guild in guilds:
+                assert [len(m.received) for m in guild.get_role(100).members] == [expected, expected]
+            assert await db.due_fires(now) == []
+            await scheduler.cancel_guild(1)
+            assert await db.due_fires(tomorrow) == [(2, tomorrow)]
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_loop_fires_due_guilds_when_woken():
+    guild = staff_guild(1, 2)
+    clock = [datetime(2024, 1, 3, 12, 0, tzinfo=UTC).timestamp()]
+
+    async def run():
+        db = Database(":memory:")
+        await db.connect()
+        try:
+            configs = GuildConfigCache(db)
+            dispatcher = RunDispatcher(DMQueue(db, RateLimiter(0.0)), configs)
+            scheduler = Scheduler(_Bot(guild), db, dispatcher, timezone=UTC, time_func=lambda: clock[0])
+            scheduler.start()
+            await asyncio.sleep(0.05)  # idle: nothing is scheduled
+            cfg = await configs.update_guild_config(1, staff_role_id=100, schedule_cron="0 9 * * *")
+            clock[0] = datetime(2024, 1, 4, 9, 0, tzinfo=UTC).timestamp()
+            await scheduler.schedule_guild(1, cfg)
+            # Due on the 5th; the loop sleeps until then, or until woken.
+            clock[0] = datetime(2024, 1, 5, 9, 0, tzinfo=UTC).timestamp()
+            scheduler._wake.set()
+            members = guild.get_role(100).members
+            for _ in range(100):
+                if all(m.received for m in members):
+                    break
+                await asyncio.sleep(0.01)
+            assert [len(m.received) for m in members] == [1, 1]
+            scheduler.shutdown()
+        finally:
+            await db.close()
+
+    asyncio.run(run())
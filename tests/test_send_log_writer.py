@@ -0,0 +1,157 @@
+import asyncio
+
+import aiosqlite
+import pytest
+
+from db import Database
+
+
+async def _count(db):
+    async with db.conn.execute("SELECT COUNT(*) FROM send_log") as cur:
+        (n,) = await cur.fetchone()
+    return n
+
+
+def test_send_log_flushes_at_size_threshold(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        db.send_log.max_rows = 3
+        await db.connect()
+        await db.log_send(1, 10, "sent", None)
+        await db.log_send(1, 11, "failed", "closed")
+        assert await _count(db) == 0
+        await db.log_send(1, 12, "sent", None)
+        assert await _count(db) == 3
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_send_log_flushes_on_close(tmp_path):
+    path = str(tmp_path / "bot.db")
+
+    async def run():
+        db = Database(path)
+        await db.connect()
+        await db.log_send(1, 10, "sent", None)
+        await db.close()
+        db = Database(path)
+        await db.connect()
+        assert await _count(db) == 1
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_rollups_track_sends_and_survive_compaction(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        run_id = await db.create_run(1, [10, 11, 12])
+        await db.log_send(1, 10, "sent", None, run_id)
+        await db.log_send(1, 11, "failed", "closed", run_id)
+        await db.log_send(1, 12, "sent", None, run_id)
+        await db.log_send(2, 20, "sent", None)
+        await db.flush_send_log()
+        await db.finish_run(run_id)
+
+        assert await db.send_stats(1) == (2, 1)
+        assert await db.send_stats(1, days=1) == (2, 1)
+        assert await db.send_stats(2) == (1, 0)
+        [(rid, status, _, sent, failed, skipped)] = await db.recent_runs(1)
+        assert (rid, status, sent, failed, skipped) == (run_id, "done", 2, 1, 0)
+
+        assert await db.compact_send_log("9999-12-31") == 4
+        assert await _count(db) == 0
+        assert await db.run_counts(run_id) == {}
+        assert await db.send_stats(1) == (2, 1)
+        assert (await db.recent_runs(1))[0][3:] == (2, 1, 0)
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_rollups_are_backfilled_from_existing_history(tmp_path):
+    path = str(tmp_path / "bot.db")
+
+    async def run():
+        db = Database(path)
+        await db.connect()
+        await db.log_send(1, 10, "sent", None)
+        await db.log_send(1, 11, "failed", "closed")
+        await db.flush_send_log()
+        await db.conn.execute("DROP TABLE send_stats_daily")
+        await db.conn.commit()
+        await db.close()
+        db = Database(path)
+        await db.connect()
+        assert await db.send_stats(1) == (1, 1)
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_rolled_back_and_retried_once(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            run_id = await db.create_run(1, [10])
+            await db.log_send(1, 10, "sent", None, run_id)
+            executemany = db.conn.executemany
+
+            async def failing(sql, params):
+                if sql.startswith("UPDATE dm_job"):
+                    raise aiosqlite.OperationalError("disk I/O error")
+                return await executemany(sql, params)
+
+            # The INSERT into send_log runs before the failure.
+            db.conn.executemany = failing
+            with pytest.raises(aiosqlite.OperationalError):
+                await db.flush_send_log()
+            del db.conn.executemany
+            assert len(db.send_log) == 1
+            await db.flush_send_log()
+            assert await _count(db) == 1
+            assert await db.send_stats(1) == (1, 0)
+            assert await db.run_counts(run_id) == {"sent": 1}
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_during_a_run_does_not_stop_it(tmp_path):
+    from config import GuildConfig
+    from dm_queue import DMQueue, RateLimiter
+    from fake_discord import staff_guild
+
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        db.send_log.max_rows = 2
+        await db.connect()
+        try:
+            guild = staff_guild(1, 6)
+            executemany = db.conn.executemany
+            failures = []
+
+            async def fails_once(sql, params):
+                if sql.startswith("INSERT INTO send_log") and not failures:
+                    failures.append(sql)
+                    raise aiosqlite.OperationalError("database is locked")
+                return await executemany(sql, params)
+
+            db.conn.executemany = fails_once
+            assert (await DMQueue(db, RateLimiter(0.0)).send(guild, GuildConfig(guild_id=1, staff_role_id=100)))[:3] == (
+                6,
+                6,
+                0,
+            )
+            assert failures
+            assert [len(m.received) for m in guild.get_role(100).members] == [1] * 6
+            assert await _count(db) == 6
+            assert await db.unfinished_runs() == []
+        finally:
+            await db.close()
+
+    asyncio.run(run())
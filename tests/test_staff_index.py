@@ -0,0 +1,55 @@
+import asyncio
+
+from fake_discord import FakeMember, staff_guild
+from staff_index import StaffIndex
+
+
+def test_staff_index_tracks_member_events():
+    guild = staff_guild(1, 3)
+    role = guild.get_role(100)
+    index = StaffIndex()
+    assert index.count(guild, 100) == 3
+
+    newcomer = FakeMember(99, roles=[role])
+    newcomer.guild = guild
+    guild._members[99] = newcomer
+    index.on_member_update(newcomer)
+    assert index.count(guild, 100) == 4
+
+    demoted = role.members[0]
+    demoted.roles = []
+    index.on_member_update(demoted)
+    index.on_member_remove(1, role.members[1].id)
+    assert index.member_ids(guild, 100) == [role.members[2].id, 99]
+    assert [m.id for m in index.members(guild, 100)] == [role.members[2].id, 99]
+
+    bot_member = FakeMember(98, bot=True, roles=[role])
+    bot_member.guild = guild
+    index.on_member_update(bot_member)
+    assert index.count(guild, 100) == 2
+
+    index.on_role_delete(role)
+    assert len(index) == 0
+
+
+def test_staff_only_index_loads_members_from_the_gateway():
+    guild = staff_guild(1, 3)
+    outsider = FakeMember(99)
+    outsider.guild = guild
+    guild._members[99] = outsider
+    index = StaffIndex(chunk=True)
+    assert index.count(guild, 100) == 0
+
+    asyncio.run(index.refresh(guild, 100))
+    staff_ids = sorted(m.id for m in guild.get_role(100).members)
+    # Nothing is cached by discord.py; the index holds the staff members.
+    guild._members.clear()
+    assert sorted(m.id for m in index.members(guild, 100)) == staff_ids
+    assert index.get_member(guild, staff_ids[0]).id == staff_ids[0]
+    assert index.get_member(guild, 99) is None
+    assert index.size == 3
+
+    asyncio.run(index.refresh(guild, 100))
+    assert index.count(guild, 100) == 3
+    asyncio.run(index.refresh(guild, 100, force=True))
+    assert index.count(guild, 100) == 0
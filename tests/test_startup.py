@@ -0,0 +1,56 @@
+import asyncio
+
+import discord
+from discord import app_commands
+
+from db import Database
+from startup import StartupTimer, sync_commands
+
+
+def _tree():
+    tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.none()))
+    tree.synced = 0
+
+    async def sync():
+        tree.synced += 1
+
+    tree.sync = sync
+
+    @tree.command(name="ping", description="Pong")
+    async def ping(inter: discord.Interaction) -> None: ...
+
+    return tree
+
+
+def test_command_tree_is_synced_only_when_it_changes(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.connect()
+        try:
+            tree = _tree()
+            assert await sync_commands(tree, db, 1)
+            assert not await sync_commands(tree, db, 1)
+            # A restart with the same commands finds the persisted hash.
+            assert not await sync_commands(_tree(), db, 1)
+            assert tree.synced == 1
+            # Another application has its own hash.
+            assert await sync_commands(tree, db, 2)
+
+            @tree.command(name="pong", description="Ping")
+            async def pong(inter: discord.Interaction) -> None: ...
+
+            assert await sync_commands(tree, db, 1)
+            assert tree.synced == 3
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+def test_startup_timer_reports_phases_in_order():
+    timer = StartupTimer()
+    timer.lap("import")
+    timer.skip("command sync")
+    report = timer.report()
+    assert report.startswith("Started in ")
+    assert report.index("import") < report.index("command sync (skipped)")
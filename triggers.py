@@ -0,0 +1,32 @@
+"""Cron fire times; imported by ``scheduler`` only once a guild has a cron."""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, tzinfo, UTC
+from functools import lru_cache
+
+from apscheduler.triggers.cron import CronTrigger
+
+
+@lru_cache(maxsize=1024)
+def cron_trigger(expr: str, timezone: tzinfo | None = None) -> CronTrigger:
+    """Parsed ``expr``; guilds sharing an expression share one trigger.
+
+    Raises ``ValueError`` for an invalid expression.
+    """
+    return CronTrigger.from_crontab(expr, timezone=timezone)
+
+
+@lru_cache(maxsize=4096)
+def _first_fire_from(expr: str, timezone: tzinfo | None, minute: int) -> datetime | None:
+    return cron_trigger(expr, timezone).get_next_fire_time(None, datetime.fromtimestamp(minute * 60, UTC))
+
+
+def next_fire_time(expr: str, after: datetime, offset: float = 0.0, timezone: tzinfo | None = None) -> datetime | None:
+    """First fire time of ``expr``, shifted by ``offset`` seconds, strictly after ``after``.
+
+    Crontab fire times fall on whole minutes, so the result is cached per
+    minute and guilds due together mostly share one computation.
+    """
+    minute = int((after.timestamp() - offset) // 60) + 1
+    fire_time = _first_fire_from(expr, timezone, minute)
+    return fire_time + timedelta(seconds=offset) if fire_time else None